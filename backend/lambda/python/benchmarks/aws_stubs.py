@@ -0,0 +1,122 @@
+"""Offline stand-ins for the AWS APIs the handlers call during a benchmark
+
+install() patches botocore's API dispatch the moment botocore.client is
+imported, so handlers that import boto3 lazily are measured with their real
+import cost and no request ever leaves the process.
+"""
+import base64
+import importlib.abc
+import importlib.machinery
+import io
+import json
+import sys
+from typing import Any, Dict
+
+STUB_ANSWER = 'Benchmark stub answer from Bedrock.'
+
+# 1x1 transparent PNG
+STUB_PNG = base64.b64decode(
+    'iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAQAAAC1HAwCAAAAC0lEQVR42mNkYAAAAAYAAjCB0C8AAAAASUVORK5CYII='
+)
+
+
+def _anthropic_message() -> Dict[str, Any]:
+    return {
+        'id': 'msg_benchmark',
+        'type': 'message',
+        'role': 'assistant',
+        'model': 'claude-benchmark',
+        'content': [{'type': 'text', 'text': STUB_ANSWER}],
+        'stop_reason': 'end_turn',
+        'stop_sequence': None,
+        'usage': {'input_tokens': 10, 'output_tokens': 8}
+    }
+
+
+def _anthropic_stream():
+    events = [
+        {'type': 'message_start', 'message': {**_anthropic_message(), 'content': []}},
+        {'type': 'content_block_start', 'index': 0, 'content_block': {'type': 'text', 'text': ''}},
+    ]
+    for word in STUB_ANSWER.split(' '):
+        events.append({'type': 'content_block_delta', 'index': 0, 'delta': {'type': 'text_delta', 'text': word + ' '}})
+    events += [
+        {'type': 'content_block_stop', 'index': 0},
+        {'type': 'message_delta', 'delta': {'stop_reason': 'end_turn'}, 'usage': {'output_tokens': 8}},
+        {'type': 'message_stop', 'amazon-bedrock-invocationMetrics': {
+            'inputTokenCount': 10, 'outputTokenCount': 8, 'invocationLatency': 1, 'firstByteLatency': 1
+        }},
+    ]
+    return [{'chunk': {'bytes': json.dumps(event).encode('utf-8')}} for event in events]
+
+
+def stub_response(operation_name: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    """Canned response for one botocore operation"""
+    from botocore.response import StreamingBody
+
+    def body(data: bytes) -> StreamingBody:
+        return StreamingBody(io.BytesIO(data), len(data))
+
+    if operation_name == 'InvokeModel':
+        return {'body': body(json.dumps(_anthropic_message()).encode('utf-8')), 'contentType': 'application/json'}
+    if operation_name == 'InvokeModelWithResponseStream':
+        return {'body': _anthropic_stream(), 'contentType': 'application/json'}
+    if operation_name == 'Converse':
+        return {
+            'output': {'message': {'role': 'assistant', 'content': [{'text': STUB_ANSWER}]}},
+            'stopReason': 'end_turn',
+            'usage': {'inputTokens': 10, 'outputTokens': 8, 'totalTokens': 18},
+            'metrics': {'latencyMs': 1}
+        }
+    if operation_name == 'HeadObject':
+        return {
+            'ContentType': 'image/png',
+            'ContentLength': len(STUB_PNG),
+            'ETag': '"d41d8cd98f00b204e9800998ecf8427e"',
+            'Metadata': {'userid': 'benchmark-user', 'originalname': 'chart.png', 'fileid': 'file-1'}
+        }
+    if operation_name == 'GetObject':
+        return {'Body': body(STUB_PNG), 'ContentLength': len(STUB_PNG), 'ContentType': 'image/png'}
+    if operation_name == 'Retrieve':
+        return {'retrievalResults': []}
+    return {}
+
+
+def _patch_botocore_client(module) -> None:
+    def _make_api_call(self, operation_name, api_params):
+        return stub_response(operation_name, api_params)
+
+    module.BaseClient._make_api_call = _make_api_call
+
+
+class _PatchOnImport(importlib.abc.MetaPathFinder):
+    """Run a patch right after a given module finishes importing"""
+
+    def __init__(self, name: str, patch):
+        self.name = name
+        self.patch = patch
+
+    def find_spec(self, fullname, path, target=None):
+        if fullname != self.name:
+            return None
+        spec = importlib.machinery.PathFinder.find_spec(fullname, path)
+        if spec is None or spec.loader is None:
+            return None
+        loader = spec.loader
+        original_exec = loader.exec_module
+        patch = self.patch
+
+        def exec_module(module):
+            original_exec(module)
+            patch(module)
+
+        loader.exec_module = exec_module
+        return spec
+
+
+def install() -> None:
+    """Route every botocore API call to stub_response"""
+    if 'botocore.client' in sys.modules:
+        _patch_botocore_client(sys.modules['botocore.client'])
+        return
+    sys.meta_path.insert(0, _PatchOnImport('botocore.client', _patch_botocore_client))
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""Cold-start benchmark for the Python Lambda handlers
+
+Every sample runs in a fresh interpreter that imports one handler module with
+all AWS calls stubbed (see aws_stubs.py). Requests carry an unsigned token
+that the real development-mode validator accepts (STAGE=dev).
+It records import (init phase) time, the latency of the first and of a second,
+warm invocation, and peak RSS. Results are written as JSON so runs on
+different commits can be compared:
+
+    python benchmarks/cold_start.py --runs 5 --output before.json
+    python benchmarks/cold_start.py --runs 5 --output after.json --compare before.json
+"""
+import argparse
+import base64
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Any, Dict, List
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.normpath(os.path.join(BENCH_DIR, '..', 'src'))
+SERVERLESS_DIR = os.path.normpath(os.path.join(BENCH_DIR, '..', '..', '..', 'serverless'))
+
+
+def _b64url(data: Dict[str, Any]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(data).encode('utf-8')).rstrip(b'=').decode('ascii')
+
+
+# Built with the standard library so that encoding it does not import python-jose
+# ahead of the handler; development mode checks only the claims, not the signature
+BENCHMARK_TOKEN = '.'.join([
+    _b64url({'alg': 'HS256', 'typ': 'JWT'}),
+    _b64url({'sub': 'benchmark-user', 'cognito:groups': [], 'exp': int(time.time()) + 24 * 3600}),
+    _b64url({'sig': 'benchmark'})
+])
+AUTH_HEADERS = {'Authorization': f'Bearer {BENCHMARK_TOKEN}'}
+CHAT_BODY = json.dumps({'message': 'What is our travel expense policy?', 'sessionId': 'bench-session', 'history': []})
+
+HANDLERS: Dict[str, Dict[str, Any]] = {
+    'chat_agent': {
+        'path': SRC_DIR, 'module': 'chat_agent', 'handler': 'handler',
+        'event': {'httpMethod': 'POST', 'headers': AUTH_HEADERS, 'body': CHAT_BODY}
+    },
+    'chat_stream': {
+        'path': SRC_DIR, 'module': 'chat_stream', 'handler': 'lambda_handler',
+        'event': {'httpMethod': 'POST', 'headers': AUTH_HEADERS, 'body': CHAT_BODY}
+    },
+    'file_processor': {
+        'path': SRC_DIR, 'module': 'file_processor', 'handler': 'handler',
+        'event': {'Records': [{
+            'eventSource': 'aws:s3',
+            's3': {'bucket': {'name': 'benchmark-bucket'}, 'object': {'key': 'uploads/benchmark-user/chart.png'}}
+        }]}
+    },
+    'simple_chat_agent': {
+        'path': SRC_DIR, 'module': 'simple_chat_agent', 'handler': 'handler',
+        'event': {'httpMethod': 'POST', 'headers': AUTH_HEADERS, 'body': CHAT_BODY}
+    },
+    'simple_chat_agent_serverless': {
+        'path': SERVERLESS_DIR, 'module': 'simple_chat_agent', 'handler': 'handler',
+        'event': {'httpMethod': 'POST', 'headers': AUTH_HEADERS, 'body': CHAT_BODY}
+    },
+}
+
+BENCH_ENV = {
+    'AWS_DEFAULT_REGION': 'ap-northeast-1',
+    'AWS_REGION': 'ap-northeast-1',
+    'AWS_ACCESS_KEY_ID': 'benchmark',
+    'AWS_SECRET_ACCESS_KEY': 'benchmark',
+    'S3_BUCKET': 'benchmark-bucket',
+    'STAGE': 'dev',
+    # The second call repeats the first; keep it on the warm model path
+    'RESPONSE_CACHE_ENABLED': 'false',
+}
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+def run_child(name: str) -> Dict[str, Any]:
+    """Measure one cold start of a handler inside the current (fresh) interpreter"""
+    spec = HANDLERS[name]
+    sys.path.insert(0, BENCH_DIR)
+    import aws_stubs
+    aws_stubs.install()
+    sys.path.insert(0, spec['path'])
+
+    baseline_rss = _peak_rss_mb()
+    start = time.perf_counter()
+    module = __import__(spec['module'])
+    import_ms = (time.perf_counter() - start) * 1000
+    import_rss = _peak_rss_mb()
+
+    handler = getattr(module, spec['handler'])
+    timings = []
+    statuses = []
+    for i in range(2):
+        context = SimpleNamespace(
+            aws_request_id=f'bench-request-{i}',
+            function_name=name,
+            memory_limit_in_mb=1024,
+            get_remaining_time_in_millis=lambda: 300000
+        )
+        start = time.perf_counter()
+        response = handler(json.loads(json.dumps(spec['event'])), context)
+        timings.append((time.perf_counter() - start) * 1000)
+        statuses.append(response.get('statusCode') if isinstance(response, dict) else None)
+
+    return {
+        'import_ms': import_ms,
+        'first_invoke_ms': timings[0],
+        'warm_invoke_ms': timings[1],
+        'import_rss_mb': import_rss - baseline_rss,
+        'peak_rss_mb': _peak_rss_mb(),
+        'status_codes': statuses
+    }
+
+
+def sample(name: str) -> Dict[str, Any]:
+    """Spawn a fresh interpreter for one cold-start sample"""
+    env = {k: v for k, v in os.environ.items() if not k.startswith('AWS_')}
+    env.update(BENCH_ENV)
+    proc = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--child', name],
+        env=env, capture_output=True, text=True
+    )
+    lines = proc.stdout.strip().splitlines()
+    if proc.returncode != 0 or not lines:
+        return {'error': (proc.stderr.strip().splitlines() or ['unknown error'])[-1]}
+    return json.loads(lines[-1])
+
+
+def summarize(samples: List[Dict[str, Any]]) -> Dict[str, Any]:
+    ok = [s for s in samples if 'error' not in s]
+    if not ok:
+        return {'error': samples[0]['error'] if samples else 'no samples'}
+    summary: Dict[str, Any] = {'samples': len(ok), 'status_codes': ok[0]['status_codes']}
+    for metric in ('import_ms', 'first_invoke_ms', 'warm_invoke_ms', 'import_rss_mb', 'peak_rss_mb'):
+        values = [s[metric] for s in ok]
+        summary[metric] = {
+            'median': round(statistics.median(values), 2),
+            'min': round(min(values), 2),
+            'max': round(max(values), 2)
+        }
+    return summary
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCH_DIR, capture_output=True, text=True
+        ).stdout.strip() or 'unknown'
+    except OSError:
+        return 'unknown'
+
+
+def print_report(report: Dict[str, Any], baseline: Dict[str, Any] = None) -> None:
+    print(f"commit {report['commit']}  python {report['python']}  runs {report['runs']}")
+    header = f"{'handler':<30}{'import ms':>12}{'1st call ms':>14}{'warm ms':>10}{'peak RSS MB':>14}"
+    print(header)
+    for name, result in report['handlers'].items():
+        if 'error' in result:
+            print(f"{name:<30}  error: {result['error']}")
+            continue
+        row = f"{name:<30}"
+        for metric, width in (('import_ms', 12), ('first_invoke_ms', 14), ('warm_invoke_ms', 10), ('peak_rss_mb', 14)):
+            row += f"{result[metric]['median']:>{width}.1f}"
+        print(row)
+        before = (baseline or {}).get('handlers', {}).get(name)
+        if before and 'error' not in before:
+            delta = f"{'':<30}"
+            for metric, width in (('import_ms', 12), ('first_invoke_ms', 14), ('warm_invoke_ms', 10), ('peak_rss_mb', 14)):
+                delta += f"{result[metric]['median'] - before[metric]['median']:>+{width}.1f}"
+            print(delta + f"  vs {baseline.get('commit', 'baseline')}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('handlers', nargs='*', default=list(HANDLERS))
+    parser.add_argument('--runs', type=int, default=5, help='fresh interpreters per handler')
+    parser.add_argument('--output', help='write the JSON report to this file')
+    parser.add_argument('--compare', help='JSON report from an earlier run to diff against')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_child(args.child)))
+        return 0
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': datetime.utcnow().isoformat() + 'Z',
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'runs': args.runs,
+        'handlers': {name: summarize([sample(name) for _ in range(args.runs)]) for name in args.handlers}
+    }
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
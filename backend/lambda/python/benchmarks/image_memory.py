@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""Peak memory of the image intake path, per image
+
+Each case runs in a fresh interpreter: it builds a synthetic image, wraps it
+the way a request would deliver it (data URL or S3 object), and runs
+image_intake.load_image on it. The reported figure is the growth of peak RSS
+across that call, so it covers decoding, resizing and encoding but not
+building the input itself.
+
+    python benchmarks/image_memory.py
+    python benchmarks/image_memory.py --json
+"""
+import argparse
+import base64
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+from types import SimpleNamespace
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.normpath(os.path.join(BENCH_DIR, '..', 'src'))
+
+# name: (source, width, height, format)
+CASES = {
+    'data_url_small_png': ('data_url', 800, 600, 'PNG'),
+    'data_url_12mp_jpeg': ('data_url', 4032, 3024, 'JPEG'),
+    's3_12mp_jpeg': ('s3', 4032, 3024, 'JPEG'),
+    # Noise PNG of this size is far over IMAGE_MAX_INPUT_BYTES: rejected before download
+    's3_24mp_png_oversized': ('s3', 6000, 4000, 'PNG'),
+}
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+def run_child(name: str) -> dict:
+    source, width, height, image_format = CASES[name]
+    sys.path.insert(0, SRC_DIR)
+    from PIL import Image
+    import image_intake
+
+    buffer = io.BytesIO()
+    if image_format == 'PNG' and width * height < 1000000:
+        # Flat colours, like a chart or screenshot
+        Image.linear_gradient('L').resize((width, height)).convert('RGB').save(buffer, image_format)
+    else:
+        # Noise compresses poorly, like a real photo
+        Image.effect_noise((width, height), 40).convert('RGB').save(buffer, image_format)
+    data = buffer.getvalue()
+    del buffer
+
+    if source == 'data_url':
+        image_input = f"data:image/{image_format.lower()};base64,{base64.b64encode(data).decode('ascii')}"
+        del data
+    else:
+        image_input = f"s3://benchmark-bucket/uploads/user/photo.{image_format.lower()}"
+        image_intake.s3_client = SimpleNamespace(
+            head_object=lambda Bucket, Key: {'ContentLength': len(data)},
+            get_object=lambda Bucket, Key: {'Body': io.BytesIO(data)}
+        )
+
+    input_mb = round(len(image_input if source == 'data_url' else data) / (1024 * 1024), 2)
+    before = _peak_rss_mb()
+    try:
+        image = image_intake.load_image(image_input)
+        outcome = {'output_mb': round(image.size / (1024 * 1024), 2), 'result': 'passthrough' if image.passthrough else 'processed'}
+    except image_intake.ImageIntakeError:
+        outcome = {'output_mb': 0.0, 'result': 'rejected'}
+    after = _peak_rss_mb()
+    return {
+        'input_mb': input_mb,
+        **outcome,
+        'peak_rss_growth_mb': round(after - before, 1),
+        'peak_rss_mb': round(after, 1),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('cases', nargs='*', default=list(CASES))
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_child(args.child)))
+        return 0
+
+    results = {}
+    for name in args.cases:
+        proc = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', name],
+                              capture_output=True, text=True)
+        lines = proc.stdout.strip().splitlines()
+        if proc.returncode != 0 or not lines:
+            results[name] = {'error': (proc.stderr.strip().splitlines() or ['unknown error'])[-1]}
+        else:
+            results[name] = json.loads(lines[-1])
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return 0
+
+    print(f"{'case':<26}{'input MB':>10}{'output MB':>11}{'result':>13}{'peak +MB':>10}{'peak MB':>9}")
+    for name, result in results.items():
+        if 'error' in result:
+            print(f"{name:<26}  error: {result['error']}")
+            continue
+        print(f"{name:<26}{result['input_mb']:>10.2f}{result['output_mb']:>11.2f}{result['result']:>13}"
+              f"{result['peak_rss_growth_mb']:>10.1f}{result['peak_rss_mb']:>9.1f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""Report per-module import time of the Python Lambda handlers
+
+Each handler module is imported in a fresh interpreter with `-X importtime`
+so results reflect a cold start. Usage:
+
+    python scripts/import_time_report.py                      # all handlers
+    python scripts/import_time_report.py chat_stream --top 20
+    python scripts/import_time_report.py --budget-ms 150      # exit 1 if exceeded
+    python scripts/import_time_report.py --json
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+from typing import Dict, List
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+HANDLER_MODULES = ['chat_agent', 'chat_stream', 'simple_chat_agent', 'file_processor', 'auth_validator']
+
+_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)$')
+
+
+def measure(module: str) -> Dict:
+    """Import module in a fresh interpreter and parse the -X importtime output"""
+    env = dict(os.environ, PYTHONPATH=SRC_DIR, AWS_DEFAULT_REGION=os.environ.get('AWS_DEFAULT_REGION', 'ap-northeast-1'))
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=SRC_DIR, env=env, capture_output=True, text=True
+    )
+    if proc.returncode != 0:
+        return {'module': module, 'error': proc.stderr.strip().splitlines()[-1:]}
+
+    # Children are printed before their parent, so the handler's subtree is
+    # everything between the previous top-level import and the handler itself
+    # (interpreter startup imports such as site are excluded)
+    imports: List[Dict] = []
+    total = 0.0
+    for line in proc.stderr.splitlines():
+        match = _LINE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, name = match.groups()
+        depth = (len(indent) - 1) // 2
+        if depth == 0:
+            if name == module:
+                total = int(cumulative_us) / 1000
+                break
+            imports = []
+            continue
+        imports.append({
+            'name': name,
+            'depth': depth,
+            'self_ms': int(self_us) / 1000,
+            'cumulative_ms': int(cumulative_us) / 1000
+        })
+
+    return {'module': module, 'total_ms': total, 'imports': imports}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('modules', nargs='*', default=HANDLER_MODULES)
+    parser.add_argument('--top', type=int, default=10, help='slowest imports to list per module')
+    parser.add_argument('--budget-ms', type=float, help='fail when any module exceeds this total')
+    parser.add_argument('--json', action='store_true', help='print the full report as JSON')
+    args = parser.parse_args()
+
+    results = [measure(module) for module in args.modules]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for result in results:
+            if 'error' in result:
+                print(f"{result['module']}: import failed: {result['error']}")
+                continue
+            print(f"{result['module']}: {result['total_ms']:.1f} ms")
+            # Direct dependencies of the handler module, slowest first
+            direct = [i for i in result['imports'] if i['depth'] == 1]
+            for item in sorted(direct, key=lambda i: i['cumulative_ms'], reverse=True)[:args.top]:
+                print(f"  {item['cumulative_ms']:8.1f} ms  {item['name']}")
+
+    if args.budget_ms is not None:
+        over = [r for r in results if 'error' in r or r['total_ms'] > args.budget_ms]
+        for result in over:
+            print(f"Over budget ({args.budget_ms} ms): {result['module']}", file=sys.stderr)
+        return 1 if over else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
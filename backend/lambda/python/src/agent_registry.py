@@ -0,0 +1,89 @@
+import os
+import time
+import logging
+import threading
+from typing import Any, Callable, Dict, Hashable, Tuple, TypeVar
+
+logger = logging.getLogger()
+
+T = TypeVar('T')
+
+# Objects built once per warm container, keyed by (name, key)
+_registry: Dict[Tuple[str, Hashable], Any] = {}
+_build_ms: Dict[Tuple[str, Hashable], float] = {}
+_stats: Dict[str, Dict[str, float]] = {}
+_lock = threading.Lock()
+
+
+def tool_config_key() -> Tuple[str, ...]:
+    """Key for the environment settings that change which tools an agent gets"""
+    return (
+        os.environ.get('KNOWLEDGE_BASE_ID', ''),
+        os.environ.get('S3_BUCKET', ''),
+    )
+
+
+def model_config_key(model: Any) -> Tuple[Any, ...]:
+    """Key for the settings that change what a chat model does
+
+    Built from the configuration rather than id(model), since an id can be
+    reused by a new object once the old one is collected.
+    """
+    return (
+        type(model).__name__,
+        getattr(model, 'model_id', None),
+        getattr(model, 'region_name', None),
+        bool(getattr(model, 'streaming', False)),
+    )
+
+
+def _record(name: str, field: str, amount: float = 1) -> None:
+    counters = _stats.setdefault(name, {'hits': 0, 'misses': 0, 'saved_ms': 0.0})
+    counters[field] += amount
+
+
+def get_or_create(name: str, key: Hashable, factory: Callable[[], T]) -> T:
+    """Return the cached object for (name, key), building it with factory on a miss"""
+    entry_key = (name, key)
+    obj = _registry.get(entry_key)
+    if obj is not None:
+        with _lock:
+            _record(name, 'hits')
+            _record(name, 'saved_ms', _build_ms.get(entry_key, 0.0))
+        return obj
+
+    with _lock:
+        obj = _registry.get(entry_key)
+        if obj is not None:
+            _record(name, 'hits')
+            return obj
+
+        start = time.perf_counter()
+        obj = factory()
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        _registry[entry_key] = obj
+        _build_ms[entry_key] = elapsed_ms
+        _record(name, 'misses')
+        logger.info(f"Agent registry built {name} in {elapsed_ms:.1f}ms")
+        return obj
+
+
+def get_stats() -> Dict[str, Any]:
+    """Hit/miss counters per object name, plus the build time saved by hits"""
+    with _lock:
+        return {
+            'entries': len(_registry),
+            'hits': sum(int(c['hits']) for c in _stats.values()),
+            'misses': sum(int(c['misses']) for c in _stats.values()),
+            'saved_ms': round(sum(c['saved_ms'] for c in _stats.values()), 1),
+            'by_name': {name: dict(c, saved_ms=round(c['saved_ms'], 1)) for name, c in _stats.items()}
+        }
+
+
+def clear() -> None:
+    """Drop every cached object and counter"""
+    with _lock:
+        _registry.clear()
+        _build_ms.clear()
+        _stats.clear()
@@ -1,19 +1,131 @@
 import json
 import os
+import time
+import hashlib
 import logging
-import requests
-from typing import Dict, Optional, Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional, Any
 from datetime import datetime
-from jose import jwt, JWTError
-import boto3
+from lazy import LazyModule
+from ttl_cache import SingleFlight, TTLCache
+
+# python-jose pulls in the cryptography backend; requests is only needed
+# when the JWKS cache is cold. Neither is needed for OPTIONS preflights.
+# `import jose` does not load its jwt/jwk submodules, so each gets its own proxy
+jose = LazyModule('jose')
+jwt = LazyModule('jose.jwt')
+jwk = LazyModule('jose.jwk')
+requests = LazyModule('requests')
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-# Global cache for Cognito public keys
-_jwks_cache: Optional[Dict] = None
-_cache_timestamp: Optional[float] = None
-CACHE_TTL = 3600  # 1 hour
+# Cognito public keys: fresh for CACHE_TTL, then served stale while a background refresh runs
+CACHE_TTL = int(os.environ.get('JWKS_CACHE_TTL_SECONDS', '3600'))  # 1 hour
+# Past this age a request waits for the refresh (and still falls back to the old keys if it fails)
+JWKS_MAX_STALE_SECONDS = int(os.environ.get('JWKS_MAX_STALE_SECONDS', '86400'))
+# At most one fetch per interval, however many tokens with unknown kids arrive
+JWKS_MIN_REFRESH_SECONDS = float(os.environ.get('JWKS_MIN_REFRESH_SECONDS', '10'))
+
+_jwks_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='jwks-refresh')
+
+# Verified tokens are reused until shortly before they expire, skipping signature verification
+TOKEN_CACHE_MAX_ENTRIES = int(os.environ.get('TOKEN_CACHE_MAX_ENTRIES', '1024'))
+TOKEN_CACHE_EXP_MARGIN_SECONDS = int(os.environ.get('TOKEN_CACHE_EXP_MARGIN_SECONDS', '30'))
+# Rejected tokens are remembered briefly, so a flood of bad tokens costs one verification each
+TOKEN_NEGATIVE_CACHE_SECONDS = float(os.environ.get('TOKEN_NEGATIVE_CACHE_SECONDS', '10'))
+TOKEN_NEGATIVE_CACHE_MAX_ENTRIES = int(os.environ.get('TOKEN_NEGATIVE_CACHE_MAX_ENTRIES', '1024'))
+
+class JWKSUnavailableError(Exception):
+    """The signing keys could not be fetched; says nothing about the token itself"""
+
+class UnknownKeyError(Exception):
+    """No signing key for the token's kid (yet); it may appear at the next JWKS refresh"""
+
+class JWKSCache:
+    """Cognito signing keys, parsed once into key objects and indexed by kid
+
+    A token signed with an unknown kid (Cognito rotated its keys) triggers
+    an immediate refresh, rate-limited to one fetch per
+    JWKS_MIN_REFRESH_SECONDS. Concurrent refreshes share one fetch.
+    """
+    
+    def __init__(self, url: str, fresh_seconds: float = CACHE_TTL,
+                 max_stale_seconds: float = JWKS_MAX_STALE_SECONDS,
+                 min_refresh_seconds: float = JWKS_MIN_REFRESH_SECONDS,
+                 fetch: Optional[Callable[[str], Dict]] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self.url = url
+        self.fresh_seconds = fresh_seconds
+        self.max_stale_seconds = max_stale_seconds
+        self.min_refresh_seconds = min_refresh_seconds
+        self.fetch = fetch or self._fetch
+        self.clock = clock
+        self.jwks: Optional[Dict] = None
+        self.keys: Dict[str, Any] = {}
+        self.fetched_at: Optional[float] = None
+        self.attempted_at: Optional[float] = None
+        self._flight = SingleFlight()
+    
+    @staticmethod
+    def _fetch(url: str) -> Dict:
+        response = requests.get(url, timeout=10)
+        response.raise_for_status()
+        return response.json()
+    
+    def _load(self) -> bool:
+        try:
+            jwks = self.fetch(self.url)
+            keys = {}
+            for key in jwks.get('keys', []):
+                kid = key.get('kid')
+                if not kid:
+                    continue
+                try:
+                    keys[kid] = jwk.construct(key, key.get('alg', 'RS256'))
+                except Exception as e:
+                    logger.warning(f"Skipping unusable Cognito public key {kid}: {e}")
+            self.jwks, self.keys, self.fetched_at = jwks, keys, self.clock()
+            logger.info(f"Successfully fetched Cognito public keys ({len(keys)} keys)")
+            return True
+        except Exception as e:
+            logger.error(f"Failed to fetch Cognito public keys: {e}")
+            return False
+    
+    def _refresh(self, wait: bool) -> bool:
+        """Start a refresh unless one ran within the rate limit; optionally wait for it"""
+        now = self.clock()
+        if (not self._flight.in_flight('jwks') and self.attempted_at is not None
+                and now - self.attempted_at < self.min_refresh_seconds):
+            return False
+        self.attempted_at = now
+        future = self._flight.submit('jwks', self._load, _jwks_executor)
+        return future.result() if wait else False
+    
+    def _ensure(self) -> None:
+        age = None if self.fetched_at is None else self.clock() - self.fetched_at
+        if age is None or age > self.max_stale_seconds:
+            self._refresh(wait=True)
+            if not self.keys:
+                raise JWKSUnavailableError("Cannot fetch Cognito public keys")
+            if self.fetched_at is None or self.clock() - self.fetched_at > self.max_stale_seconds:
+                logger.warning("Using cached keys due to fetch error")
+        elif age > self.fresh_seconds:
+            self._refresh(wait=False)
+    
+    def get_jwks(self) -> Dict:
+        self._ensure()
+        return self.jwks
+    
+    def get_key(self, kid: str) -> Any:
+        """Constructed public key for kid, refreshing once if the kid is new"""
+        self._ensure()
+        key = self.keys.get(kid)
+        if key is None and self._refresh(wait=True):
+            key = self.keys.get(kid)
+        if key is None:
+            raise UnknownKeyError(f"Public key not found for kid: {kid}")
+        return key
 
 class CognitoTokenValidator:
     def __init__(self):
@@ -24,58 +136,54 @@ class CognitoTokenValidator:
         
         if not self.user_pool_id or not self.client_id:
             logger.warning("Cognito configuration not found in environment variables")
+        
+        jwks_url = f'https://cognito-idp.{self.region}.amazonaws.com/{self.user_pool_id}/.well-known/jwks.json'
+        self.jwks_cache = JWKSCache(jwks_url)
+        # Keyed by the token's SHA-256; separate so rejected tokens cannot evict verified ones
+        self.verified_tokens = TTLCache(max_entries=TOKEN_CACHE_MAX_ENTRIES)
+        self.rejected_tokens = TTLCache(max_entries=TOKEN_NEGATIVE_CACHE_MAX_ENTRIES,
+                                        ttl_seconds=TOKEN_NEGATIVE_CACHE_SECONDS)
     
     def get_cognito_public_keys(self) -> Dict:
-        """Get Cognito public keys with caching"""
-        global _jwks_cache, _cache_timestamp
-        
-        current_time = datetime.utcnow().timestamp()
-        
-        # Check cache validity
-        if (_jwks_cache and _cache_timestamp and 
-            (current_time - _cache_timestamp) < CACHE_TTL):
-            return _jwks_cache
-        
-        try:
-            # Fetch fresh keys from Cognito
-            jwks_url = f'https://cognito-idp.{self.region}.amazonaws.com/{self.user_pool_id}/.well-known/jwks.json'
-            response = requests.get(jwks_url, timeout=10)
-            response.raise_for_status()
-            
-            jwks = response.json()
-            
-            # Update cache
-            _jwks_cache = jwks
-            _cache_timestamp = current_time
-            
-            logger.info("Successfully fetched Cognito public keys")
-            return jwks
-            
-        except Exception as e:
-            logger.error(f"Failed to fetch Cognito public keys: {e}")
-            # Return cached keys if available, even if expired
-            if _jwks_cache:
-                logger.warning("Using cached keys due to fetch error")
-                return _jwks_cache
-            raise Exception(f"Cannot fetch Cognito public keys: {e}")
+        """Get Cognito public keys (raw JWKS) with caching"""
+        return self.jwks_cache.get_jwks()
     
-    def get_public_key(self, token_header: Dict) -> Dict:
-        """Get the public key for a specific token"""
+    def get_public_key(self, token_header: Dict) -> Any:
+        """Get the constructed public key for a specific token"""
         kid = token_header.get('kid')
         if not kid:
             raise Exception("Token header missing 'kid' claim")
         
-        jwks = self.get_cognito_public_keys()
+        return self.jwks_cache.get_key(kid)
+    
+    def validate_token_production(self, token: str) -> Optional[Dict]:
+        """Production-grade JWT validation with signature verification, cached per token"""
+        token_hash = hashlib.sha256(token.encode('utf-8')).hexdigest()
+        decoded_token = self.verified_tokens.get(token_hash)
+        if decoded_token is not None:
+            logger.info(f"Token validated (cached) for user: {decoded_token.get('sub')}")
+            return dict(decoded_token)
+        if self.rejected_tokens.get(token_hash):
+            logger.warning("Token rejected (cached)")
+            return None
         
-        # Find the matching key
-        for key in jwks.get('keys', []):
-            if key.get('kid') == kid:
-                return key
+        try:
+            decoded_token = self.verify_token(token)
+        except (JWKSUnavailableError, UnknownKeyError) as e:
+            # May pass once the keys load or rotate; JWKSCache already rate-limits those fetches
+            logger.error(f"Token validation error: {e}")
+            return None
         
-        raise Exception(f"Public key not found for kid: {kid}")
+        if decoded_token is None:
+            self.rejected_tokens.set(token_hash, True)
+            return None
+        ttl = decoded_token['exp'] - TOKEN_CACHE_EXP_MARGIN_SECONDS - datetime.utcnow().timestamp()
+        if ttl > 0:
+            self.verified_tokens.set(token_hash, dict(decoded_token), ttl_seconds=ttl)
+        return decoded_token
     
-    def validate_token_production(self, token: str) -> Optional[Dict]:
-        """Production-grade JWT validation with signature verification"""
+    def verify_token(self, token: str) -> Optional[Dict]:
+        """Header parsing, signature verification and claim checks, without caching"""
         try:
             # Get token header without verification
             header = jwt.get_unverified_header(token)
@@ -135,9 +243,11 @@ class CognitoTokenValidator:
             logger.info(f"Token successfully validated for user: {decoded_token.get('sub')}")
             return decoded_token
             
-        except JWTError as e:
+        except jose.JWTError as e:
             logger.error(f"JWT validation error: {e}")
             return None
+        except (JWKSUnavailableError, UnknownKeyError):
+            raise
         except Exception as e:
             logger.error(f"Token validation error: {e}")
             return None
@@ -146,7 +256,7 @@ class CognitoTokenValidator:
         """Development JWT validation without signature verification"""
         try:
             # Decode without signature verification (development only)
-            decoded = jwt.decode(token, options={"verify_signature": False})
+            decoded = jwt.get_unverified_claims(token)
             
             # Basic token validation checks
             current_time = datetime.utcnow().timestamp()
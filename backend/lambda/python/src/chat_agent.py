@@ -1,50 +1,71 @@
+from __future__ import annotations
+
 import json
 import os
-import boto3
 import logging
-import base64
-from typing import Dict, Any, List, Optional
+from typing import TYPE_CHECKING, Dict, Any, List, Optional
 from datetime import datetime
-from langchain.tools import Tool
-from langchain_community.tools import DuckDuckGoSearchResults
-from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
-from langchain_aws import ChatBedrock
-from langgraph.prebuilt import create_react_agent
-from PIL import Image
-import io
+from lazy import LazyClient, LazyModule, lazy_singleton
 from auth_validator import validate_token, log_auth_event
+from agent_registry import get_or_create, get_stats, tool_config_key
+from image_intake import ImageIntakeError, load_image
+from image_analysis_cache import get_image_analysis_cache
+from search_cache import get_search_cache
+from retrieval_cache import get_retrieval_cache
+from vector_index import get_local_index
+from context_packing import log_packing, pack_messages
+from session_store import open_session
+from response_cache import cache_requested, cached_answer
+
+if TYPE_CHECKING:
+    from langchain.tools import Tool
+
+# Heavy dependencies are imported on first use so OPTIONS preflights and
+# rejected requests do not pay for them on a cold start
+lc_tools = LazyModule('langchain.tools')
+lc_community_tools = LazyModule('langchain_community.tools')
+lc_messages = LazyModule('langchain_core.messages')
+langchain_aws = LazyModule('langchain_aws')
+langgraph_prebuilt = LazyModule('langgraph.prebuilt')
 
 # Configure logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 # AWS clients
-bedrock_client = boto3.client('bedrock-runtime')
-s3_client = boto3.client('s3')
-ssm_client = boto3.client('ssm')
-knowledge_base_client = boto3.client('bedrock-agent-runtime')
+s3_client = LazyClient('s3')
+knowledge_base_client = LazyClient('bedrock-agent-runtime')
+
+IMAGE_ANALYSIS_SYSTEM_PROMPT = "You are an expert image analyst. Analyze the provided image thoroughly and describe what you see, including any text, charts, diagrams, objects, people, or other relevant details. If there are any business-related elements like charts, graphs, or documents, pay special attention to those."
+IMAGE_ANALYSIS_PROMPT = "Please analyze this image in detail:"
 
-# Initialize Bedrock client
-bedrock_llm = ChatBedrock(
-    model_id="anthropic.claude-3-5-sonnet-20241022-v2:0",
-    region_name="ap-northeast-1"
-)
+@lazy_singleton
+def get_bedrock_llm():
+    """Shared ChatBedrock client, created on first use"""
+    return langchain_aws.ChatBedrock(
+        model_id="anthropic.claude-3-5-sonnet-20241022-v2:0",
+        region_name="ap-northeast-1"
+    )
+
+def summarize_text(prompt: str) -> str:
+    """Plain completion used to fold old session messages into a summary"""
+    return get_bedrock_llm().invoke(prompt).content
 
 class ChatAgent:
     def __init__(self):
         self.model_id = "anthropic.claude-3-5-sonnet-20241022-v2:0"
-        self.search_tool = DuckDuckGoSearchResults(max_results=5)
+        self.search_tool = lc_community_tools.DuckDuckGoSearchResults(max_results=5)
         self.knowledge_base_id = os.environ.get('KNOWLEDGE_BASE_ID')
         
     def create_tools(self) -> List[Tool]:
         """Create tools for the ReAct agent"""
         tools = [
-            Tool(
+            lc_tools.Tool(
                 name="web_search",
                 description="Search the web for current information. Use this when you need up-to-date facts, news, or information not in your knowledge base.",
                 func=self._web_search
             ),
-            Tool(
+            lc_tools.Tool(
                 name="analyze_image",
                 description="Analyze images using Claude's vision capabilities. Provide the S3 key or URL of the image to analyze. Use this for understanding charts, diagrams, documents, or any visual content.",
                 func=self._analyze_image
@@ -53,7 +74,7 @@ class ChatAgent:
         
         if self.knowledge_base_id:
             tools.append(
-                Tool(
+                lc_tools.Tool(
                     name="knowledge_base_search",
                     description="Search internal company documents and knowledge base. Use this for company-specific information, policies, procedures, and internal data.",
                     func=self._knowledge_base_search
@@ -66,7 +87,8 @@ class ChatAgent:
         """Perform web search using DuckDuckGo"""
         try:
             logger.info(f"Performing web search: {query}")
-            results = self.search_tool.run(query)
+            # Popular queries repeat across users; reuse recent results
+            results = get_search_cache().get('duckduckgo', query, lambda: self.search_tool.run(query))
             
             # Format results for better readability
             if isinstance(results, list):
@@ -92,20 +114,29 @@ class ChatAgent:
         try:
             logger.info(f"Searching knowledge base: {query}")
             
-            response = knowledge_base_client.retrieve(
-                knowledgeBaseId=self.knowledge_base_id,
-                retrievalQuery={
-                    'text': query
-                },
-                retrievalConfiguration={
-                    'vectorSearchConfiguration': {
-                        'numberOfResults': 5
-                    }
+            retrieval_config = {
+                'vectorSearchConfiguration': {
+                    'numberOfResults': 5
                 }
-            )
+            }
+            
+            # Warm containers answer from the in-process index; Bedrock on a miss or a weak match
+            retrieved = get_local_index().search(query, retrieval_config['vectorSearchConfiguration']['numberOfResults'])
+            if retrieved is None:
+                # Repeated lookups reuse results until the next knowledge base ingest
+                retrieved = get_retrieval_cache().retrieve(
+                    self.knowledge_base_id, query, retrieval_config,
+                    lambda: knowledge_base_client.retrieve(
+                        knowledgeBaseId=self.knowledge_base_id,
+                        retrievalQuery={
+                            'text': query
+                        },
+                        retrievalConfiguration=retrieval_config
+                    )
+                )
             
             results = []
-            for result in response.get('retrievalResults', []):
+            for result in retrieved:
                 content = result.get('content', {}).get('text', '')
                 source = result.get('location', {}).get('s3Location', {}).get('uri', '')
                 score = result.get('score', 0)
@@ -124,78 +155,34 @@ class ChatAgent:
     def _analyze_image(self, image_input: str) -> str:
         """Analyze images using Claude's vision capabilities"""
         try:
-            logger.info(f"Analyzing image: {image_input}")
-            
-            # Extract image data based on input type
-            image_data = None
-            image_format = None
-            
-            if image_input.startswith('data:image/'):
-                # Data URL format
-                header, data = image_input.split(',', 1)
-                image_format = header.split(';')[0].split('/')[1]
-                image_data = base64.b64decode(data)
-            elif image_input.startswith('s3://') or '/' in image_input:
-                # S3 key or URL
-                s3_key = image_input.replace('s3://', '').split('/', 1)
-                if len(s3_key) == 2:
-                    bucket, key = s3_key
-                else:
-                    bucket = os.environ.get('S3_BUCKET', '').replace('s3://', '')
-                    key = image_input
-                
-                try:
-                    response = s3_client.get_object(Bucket=bucket, Key=key)
-                    image_data = response['Body'].read()
-                    # Determine format from file extension
-                    image_format = key.split('.')[-1].lower()
-                    if image_format == 'jpg':
-                        image_format = 'jpeg'
-                except Exception as s3_error:
-                    logger.error(f"S3 image retrieval error: {s3_error}")
-                    return f"Failed to retrieve image from S3: {str(s3_error)}"
-            else:
-                # Assume it's a base64 encoded image
-                try:
-                    image_data = base64.b64decode(image_input)
-                    # Try to detect format from image data
-                    image = Image.open(io.BytesIO(image_data))
-                    image_format = image.format.lower()
-                except Exception:
-                    return "Invalid image format. Please provide a valid image URL, S3 key, or base64 data."
-            
-            if not image_data:
-                return "Failed to extract image data"
-            
-            # Validate image format
-            supported_formats = ['jpeg', 'jpg', 'png', 'gif', 'webp']
-            if image_format not in supported_formats:
-                return f"Unsupported image format: {image_format}. Supported formats: {', '.join(supported_formats)}"
+            logger.info(f"Analyzing image: {image_input[:50]}...")
             
-            # Encode image for Claude
-            image_b64 = base64.b64encode(image_data).decode('utf-8')
+            # Size limits, downscaling and base64 encoding all happen in the intake path
+            try:
+                image = load_image(image_input)
+            except ImageIntakeError as e:
+                return str(e)
             
             # Create message with image
             messages = [
-                SystemMessage(content="You are an expert image analyst. Analyze the provided image thoroughly and describe what you see, including any text, charts, diagrams, objects, people, or other relevant details. If there are any business-related elements like charts, graphs, or documents, pay special attention to those."),
-                HumanMessage(content=[
+                lc_messages.SystemMessage(content=IMAGE_ANALYSIS_SYSTEM_PROMPT),
+                lc_messages.HumanMessage(content=[
                     {
                         "type": "text",
-                        "text": "Please analyze this image in detail:"
+                        "text": IMAGE_ANALYSIS_PROMPT
                     },
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/{image_format};base64,{image_b64}"
-                        }
-                    }
+                    # Native block: ChatBedrock passes it through without re-parsing a data URL
+                    image.anthropic_block()
                 ])
             ]
             
-            # Use Claude directly for vision analysis
-            response = bedrock_llm.invoke(messages)
+            # Use Claude directly for vision analysis; repeat images are served from the analysis cache
+            analysis = get_image_analysis_cache().get_or_analyze(
+                image.sha256, image.size, f"{IMAGE_ANALYSIS_SYSTEM_PROMPT}\n{IMAGE_ANALYSIS_PROMPT}", self.model_id,
+                lambda: get_bedrock_llm().invoke(messages).content
+            )
             
-            return f"Image analysis results:\n\n{response.content}"
+            return f"Image analysis results:\n\n{analysis}"
             
         except Exception as e:
             logger.error(f"Image analysis error: {e}")
@@ -208,14 +195,18 @@ class ChatAgent:
             formatted_messages = []
             for msg in messages:
                 if msg['role'] == 'user':
-                    formatted_messages.append(HumanMessage(content=msg['content']))
+                    formatted_messages.append(lc_messages.HumanMessage(content=msg['content']))
                 elif msg['role'] == 'assistant':
-                    formatted_messages.append(AIMessage(content=msg['content']))
+                    formatted_messages.append(lc_messages.AIMessage(content=msg['content']))
             
-            # Create ReAct agent with tools
-            agent_executor = create_react_agent(
-                model=bedrock_llm,
-                tools=tools
+            # ReAct graph compiled once per container for this tool set
+            agent_executor = get_or_create(
+                'ChatAgent.graph',
+                (tool_config_key(), tuple(tool.name for tool in tools)),
+                lambda: langgraph_prebuilt.create_react_agent(
+                    model=get_bedrock_llm(),
+                    tools=tools
+                )
             )
             
             # Get the latest user message
@@ -283,14 +274,13 @@ def handler(event, context):
                 'body': json.dumps({'error': 'Invalid token'})
             }
         
-        # Log authentication event
-        log_auth_event(user, 'chat_agent_access', f'Session: {body.get("sessionId", "unknown")}')
-        
         # Parse request body
         body = json.loads(event.get('body', '{}'))
+        
+        # Log authentication event
+        log_auth_event(user, 'chat_agent_access', f'Session: {body.get("sessionId", "unknown")}')
         message = body.get('message', '')
         session_id = body.get('sessionId', '')
-        conversation_history = body.get('history', [])
         
         if not message:
             return {
@@ -299,15 +289,36 @@ def handler(event, context):
                 'body': json.dumps({'error': 'Message is required'})
             }
         
-        # Initialize chat agent
-        agent = ChatAgent()
-        tools = agent.create_tools()
+        # Reuse the chat agent and its tools across warm invocations
+        agent = get_or_create('ChatAgent', tool_config_key(), ChatAgent)
+        tools = get_or_create('ChatAgent.tools', tool_config_key(), agent.create_tools)
+        
+        # History comes from the request, or from the server-side session when
+        # the client sends only sessionId and the new message
+        try:
+            session, conversation_history = open_session(body, user)
+        except PermissionError:
+            return {
+                'statusCode': 403,
+                'headers': cors_headers,
+                'body': json.dumps({'error': 'Session belongs to another user'})
+            }
+        if session:
+            session.start_summary(summarize_text)
+        
+        # Prepare messages for agent, keeping the history within the token budget
+        messages, packing = pack_messages(conversation_history + [{'role': 'user', 'content': message}])
+        log_packing('chat_agent', packing)
         
-        # Prepare messages for agent
-        messages = conversation_history + [{'role': 'user', 'content': message}]
+        # Get response from agent; repeated questions are answered from the response cache
+        response = cached_answer(
+            'chat_agent', user, agent.model_id, '', messages,
+            lambda: agent.invoke_claude(messages, tools),
+            enabled=cache_requested(body, event.get('headers'))
+        )
         
-        # Get response from agent
-        response = agent.invoke_claude(messages, tools)
+        if session:
+            session.record_turn(message, response)
         
         # Prepare response
         result = {
@@ -321,6 +332,7 @@ def handler(event, context):
         }
         
         logger.info(f"Chat response generated for user: {user.get('sub', 'unknown')}")
+        logger.info(f"Agent registry stats: {json.dumps(get_stats())}")
         
         return {
             'statusCode': 200,
@@ -1,52 +1,74 @@
+from __future__ import annotations
+
 import json
 import os
-import boto3
 import logging
 import time
-from typing import Dict, Any, List, Optional
+import uuid
+from typing import TYPE_CHECKING, Dict, Any, Iterator, List, Optional, Tuple
 from datetime import datetime
-from langchain.tools import Tool
-from langchain_community.tools import DuckDuckGoSearchResults
-from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
-from langchain_aws import ChatBedrock
-from langgraph.prebuilt import create_react_agent
-from PIL import Image
-import io
-import base64
+from http import HTTPStatus
+from lazy import LazyClient, LazyModule, lazy_singleton
 from auth_validator import validate_token, log_auth_event
+from agent_registry import get_or_create, get_stats, model_config_key, tool_config_key
+from image_intake import ImageIntakeError, load_image
+from image_analysis_cache import get_image_analysis_cache
+from search_cache import get_search_cache
+from retrieval_cache import get_retrieval_cache
+from vector_index import get_local_index
+from context_packing import log_packing, pack_messages
+from session_store import open_session
+from sse import LEGACY_PROTOCOL_VERSION, PROTOCOL_VERSION, StreamEncoder, chunk_text, coalesce_chunks, format_sse, iter_encoded
+
+if TYPE_CHECKING:
+    from langchain.tools import Tool
+
+# Imported on first use to keep cold starts short (see lazy.py)
+lc_tools = LazyModule('langchain.tools')
+lc_community_tools = LazyModule('langchain_community.tools')
+lc_messages = LazyModule('langchain_core.messages')
+langchain_aws = LazyModule('langchain_aws')
+langgraph_prebuilt = LazyModule('langgraph.prebuilt')
 
 # Configure logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 # AWS clients
-bedrock_client = boto3.client('bedrock-runtime')
-s3_client = boto3.client('s3')
-ssm_client = boto3.client('ssm')
-knowledge_base_client = boto3.client('bedrock-agent-runtime')
-
-# Initialize Bedrock client for streaming
-bedrock_llm_streaming = ChatBedrock(
-    model_id="anthropic.claude-3-5-sonnet-20241022-v2:0",
-    region_name="ap-northeast-1",
-    streaming=True
-)
+s3_client = LazyClient('s3')
+knowledge_base_client = LazyClient('bedrock-agent-runtime')
+
+IMAGE_ANALYSIS_SYSTEM_PROMPT = "You are an expert image analyst. Analyze the provided image thoroughly and describe what you see, including any text, charts, diagrams, objects, people, or other relevant details. If there are any business-related elements like charts, graphs, or documents, pay special attention to those."
+IMAGE_ANALYSIS_PROMPT = "Please analyze this image in detail:"
+
+@lazy_singleton
+def get_bedrock_llm_streaming():
+    """Shared ChatBedrock client, created on first use"""
+    return langchain_aws.ChatBedrock(
+        model_id="anthropic.claude-3-5-sonnet-20241022-v2:0",
+        region_name="ap-northeast-1",
+        streaming=True
+    )
+
+def summarize_text(prompt: str) -> str:
+    """Plain completion used to fold old session messages into a summary"""
+    return get_bedrock_llm_streaming().invoke(prompt).content
 
 class StreamingChatAgent:
     def __init__(self):
         self.model_id = "anthropic.claude-3-5-sonnet-20241022-v2:0"
-        self.search_tool = DuckDuckGoSearchResults(max_results=5)
+        self.search_tool = lc_community_tools.DuckDuckGoSearchResults(max_results=5)
         self.knowledge_base_id = os.environ.get('KNOWLEDGE_BASE_ID')
         
     def create_tools(self) -> List[Tool]:
         """Create tools for the ReAct agent"""
         tools = [
-            Tool(
+            lc_tools.Tool(
                 name="web_search",
                 description="Search the web for current information. Use this when you need up-to-date facts, news, or information not in your knowledge base.",
                 func=self._web_search
             ),
-            Tool(
+            lc_tools.Tool(
                 name="analyze_image",
                 description="Analyze images using Claude's vision capabilities. Provide the S3 key or URL of the image to analyze. Use this for understanding charts, diagrams, documents, or any visual content.",
                 func=self._analyze_image
@@ -55,7 +77,7 @@ class StreamingChatAgent:
         
         if self.knowledge_base_id:
             tools.append(
-                Tool(
+                lc_tools.Tool(
                     name="knowledge_base_search",
                     description="Search internal company documents and knowledge base. Use this for company-specific information, policies, procedures, and internal data.",
                     func=self._knowledge_base_search
@@ -68,7 +90,8 @@ class StreamingChatAgent:
         """Perform web search using DuckDuckGo"""
         try:
             logger.info(f"Performing web search: {query}")
-            results = self.search_tool.run(query)
+            # Popular queries repeat across users; reuse recent results
+            results = get_search_cache().get('duckduckgo', query, lambda: self.search_tool.run(query))
             
             # Format results for better readability
             if isinstance(results, list):
@@ -94,20 +117,29 @@ class StreamingChatAgent:
         try:
             logger.info(f"Searching knowledge base: {query}")
             
-            response = knowledge_base_client.retrieve(
-                knowledgeBaseId=self.knowledge_base_id,
-                retrievalQuery={
-                    'text': query
-                },
-                retrievalConfiguration={
-                    'vectorSearchConfiguration': {
-                        'numberOfResults': 5
-                    }
+            retrieval_config = {
+                'vectorSearchConfiguration': {
+                    'numberOfResults': 5
                 }
-            )
+            }
+            
+            # Warm containers answer from the in-process index; Bedrock on a miss or a weak match
+            retrieved = get_local_index().search(query, retrieval_config['vectorSearchConfiguration']['numberOfResults'])
+            if retrieved is None:
+                # Repeated lookups reuse results until the next knowledge base ingest
+                retrieved = get_retrieval_cache().retrieve(
+                    self.knowledge_base_id, query, retrieval_config,
+                    lambda: knowledge_base_client.retrieve(
+                        knowledgeBaseId=self.knowledge_base_id,
+                        retrievalQuery={
+                            'text': query
+                        },
+                        retrievalConfiguration=retrieval_config
+                    )
+                )
             
             results = []
-            for result in response.get('retrievalResults', []):
+            for result in retrieved:
                 content = result.get('content', {}).get('text', '')
                 source = result.get('location', {}).get('s3Location', {}).get('uri', '')
                 score = result.get('score', 0)
@@ -126,234 +158,321 @@ class StreamingChatAgent:
     def _analyze_image(self, image_input: str) -> str:
         """Analyze images using Claude's vision capabilities"""
         try:
-            logger.info(f"Analyzing image: {image_input}")
+            logger.info(f"Analyzing image: {image_input[:50]}...")
             
-            # Extract image data based on input type
-            image_data = None
-            image_format = None
-            
-            if image_input.startswith('data:image/'):
-                # Data URL format
-                header, data = image_input.split(',', 1)
-                image_format = header.split(';')[0].split('/')[1]
-                image_data = base64.b64decode(data)
-            elif image_input.startswith('s3://') or '/' in image_input:
-                # S3 key or URL
-                s3_key = image_input.replace('s3://', '').split('/', 1)
-                if len(s3_key) == 2:
-                    bucket, key = s3_key
-                else:
-                    bucket = os.environ.get('S3_BUCKET', '').replace('s3://', '')
-                    key = image_input
-                
-                try:
-                    response = s3_client.get_object(Bucket=bucket, Key=key)
-                    image_data = response['Body'].read()
-                    # Determine format from file extension
-                    image_format = key.split('.')[-1].lower()
-                    if image_format == 'jpg':
-                        image_format = 'jpeg'
-                except Exception as s3_error:
-                    logger.error(f"S3 image retrieval error: {s3_error}")
-                    return f"Failed to retrieve image from S3: {str(s3_error)}"
-            else:
-                # Assume it's a base64 encoded image
-                try:
-                    image_data = base64.b64decode(image_input)
-                    # Try to detect format from image data
-                    image = Image.open(io.BytesIO(image_data))
-                    image_format = image.format.lower()
-                except Exception:
-                    return "Invalid image format. Please provide a valid image URL, S3 key, or base64 data."
-            
-            if not image_data:
-                return "Failed to extract image data"
-            
-            # Validate image format
-            supported_formats = ['jpeg', 'jpg', 'png', 'gif', 'webp']
-            if image_format not in supported_formats:
-                return f"Unsupported image format: {image_format}. Supported formats: {', '.join(supported_formats)}"
-            
-            # Encode image for Claude
-            image_b64 = base64.b64encode(image_data).decode('utf-8')
+            # Size limits, downscaling and base64 encoding all happen in the intake path
+            try:
+                image = load_image(image_input)
+            except ImageIntakeError as e:
+                return str(e)
             
             # Create message with image
             messages = [
-                SystemMessage(content="You are an expert image analyst. Analyze the provided image thoroughly and describe what you see, including any text, charts, diagrams, objects, people, or other relevant details. If there are any business-related elements like charts, graphs, or documents, pay special attention to those."),
-                HumanMessage(content=[
+                lc_messages.SystemMessage(content=IMAGE_ANALYSIS_SYSTEM_PROMPT),
+                lc_messages.HumanMessage(content=[
                     {
                         "type": "text",
-                        "text": "Please analyze this image in detail:"
+                        "text": IMAGE_ANALYSIS_PROMPT
                     },
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/{image_format};base64,{image_b64}"
-                        }
-                    }
+                    # Native block: ChatBedrock passes it through without re-parsing a data URL
+                    image.anthropic_block()
                 ])
             ]
             
-            # Use Claude directly for vision analysis
-            response = bedrock_llm_streaming.invoke(messages)
+            # Use Claude directly for vision analysis; repeat images are served from the analysis cache
+            analysis = get_image_analysis_cache().get_or_analyze(
+                image.sha256, image.size, f"{IMAGE_ANALYSIS_SYSTEM_PROMPT}\n{IMAGE_ANALYSIS_PROMPT}", self.model_id,
+                lambda: get_bedrock_llm_streaming().invoke(messages).content
+            )
             
-            return f"Image analysis results:\n\n{response.content}"
+            return f"Image analysis results:\n\n{analysis}"
             
         except Exception as e:
             logger.error(f"Image analysis error: {e}")
             return f"Image analysis failed: {str(e)}"
 
+    def stream_agent(self, messages: List[Any], tools: List[Tool], llm=None) -> Iterator[Any]:
+        """Run the ReAct agent, yielding model text deltas and tool event dicts
+
+        Text arrives as str; tool activity arrives as
+        {'event': 'tool_start' | 'tool_end', 'data': {...}}.
+        """
+        model = llm or get_bedrock_llm_streaming()
+        # ReAct graph compiled once per container for this tool set and model
+        agent_executor = get_or_create(
+            'StreamingChatAgent.graph',
+            (tool_config_key(), tuple(tool.name for tool in tools), model_config_key(model)),
+            lambda: langgraph_prebuilt.create_react_agent(
+                model=model,
+                tools=tools
+            )
+        )
 
+        started: Dict[str, float] = {}
+        for mode, payload in agent_executor.stream({'messages': messages}, stream_mode=['messages', 'updates']):
+            if mode == 'messages':
+                # Token deltas from the model node only; tool output is reported via updates
+                message_chunk, metadata = payload
+                if metadata.get('langgraph_node') == 'agent' and isinstance(message_chunk, lc_messages.AIMessageChunk):
+                    text = chunk_text(message_chunk)
+                    if text:
+                        yield text
+                continue
 
-def lambda_handler(event, context):
-    """Lambda handler for streaming chat agent"""
-    logger.info(f"Streaming chat event: {json.dumps(event)}")
-    
-    # CORS headers
-    cors_headers = {
-        'Access-Control-Allow-Origin': '*',
-        'Access-Control-Allow-Headers': 'Content-Type,Authorization,Cache-Control',
-        'Access-Control-Allow-Methods': 'POST,OPTIONS',
-        'Access-Control-Allow-Credentials': 'true',
-        'Content-Type': 'text/event-stream; charset=utf-8',
-        'Cache-Control': 'no-cache',
-        'Connection': 'keep-alive',
-    }
-    
+            for node, update in payload.items():
+                for message in (update or {}).get('messages', []):
+                    if node == 'agent':
+                        for tool_call in getattr(message, 'tool_calls', None) or []:
+                            started[tool_call['id']] = time.monotonic()
+                            logger.info(f"Tool start: {tool_call['name']}")
+                            yield {'event': 'tool_start', 'data': {
+                                'id': tool_call['id'],
+                                'name': tool_call['name'],
+                                'input': tool_call.get('args', {})
+                            }}
+                    elif node == 'tools' and isinstance(message, lc_messages.ToolMessage):
+                        output = chunk_text(message)
+                        duration = time.monotonic() - started.pop(message.tool_call_id, time.monotonic())
+                        logger.info(f"Tool end: {message.name} ({duration:.2f}s)")
+                        yield {'event': 'tool_end', 'data': {
+                            'id': message.tool_call_id,
+                            'name': message.name,
+                            'status': getattr(message, 'status', 'success'),
+                            'durationMs': int(duration * 1000),
+                            'outputPreview': output[:TOOL_OUTPUT_PREVIEW_CHARS]
+                        }}
+
+# Clients that do not send `protocolVersion` predate delta chunks; keep sending
+# them `fullContent` unless this compatibility flag is turned off
+LEGACY_FULL_CONTENT = os.environ.get('STREAM_LEGACY_FULL_CONTENT', 'true').lower() == 'true'
+CHECKPOINT_INTERVAL = int(os.environ.get('STREAM_CHECKPOINT_INTERVAL', '50'))
+
+# Model output is coalesced into frames flushed at this size or age, whichever comes first
+COALESCE_MAX_BYTES = int(os.environ.get('STREAM_COALESCE_BYTES', '256'))
+COALESCE_MAX_DELAY = int(os.environ.get('STREAM_COALESCE_MS', '30')) / 1000
+
+# Tool results can be long documents; tool_end events only carry a preview
+TOOL_OUTPUT_PREVIEW_CHARS = 500
+
+# CORS headers
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Headers': 'Content-Type,Authorization,Cache-Control',
+    'Access-Control-Allow-Methods': 'POST,OPTIONS',
+    'Access-Control-Allow-Credentials': 'true',
+    'Content-Type': 'text/event-stream; charset=utf-8',
+    'Cache-Control': 'no-cache',
+    'Connection': 'keep-alive',
+}
+
+
+def _parse_stream_request(event: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """Validate the request and return (request, None) or (None, error response)"""
+    # Handle CORS preflight
+    if event.get('httpMethod') == 'OPTIONS':
+        return None, {
+            'statusCode': 200,
+            'headers': CORS_HEADERS,
+            'body': ''
+        }
+
+    # Validate authorization
+    auth_header = event.get('headers', {}).get('Authorization') or event.get('headers', {}).get('authorization')
+    if not auth_header:
+        return None, {
+            'statusCode': 401,
+            'headers': CORS_HEADERS,
+            'body': json.dumps({'error': 'Missing authorization header'})
+        }
+
+    user = validate_token(auth_header)
+    if not user:
+        return None, {
+            'statusCode': 401,
+            'headers': CORS_HEADERS,
+            'body': json.dumps({'error': 'Invalid token'})
+        }
+
+    # Parse request body
+    body = json.loads(event.get('body') or '{}')
+    message = body.get('message', '')
+
+    # Log authentication event
+    log_auth_event(user, 'chat_stream_access', f'Session: {body.get("sessionId", "unknown")}')
+
+    if not message:
+        return None, {
+            'statusCode': 400,
+            'headers': CORS_HEADERS,
+            'body': json.dumps({'error': 'Message is required'})
+        }
+
+    # History comes from the request, or from the server-side session when
+    # the client sends only sessionId and the new message
     try:
-        # Handle CORS preflight
-        if event.get('httpMethod') == 'OPTIONS':
-            return {
-                'statusCode': 200,
-                'headers': cors_headers,
-                'body': ''
-            }
+        session, history = open_session(body, user)
+    except PermissionError:
+        return None, {
+            'statusCode': 403,
+            'headers': CORS_HEADERS,
+            'body': json.dumps({'error': 'Session belongs to another user'})
+        }
 
-        # Validate authorization
-        auth_header = event.get('headers', {}).get('Authorization') or event.get('headers', {}).get('authorization')
-        if not auth_header:
-            return {
-                'statusCode': 401,
-                'headers': cors_headers,
-                'body': json.dumps({'error': 'Missing authorization header'})
-            }
+    default_version = LEGACY_PROTOCOL_VERSION if LEGACY_FULL_CONTENT else PROTOCOL_VERSION
+    try:
+        protocol_version = int(body.get('protocolVersion', default_version))
+    except (TypeError, ValueError):
+        protocol_version = default_version
 
-        user = validate_token(auth_header)
-        if not user:
-            return {
-                'statusCode': 401,
-                'headers': cors_headers,
-                'body': json.dumps({'error': 'Invalid token'})
-            }
-        
-        # Log authentication event
-        log_auth_event(user, 'chat_stream_access', f'Session: {body.get("sessionId", "unknown")}')
-
-        # Parse request body
-        body = json.loads(event.get('body', '{}'))
-        message = body.get('message', '')
-        session_id = body.get('sessionId', '')
-        conversation_history = body.get('history', [])
-
-        if not message:
-            return {
-                'statusCode': 400,
-                'headers': cors_headers,
-                'body': json.dumps({'error': 'Message is required'})
-            }
+    return {
+        'user': user,
+        'message': message,
+        'session_id': body.get('sessionId', ''),
+        'history': history,
+        'session': session,
+        'protocol_version': protocol_version
+    }, None
 
-        # Initialize streaming chat agent
-        agent = StreamingChatAgent()
-        tools = agent.create_tools()
-
-        # Prepare messages for agent (simplified for now)
-        # For streaming, we'll use a simpler approach
-        formatted_messages = []
-        for msg in conversation_history:
-            if msg['role'] == 'user':
-                formatted_messages.append(HumanMessage(content=msg['content']))
-            elif msg['role'] == 'assistant':
-                formatted_messages.append(AIMessage(content=msg['content']))
-        
-        formatted_messages.append(HumanMessage(content=message))
 
-        # Create streaming response
-        response_parts = []
-        
-        # Start message
-        start_event = {
-            'event': 'start',
-            'data': {
-                'sessionId': session_id or context.aws_request_id,
-                'messageId': context.aws_request_id
-            }
+def stream_chat_events(request: Dict[str, Any], request_id: str, llm=None) -> Iterator[str]:
+    """Yield SSE frames as the model generates the answer"""
+    # Reuse the agent and its tools across warm invocations
+    agent = get_or_create('StreamingChatAgent', tool_config_key(), StreamingChatAgent)
+    tools = get_or_create('StreamingChatAgent.tools', tool_config_key(), agent.create_tools)
+
+    session = request.get('session')
+    if session:
+        session.start_summary(summarize_text)
+
+    # Keep the history within the token budget
+    messages, packing = pack_messages(request['history'] + [{'role': 'user', 'content': request['message']}])
+    log_packing('chat_stream', packing)
+
+    formatted_messages = []
+    for msg in messages:
+        if msg['role'] == 'user':
+            formatted_messages.append(lc_messages.HumanMessage(content=msg['content']))
+        elif msg['role'] == 'assistant':
+            formatted_messages.append(lc_messages.AIMessage(content=msg['content']))
+
+    encoder = StreamEncoder(request.get('protocol_version', PROTOCOL_VERSION), CHECKPOINT_INTERVAL)
+
+    # Start message
+    yield encoder.start({
+        'sessionId': request['session_id'] or request_id,
+        'messageId': request_id
+    })
+
+    try:
+        # Forward model output as Bedrock emits it, coalesced into fewer frames,
+        # interleaved with tool progress events
+        items = agent.stream_agent(formatted_messages, tools, llm=llm)
+        for item in coalesce_chunks(items, COALESCE_MAX_BYTES, COALESCE_MAX_DELAY):
+            if isinstance(item, str):
+                yield encoder.chunk(item)
+            else:
+                yield encoder.event(item['event'], item['data'])
+
+        if session:
+            session.record_turn(request['message'], encoder.content)
+
+        # End message
+        yield encoder.end({
+            'id': request_id,
+            'role': 'assistant',
+            'timestamp': datetime.utcnow().isoformat() + 'Z'
+        })
+
+    except Exception as agent_error:
+        logger.error(f"Agent error: {agent_error}")
+        yield encoder.error(f'Agent processing failed: {str(agent_error)}')
+
+    logger.info(f"Streaming response completed for user: {request['user'].get('sub', 'unknown')}")
+    logger.info(f"Agent registry stats: {json.dumps(get_stats())}")
+
+
+def local_stream(event: Dict[str, Any], context=None, llm=None) -> Iterator[str]:
+    """Yield SSE frames for an API Gateway style event without any AWS runtime
+
+    Error responses are yielded as their raw body so callers can assert on them.
+    """
+    request_id = getattr(context, 'aws_request_id', None) or str(uuid.uuid4())
+    request, error_response = _parse_stream_request(event)
+    if error_response:
+        if error_response['body']:
+            yield error_response['body']
+        return
+    yield from stream_chat_events(request, request_id, llm=llm)
+
+
+def response_stream_app(environ, start_response):
+    """WSGI entry point for Lambda response streaming via the Lambda Web Adapter
+
+    Run with AWS_LWA_INVOKE_MODE=response_stream so every frame is flushed to
+    the client as it is yielded, instead of being buffered like lambda_handler.
+    """
+    try:
+        length = int(environ.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        length = 0
+    event = {
+        'httpMethod': environ.get('REQUEST_METHOD', 'POST'),
+        'headers': {'Authorization': environ.get('HTTP_AUTHORIZATION', '')},
+        'body': environ['wsgi.input'].read(length).decode('utf-8') if length else '{}'
+    }
+    request_id = environ.get('HTTP_X_AMZN_REQUEST_ID') or str(uuid.uuid4())
+
+    try:
+        request, error_response = _parse_stream_request(event)
+    except Exception as e:
+        logger.error(f"Streaming handler error: {e}")
+        request, error_response = None, {
+            'statusCode': 500,
+            'headers': CORS_HEADERS,
+            'body': format_sse('error', {'error': 'Internal server error'})
         }
-        response_parts.append(f"data: {json.dumps(start_event)}\n\n")
 
-        # Generate response using regular model (simplified)
-        try:
-            # Use the regular ChatBedrock for now, streaming will be enhanced later
-            response = bedrock_llm_streaming.invoke(formatted_messages)
-            full_content = response.content if hasattr(response, 'content') else str(response)
-            
-            # Simulate streaming by breaking into chunks
-            words = full_content.split()
-            accumulated_content = ""
-            
-            for i, word in enumerate(words):
-                accumulated_content += word + " "
-                
-                chunk_event = {
-                    'event': 'chunk',
-                    'data': {
-                        'content': word + " ",
-                        'fullContent': accumulated_content.strip()
-                    }
-                }
-                response_parts.append(f"data: {json.dumps(chunk_event)}\n\n")
-                
-                # Add some chunks to simulate real streaming
-                if i % 3 == 0 and i > 0:
-                    time.sleep(0.1)  # Small delay to simulate real streaming
-
-            # End message
-            end_event = {
-                'event': 'end',
-                'data': {
-                    'message': {
-                        'id': context.aws_request_id,
-                        'content': accumulated_content.strip(),
-                        'role': 'assistant',
-                        'timestamp': datetime.utcnow().isoformat() + 'Z'
-                    }
-                }
-            }
-            response_parts.append(f"data: {json.dumps(end_event)}\n\n")
+    # WSGI servers own hop-by-hop headers such as Connection
+    headers = [(k, v) for k, v in CORS_HEADERS.items() if k != 'Connection']
 
-        except Exception as agent_error:
-            logger.error(f"Agent error: {agent_error}")
-            error_event = {
-                'event': 'error',
-                'data': {'error': f'Agent processing failed: {str(agent_error)}'}
-            }
-            response_parts.append(f"data: {json.dumps(error_event)}\n\n")
+    if error_response:
+        status = f"{error_response['statusCode']} {HTTPStatus(error_response['statusCode']).phrase}"
+        start_response(status, headers)
+        return [error_response['body'].encode('utf-8')]
+
+    start_response('200 OK', headers)
+    return iter_encoded(stream_chat_events(request, request_id))
+
+
+def lambda_handler(event, context):
+    """Lambda handler for streaming chat agent
+
+    API Gateway buffers proxy integrations, so this drains the same generator
+    used by response_stream_app into a single body.
+    """
+    logger.info(f"Streaming chat event: {json.dumps(event)}")
 
-        logger.info(f"Streaming response completed for user: {user.get('sub', 'unknown')}")
+    try:
+        request, error_response = _parse_stream_request(event)
+        if error_response:
+            return error_response
 
         return {
             'statusCode': 200,
-            'headers': cors_headers,
-            'body': ''.join(response_parts)
+            'headers': CORS_HEADERS,
+            'body': ''.join(stream_chat_events(request, context.aws_request_id))
         }
 
     except Exception as e:
         logger.error(f"Streaming handler error: {e}")
-        error_event = {
-            'event': 'error',
-            'data': {'error': 'Internal server error'}
-        }
         return {
             'statusCode': 500,
-            'headers': cors_headers,
-            'body': f"data: {json.dumps(error_event)}\n\n"
-        }
\ No newline at end of file
+            'headers': CORS_HEADERS,
+            'body': format_sse('error', {'error': 'Internal server error'})
+        }
+
+
+if __name__ == '__main__':
+    # Local streaming server: curl -N -X POST localhost:8080 -H 'Authorization: Bearer ...' -d '{"message": "hi"}'
+    from wsgiref.simple_server import make_server
+    make_server('', int(os.environ.get('PORT', '8080')), response_stream_app).serve_forever()
@@ -0,0 +1,114 @@
+import os
+import re
+import json
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger()
+
+# Default budget for system prompt + history + new message, in estimated tokens
+DEFAULT_TOKEN_BUDGET = int(os.environ.get('CONTEXT_TOKEN_BUDGET', '24000'))
+# Older messages larger than this are elided before they count against the budget
+DEFAULT_MESSAGE_TOKEN_CAP = int(os.environ.get('CONTEXT_MESSAGE_TOKEN_CAP', '4000'))
+
+# Role/formatting overhead per message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_DATA_URL = re.compile(r'data:image/[\w.+-]+;base64,[A-Za-z0-9+/=\s]+')
+_BASE64_RUN = re.compile(r'[A-Za-z0-9+/]{1024,}={0,2}')
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximate Claude token count without a tokenizer or network call
+
+    Latin text averages about four characters per token, while Japanese and
+    other non-ASCII scripts are close to one token per character. Both counts
+    come from C-level len() calls, so this stays cheap on long histories.
+    """
+    if not text:
+        return 0
+    chars = len(text)
+    # Non-ASCII code points encode to 2-4 bytes; CJK (the common case) to 3
+    non_ascii = min(chars, (len(text.encode('utf-8')) - chars) // 2)
+    return (chars - non_ascii + 3) // 4 + non_ascii
+
+
+def estimate_message_tokens(message: Dict[str, Any]) -> int:
+    content = message.get('content', '')
+    if not isinstance(content, str):
+        content = json.dumps(content, ensure_ascii=False)
+    return estimate_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+
+
+def elide_content(content: str, max_tokens: int) -> str:
+    """Drop inline images and cut the middle out of an oversized message"""
+    content = _DATA_URL.sub('[image omitted]', content)
+    content = _BASE64_RUN.sub('[binary data omitted]', content)
+
+    tokens = estimate_tokens(content)
+    if tokens <= max_tokens:
+        return content
+
+    # Keep the head and tail, which usually carry the question and conclusion
+    keep_chars = max(1, int(len(content) * max_tokens / tokens) // 2)
+    elided = tokens - max_tokens
+    return f"{content[:keep_chars]}\n…[{elided} tokens elided]…\n{content[-keep_chars:]}"
+
+
+def pack_messages(messages: List[Dict[str, Any]], system_prompt: str = '',
+                  budget_tokens: Optional[int] = None,
+                  message_token_cap: Optional[int] = None) -> Tuple[List[Dict[str, Any]], Dict[str, int]]:
+    """Fit the system prompt plus the most recent turns into a token budget
+
+    The newest message is always kept as is. Older messages are walked from
+    newest to oldest; each one over message_token_cap is elided first, and
+    the walk stops at the first message that no longer fits. The result
+    always starts with a user turn, as the Messages API requires.
+    """
+    budget_tokens = budget_tokens or DEFAULT_TOKEN_BUDGET
+    message_token_cap = message_token_cap or DEFAULT_MESSAGE_TOKEN_CAP
+
+    stats = {
+        'original_messages': len(messages),
+        'original_tokens': estimate_tokens(system_prompt) + sum(estimate_message_tokens(m) for m in messages),
+        'elided_messages': 0,
+        'dropped_messages': 0,
+    }
+    if not messages:
+        stats.update(kept_tokens=stats['original_tokens'], trimmed_tokens=0)
+        return [], stats
+
+    latest = messages[-1]
+    used = estimate_tokens(system_prompt) + estimate_message_tokens(latest)
+    kept: List[Dict[str, Any]] = []
+
+    for message in reversed(messages[:-1]):
+        content = message.get('content', '')
+        if isinstance(content, str) and estimate_tokens(content) > message_token_cap:
+            message = {**message, 'content': elide_content(content, message_token_cap)}
+            stats['elided_messages'] += 1
+        cost = estimate_message_tokens(message)
+        if used + cost > budget_tokens:
+            break
+        kept.append(message)
+        used += cost
+
+    kept.reverse()
+    # Never open the conversation with an assistant turn
+    while kept and kept[0].get('role') != 'user':
+        used -= estimate_message_tokens(kept.pop(0))
+
+    packed = kept + [latest]
+    stats['dropped_messages'] = len(messages) - len(packed)
+    stats['kept_tokens'] = used
+    stats['trimmed_tokens'] = max(0, stats['original_tokens'] - used)
+    return packed, stats
+
+
+def log_packing(handler_name: str, stats: Dict[str, int]) -> None:
+    """Log how much history was trimmed for one request"""
+    logger.info(
+        f"CONTEXT_PACKING: {handler_name} | messages: {stats['original_messages']} | "
+        f"dropped: {stats['dropped_messages']} | elided: {stats['elided_messages']} | "
+        f"tokens: {stats['original_tokens']} -> {stats['kept_tokens']} | trimmed: {stats['trimmed_tokens']}"
+    )
@@ -0,0 +1,19 @@
+import os
+import json
+from typing import List
+from lazy import LazyClient
+
+# Shared by the semantic response cache and the local knowledge base index
+EMBEDDING_MODEL_ID = os.environ.get('EMBEDDING_MODEL_ID') or os.environ.get('RESPONSE_CACHE_EMBED_MODEL', 'amazon.titan-embed-text-v2:0')
+EMBEDDING_DIMENSIONS = 256
+
+bedrock_client = LazyClient('bedrock-runtime')
+
+
+def titan_embed(text: str) -> List[float]:
+    """Unit-length embedding from Titan Text Embeddings v2"""
+    response = bedrock_client.invoke_model(
+        modelId=EMBEDDING_MODEL_ID,
+        body=json.dumps({'inputText': text, 'dimensions': EMBEDDING_DIMENSIONS, 'normalize': True})
+    )
+    return json.loads(response['body'].read())['embedding']
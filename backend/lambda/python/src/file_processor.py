@@ -1,32 +1,81 @@
 import json
-import boto3
 import os
+import time
 import logging
-from typing import Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional
 from urllib.parse import unquote_plus
 import tempfile
+from lazy import LazyClient
+from ingestion_scheduler import get_ingestion_scheduler
+from processing_manifest import content_fingerprint, manifests_for
+from retrieval_cache import bump_kb_generation
+from text_extraction import (
+    DOCX_TYPE, EXTRACT_SPOOL_MAX_BYTES, PDF_TYPE, ExtractionBudget, UnsupportedDocumentError,
+    extract_sections, open_spooled, write_outputs
+)
+from vector_index import (
+    KB_LOCAL_INDEX_ENABLED, SHARD_DIR, chunk_text, index_document, kb_document_uris, mark_skipped, rebuild_index,
+    shard_name, store_for
+)
 
 # Configure logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-# AWS clients
-s3_client = boto3.client('s3')
-bedrock_agent_client = boto3.client('bedrock-agent')
+# Records processed in parallel; the default scales with the function's memory size
+def _default_workers() -> int:
+    memory_mb = int(os.environ.get('AWS_LAMBDA_FUNCTION_MEMORY_SIZE', '1024'))
+    return max(2, min(16, memory_mb // 128))
+
+FILE_PROCESSOR_WORKERS = int(os.environ.get('FILE_PROCESSOR_WORKERS', '0')) or _default_workers()
+
+# Copies above the threshold run as parallel UploadPartCopy requests instead of one CopyObject
+FILE_COPY_MULTIPART_THRESHOLD = int(os.environ.get('FILE_COPY_MULTIPART_THRESHOLD_MB', '64')) * 1024 * 1024
+FILE_COPY_PART_SIZE = int(os.environ.get('FILE_COPY_PART_SIZE_MB', '32')) * 1024 * 1024
+FILE_COPY_MAX_CONCURRENCY = int(os.environ.get('FILE_COPY_MAX_CONCURRENCY', '4'))
+
+# Re-uploads of identical content link to the first upload's outputs instead of being reprocessed
+FILE_DEDUP_ENABLED = os.environ.get('FILE_DEDUP_ENABLED', 'true').lower() == 'true'
+
+DOCUMENT_CONTENT_TYPES = ['application/pdf', 'text/plain', 'application/msword',
+                          'application/vnd.openxmlformats-officedocument.wordprocessingml.document']
+
+# Page-numbered JSONL of extracted text; the plain text goes to knowledge-base/
+EXTRACTED_TEXT_PREFIX = os.environ.get('EXTRACTED_TEXT_PREFIX', 'processed/text/')
+
+# AWS clients; enough pooled connections for every worker to have two calls in flight
+s3_client = LazyClient('s3', config={'max_pool_connections': max(10, FILE_PROCESSOR_WORKERS * 2)})
+
+_record_executor = ThreadPoolExecutor(max_workers=FILE_PROCESSOR_WORKERS, thread_name_prefix='file-record')
 
 def handler(event, context):
     """Lambda handler for S3 file processing"""
     logger.info(f"File processor event: {json.dumps(event)}")
     
+    # Invoked by hand: {"action": "backfill_local_index"[, "bucket": "..."]}
+    if event.get('action') == 'backfill_local_index':
+        bucket = event.get('bucket') or os.environ.get('S3_BUCKET', '').replace('s3://', '')
+        return {'statusCode': 200, 'body': json.dumps(backfill_local_index(bucket))}
+    
     try:
         # Process S3 event
-        for record in event.get('Records', []):
-            if record.get('eventSource') == 'aws:s3':
-                process_s3_object(record)
+        records = [record for record in event.get('Records', []) if record.get('eventSource') == 'aws:s3']
+        failures = process_records(records, getattr(context, 'aws_request_id', ''))
+        
+        if failures:
+            return {
+                'statusCode': 500,
+                'body': json.dumps({
+                    'error': f'{len(failures)} of {len(records)} files failed',
+                    'processed': len(records) - len(failures),
+                    'failed': failures
+                })
+            }
         
         return {
             'statusCode': 200,
-            'body': json.dumps({'message': 'Files processed successfully'})
+            'body': json.dumps({'message': 'Files processed successfully', 'processed': len(records)})
         }
         
     except Exception as e:
@@ -36,8 +85,77 @@ def handler(event, context):
             'body': json.dumps({'error': str(e)})
         }
 
-def process_s3_object(record: Dict[str, Any]):
-    """Process uploaded S3 object"""
+def _record_key(record: Dict[str, Any]) -> str:
+    try:
+        return unquote_plus(record['s3']['object']['key'])
+    except (KeyError, TypeError):
+        return 'unknown'
+
+def process_records(records: List[Dict[str, Any]], request_id: str = '') -> List[Dict[str, str]]:
+    """Process S3 records concurrently; one failing record does not stop the others
+
+    Returns the failures, in record order, as {'key', 'error'} dicts.
+    """
+    start = time.time()
+    futures = [_record_executor.submit(process_s3_object, record, request_id) for record in records]
+    
+    failures = []
+    indexed_buckets = set()
+    for record, future in zip(records, futures):
+        try:
+            manifest = future.result()
+            if manifest and manifest.get('indexedChunks') is not None:
+                indexed_buckets.add(record['s3']['bucket']['name'])
+        except Exception as e:
+            failures.append({'key': _record_key(record), 'error': str(e)})
+    
+    # One merge per batch, however many documents it added
+    for bucket in indexed_buckets:
+        try:
+            rebuild_index(store_for(bucket), bucket)
+        except Exception as e:
+            logger.warning(f"Local index rebuild failed; searches use Bedrock until the next one: {e}")
+    
+    logger.info(
+        f"FILE_PROCESSOR: records: {len(records)} | failed: {len(failures)} | "
+        f"workers: {min(FILE_PROCESSOR_WORKERS, len(records))} | elapsed_ms: {(time.time() - start) * 1000:.0f}"
+    )
+    return failures
+
+def copy_s3_object(bucket: str, source_key: str, dest_key: str, size: int):
+    """Server-side copy; large objects are copied as parallel parts"""
+    if size < FILE_COPY_MULTIPART_THRESHOLD:
+        s3_client.copy_object(
+            Bucket=bucket,
+            Key=dest_key,
+            CopySource={'Bucket': bucket, 'Key': source_key}
+        )
+        return
+    
+    from boto3.s3.transfer import TransferConfig
+    s3_client.copy(
+        {'Bucket': bucket, 'Key': source_key},
+        bucket,
+        dest_key,
+        Config=TransferConfig(
+            multipart_threshold=FILE_COPY_MULTIPART_THRESHOLD,
+            multipart_chunksize=FILE_COPY_PART_SIZE,
+            max_concurrency=FILE_COPY_MAX_CONCURRENCY
+        )
+    )
+    logger.info(f"Multipart copy: {source_key} -> {dest_key} | bytes: {size}")
+
+def _dedup_scope(content_type: str, user_id: str) -> Optional[str]:
+    """Who may share a processed artifact: everyone for knowledge base documents, the uploader for images"""
+    if content_type in DOCUMENT_CONTENT_TYPES:
+        return 'documents'
+    if content_type.startswith('image/'):
+        return f"images/{user_id or 'anonymous'}"
+    return None
+
+def process_s3_object(record: Dict[str, Any], request_id: str = '') -> Optional[Dict[str, Any]]:
+    """Process uploaded S3 object; returns the manifest written for it, if any"""
+    manifest = None
     try:
         # Extract S3 information
         bucket = record['s3']['bucket']['name']
@@ -48,12 +166,20 @@ def process_s3_object(record: Dict[str, Any]):
         # Check if file is in uploads/ directory
         if not key.startswith('uploads/'):
             logger.info(f"Skipping file not in uploads directory: {key}")
-            return
+            return None
         
         # Get file metadata
-        response = s3_client.head_object(Bucket=bucket, Key=key)
+        response = s3_client.head_object(Bucket=bucket, Key=key, ChecksumMode='ENABLED')
         metadata = response.get('Metadata', {})
         content_type = response.get('ContentType', '')
+        etag = response.get('ETag', '').strip('"')
+        size = response.get('ContentLength', 0)
+        
+        # S3 delivers events at least once; skip versions that are already done
+        manifests = manifests_for(bucket)
+        if manifests.is_processed(key, etag):
+            logger.info(f"Skipping already processed file: {key} ({etag})")
+            return None
         
         user_id = metadata.get('userid', '')
         original_name = metadata.get('originalname', '')
@@ -61,36 +187,67 @@ def process_s3_object(record: Dict[str, Any]):
         
         logger.info(f"File metadata - User: {user_id}, Original: {original_name}, ID: {file_id}")
         
+        manifest = {
+            'etag': etag,
+            'size': size,
+            'contentType': content_type,
+            'userId': user_id,
+            'fileId': file_id,
+            'originalName': original_name,
+            'requestId': request_id
+        }
+        
+        # Identical content already processed: link to its outputs and skip copying, extraction and ingestion
+        scope = _dedup_scope(content_type, user_id) if FILE_DEDUP_ENABLED else None
+        if scope:
+            manifest['fingerprint'] = content_fingerprint(bucket, key, response)
+            original = manifests.find_original(scope, manifest['fingerprint'])
+            if original and original['sourceKey'] != key:
+                manifest = {
+                    **manifest,
+                    'status': 'duplicate',
+                    'duplicateOf': original['sourceKey'],
+                    'outputs': original.get('outputs', [])
+                }
+                manifests.put(key, manifest)
+                logger.info(f"Duplicate upload: {key} has the same content as {original['sourceKey']}")
+                return manifest
+        
         # Process based on file type
+        output_key = None
         if content_type.startswith('image/'):
-            process_image_file(bucket, key, metadata)
-        elif content_type in ['application/pdf', 'text/plain', 'application/msword', 
-                             'application/vnd.openxmlformats-officedocument.wordprocessingml.document']:
-            process_document_file(bucket, key, metadata)
+            output_key = process_image_file(bucket, key, metadata, size)
+        elif content_type in DOCUMENT_CONTENT_TYPES:
+            output_key = process_document_file(bucket, key, metadata, size, content_type)
+            if output_key and KB_LOCAL_INDEX_ENABLED:
+                manifest['indexedChunks'] = index_kb_document(bucket, output_key, content_type)
         else:
             logger.warning(f"Unsupported file type: {content_type}")
         
-        # Update file status in metadata
-        s3_client.copy_object(
-            Bucket=bucket,
-            Key=key,
-            CopySource={'Bucket': bucket, 'Key': key},
-            Metadata={
-                **metadata,
-                'processed': 'true',
-                'processed_at': context.aws_request_id
-            },
-            MetadataDirective='REPLACE'
-        )
+        # Record file status in the manifest; the upload itself is left untouched
+        manifest = {
+            **manifest,
+            'status': 'processed',
+            'outputs': [output_key] if output_key else []
+        }
+        manifests.put(key, manifest)
+        if scope and output_key:
+            manifests.record_fingerprint(scope, manifest['fingerprint'], key)
         
         logger.info(f"Successfully processed file: {key}")
+        return manifest
         
     except Exception as e:
         logger.error(f"Error processing S3 object {record}: {e}")
+        if manifest is not None:
+            try:
+                manifests.put(key, {**manifest, 'status': 'failed', 'error': str(e)})
+            except Exception as manifest_error:
+                logger.warning(f"Could not record failure for {key}: {manifest_error}")
         raise
 
-def process_image_file(bucket: str, key: str, metadata: Dict[str, str]):
-    """Process image file for multimodal analysis"""
+def process_image_file(bucket: str, key: str, metadata: Dict[str, str], size: int) -> str:
+    """Process image file for multimodal analysis; returns the processed key"""
     try:
         logger.info(f"Processing image file: {key}")
         
@@ -100,72 +257,141 @@ def process_image_file(bucket: str, key: str, metadata: Dict[str, str]):
         
         # Move to processed folder
         processed_key = key.replace('uploads/', 'processed/images/')
-        s3_client.copy_object(
-            Bucket=bucket,
-            Key=processed_key,
-            CopySource={'Bucket': bucket, 'Key': key}
-        )
+        copy_s3_object(bucket, key, processed_key, size)
+        return processed_key
         
     except Exception as e:
         logger.error(f"Error processing image file {key}: {e}")
         raise
 
-def process_document_file(bucket: str, key: str, metadata: Dict[str, str]):
-    """Process document file for knowledge base ingestion"""
+def extract_document(bucket: str, key: str, content_type: str) -> Optional[str]:
+    """Extract text into the knowledge base prefix; returns the text key
+
+    Returns None when there was no text, or when the extraction budget ran
+    out: the caller then copies the original, so Bedrock ingests the whole
+    document instead of a truncated text.
+    """
+    text_key = key.replace('uploads/', 'knowledge-base/') + '.txt'
+    jsonl_key = key.replace('uploads/', EXTRACTED_TEXT_PREFIX) + '.jsonl'
+    budget = ExtractionBudget()
+    start = time.time()
+    
+    with open_spooled(bucket, key) as source, \
+            tempfile.SpooledTemporaryFile(max_size=EXTRACT_SPOOL_MAX_BYTES) as text_out, \
+            tempfile.SpooledTemporaryFile(max_size=EXTRACT_SPOOL_MAX_BYTES) as jsonl_out:
+        sections = write_outputs(extract_sections(source, content_type, budget), text_out, jsonl_out, key)
+        if sections and not budget.exhausted:
+            text_out.seek(0)
+            jsonl_out.seek(0)
+            s3_client.upload_fileobj(text_out, bucket, text_key, ExtraArgs={'ContentType': 'text/plain; charset=utf-8'})
+            s3_client.upload_fileobj(jsonl_out, bucket, jsonl_key, ExtraArgs={'ContentType': 'application/x-ndjson'})
+    
+    logger.info(
+        f"EXTRACT: {key} | sections: {sections} | pages: {budget.pages} | "
+        f"truncated: {budget.exhausted or 'no'} | elapsed_ms: {(time.time() - start) * 1000:.0f}"
+    )
+    if budget.exhausted:
+        logger.warning(f"Extraction of {key} stopped at the {budget.exhausted}; publishing the original instead")
+        return None
+    return text_key if sections else None
+
+def process_document_file(bucket: str, key: str, metadata: Dict[str, str], size: int,
+                          content_type: str = '') -> Optional[str]:
+    """Process document file for knowledge base ingestion; returns the knowledge base key"""
     try:
         logger.info(f"Processing document file: {key}")
         
         knowledge_base_id = os.environ.get('KNOWLEDGE_BASE_ID')
         if not knowledge_base_id:
             logger.warning("Knowledge base ID not configured, skipping document processing")
-            return
+            return None
         
-        # Move to knowledge base data source location
-        kb_key = key.replace('uploads/', 'knowledge-base/')
-        s3_client.copy_object(
-            Bucket=bucket,
-            Key=kb_key,
-            CopySource={'Bucket': bucket, 'Key': key}
-        )
+        kb_key = None
+        if content_type in (PDF_TYPE, DOCX_TYPE):
+            try:
+                kb_key = extract_document(bucket, key, content_type)
+            except Exception as e:
+                # The knowledge base can still parse the original itself
+                logger.warning(f"Text extraction failed for {key}, copying the original: {e}")
+        
+        if kb_key is None:
+            # Move to knowledge base data source location
+            kb_key = key.replace('uploads/', 'knowledge-base/')
+            copy_s3_object(bucket, key, kb_key, size)
         
         logger.info(f"Document moved to knowledge base location: {kb_key}")
         
-        # Trigger knowledge base sync (if configured)
+        # Chat handlers drop cached retrievals once they see the new generation
+        bump_kb_generation(bucket, knowledge_base_id, kb_key)
+        
+        # Trigger knowledge base sync (if configured); one job covers every document queued in the window
         try:
-            # Note: This would trigger a knowledge base ingestion job
-            # For now, we'll just log the action
-            logger.info(f"Document {kb_key} ready for knowledge base ingestion")
-            
-            # In production, you might trigger:
-            # bedrock_agent_client.start_ingestion_job(
-            #     knowledgeBaseId=knowledge_base_id,
-            #     dataSourceId=data_source_id
-            # )
+            scheduler = get_ingestion_scheduler()
+            if scheduler is not None:
+                scheduler.enqueue(kb_key)
+            else:
+                logger.info(f"Document {kb_key} ready for knowledge base ingestion (no data source configured)")
             
         except Exception as e:
             logger.warning(f"Could not trigger knowledge base sync: {e}")
         
+        return kb_key
+        
     except Exception as e:
         logger.error(f"Error processing document file {key}: {e}")
         raise
 
+def index_kb_document(bucket: str, kb_key: str, content_type: str) -> Optional[int]:
+    """Add a knowledge base document to the local vector index; returns its chunk count, or None on failure"""
+    try:
+        if kb_key.endswith('.txt'):
+            content_type = 'text/plain'
+        with open_spooled(bucket, kb_key) as source:
+            sections = (section['text'] for section in extract_sections(source, content_type))
+            return index_document(store_for(bucket), f"s3://{bucket}/{kb_key}", chunk_text(sections))
+    except Exception as e:
+        # Bedrock retrieval still covers the document; marked so it does not keep the index incomplete
+        logger.warning(f"Local index skipped for {kb_key}: {e}")
+        try:
+            mark_skipped(store_for(bucket), f"s3://{bucket}/{kb_key}", str(e))
+        except Exception as marker_error:
+            logger.warning(f"Could not mark {kb_key} as skipped: {marker_error}")
+        return None
+
+def backfill_local_index(bucket: str) -> Dict[str, int]:
+    """Index every knowledge-base/ document that has no shard yet, then rebuild
+
+    Covers documents that reached the knowledge base before the local index
+    existed or without going through this function. Already indexed documents
+    are skipped, so a run cut short by the timeout can simply be repeated;
+    documents marked skipped by an earlier failure are tried again.
+    """
+    store = store_for(bucket)
+    indexed = {name[:-len('.json')] for name in store.list(SHARD_DIR) if name.endswith('.json')}
+    missing = sorted(uri for uri in kb_document_uris(bucket) if shard_name(uri) not in indexed)
+    
+    def index_missing(uri: str) -> bool:
+        kb_key = uri[len(f"s3://{bucket}/"):]
+        try:
+            content_type = s3_client.head_object(Bucket=bucket, Key=kb_key).get('ContentType', '')
+        except Exception as e:
+            logger.warning(f"Local index skipped for {kb_key}: {e}")
+            return False
+        return index_kb_document(bucket, kb_key, content_type) is not None
+    
+    indexed_now = sum(_record_executor.map(index_missing, missing))
+    chunks = rebuild_index(store, bucket)
+    logger.info(f"FILE_PROCESSOR: backfilled local index | missing: {len(missing)} | indexed: {indexed_now} | chunks: {chunks}")
+    return {'missing': len(missing), 'indexed': indexed_now, 'chunks': chunks}
+
 def extract_text_from_file(bucket: str, key: str, content_type: str) -> str:
-    """Extract text from various file types"""
+    """Extract text from various file types, within the default page and time budget"""
     try:
-        # Download file to temporary location
-        with tempfile.NamedTemporaryFile() as tmp_file:
-            s3_client.download_fileobj(bucket, key, tmp_file)
-            tmp_file.seek(0)
-            
-            if content_type == 'text/plain':
-                return tmp_file.read().decode('utf-8')
-            elif content_type == 'application/pdf':
-                # For production, implement PDF text extraction
-                # Could use PyPDF2, pdfplumber, or AWS Textract
-                return "PDF text extraction not implemented"
-            else:
-                return "Text extraction not supported for this file type"
-                
+        with open_spooled(bucket, key) as source:
+            return '\n\n'.join(section['text'] for section in extract_sections(source, content_type))
+    
+    except UnsupportedDocumentError:
+        return "Text extraction not supported for this file type"
     except Exception as e:
         logger.error(f"Error extracting text from {key}: {e}")
         return f"Error extracting text: {str(e)}"
\ No newline at end of file
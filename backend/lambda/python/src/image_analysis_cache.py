@@ -0,0 +1,144 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+from datetime import datetime
+from typing import Callable, Optional
+from lazy import LazyClient, lazy_singleton
+from ttl_cache import TTLCache, SingleFlight
+
+logger = logging.getLogger()
+
+# Stored next to processed/images/ in the uploads bucket
+IMAGE_ANALYSIS_CACHE_PREFIX = os.environ.get('IMAGE_ANALYSIS_CACHE_PREFIX', 'processed/image-analysis/')
+# Local directory used instead of S3, for local runs and tests
+IMAGE_ANALYSIS_CACHE_DIR = os.environ.get('IMAGE_ANALYSIS_CACHE_DIR', '')
+IMAGE_ANALYSIS_CACHE_ENABLED = os.environ.get('IMAGE_ANALYSIS_CACHE_ENABLED', 'true').lower() == 'true'
+# In-container copies; analyses are a few KB each
+IMAGE_ANALYSIS_MEMORY_ENTRIES = 128
+IMAGE_ANALYSIS_MEMORY_TTL_SECONDS = 3600
+
+s3_client = LazyClient('s3')
+
+
+class S3AnalysisStore:
+    def __init__(self, bucket: str, prefix: str = IMAGE_ANALYSIS_CACHE_PREFIX):
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def get(self, name: str) -> Optional[bytes]:
+        try:
+            return s3_client.get_object(Bucket=self.bucket, Key=self.prefix + name)['Body'].read()
+        except Exception as e:
+            code = str(getattr(e, 'response', {}).get('Error', {}).get('Code', ''))
+            if code not in ('NoSuchKey', '404', '403'):
+                logger.warning(f"Image analysis cache read failed: {e}")
+            return None
+
+    def put(self, name: str, data: bytes) -> None:
+        s3_client.put_object(Bucket=self.bucket, Key=self.prefix + name, Body=data, ContentType='application/json')
+
+
+class LocalAnalysisStore:
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def get(self, name: str) -> Optional[bytes]:
+        try:
+            with open(os.path.join(self.path, name), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, name: str, data: bytes) -> None:
+        # Write then rename so concurrent readers never see a partial file
+        target = os.path.join(self.path, name)
+        temp = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp, 'wb') as f:
+            f.write(data)
+        os.replace(temp, target)
+
+
+class ImageAnalysisCache:
+    """Content-addressed cache of vision analyses
+
+    Entries are named by the SHA-256 of the (preprocessed) image bytes plus
+    a hash of the prompt and model id, so the same chart uploaded twice, or
+    analyzed twice in one ReAct run, costs one Bedrock call. Lookups check
+    the container's memory first, then the persistent store.
+    """
+
+    def __init__(self, store=None, enabled: bool = True):
+        self.store = store
+        self.enabled = enabled
+        self.memory = TTLCache(max_entries=IMAGE_ANALYSIS_MEMORY_ENTRIES, ttl_seconds=IMAGE_ANALYSIS_MEMORY_TTL_SECONDS)
+        self._flight = SingleFlight()
+
+    @staticmethod
+    def entry_name(image_hash: str, prompt: str, model_id: str) -> str:
+        request_hash = hashlib.sha256(f"{model_id}\n{prompt}".encode('utf-8')).hexdigest()[:16]
+        return f"{image_hash}-{request_hash}.json"
+
+    def _load(self, name: str) -> Optional[str]:
+        if self.store is None:
+            return None
+        data = self.store.get(name)
+        if not data:
+            return None
+        try:
+            return json.loads(data)['analysis']
+        except (ValueError, KeyError) as e:
+            logger.warning(f"Ignoring unreadable image analysis cache entry {name}: {e}")
+            return None
+
+    def _save(self, name: str, analysis: str, image_size: int, model_id: str) -> None:
+        if self.store is None:
+            return
+        try:
+            self.store.put(name, json.dumps({
+                'analysis': analysis,
+                'modelId': model_id,
+                'imageBytes': image_size,
+                'createdAt': datetime.utcnow().isoformat() + 'Z'
+            }, ensure_ascii=False).encode('utf-8'))
+        except Exception as e:
+            # A failed write only costs a future cache miss
+            logger.warning(f"Image analysis cache write failed: {e}")
+
+    def get_or_analyze(self, image_hash: str, image_size: int, prompt: str, model_id: str,
+                       analyze: Callable[[], str]) -> str:
+        """Cached analysis for the image with this SHA-256 and prompt, calling analyze() on a miss"""
+        if not self.enabled:
+            return analyze()
+        name = self.entry_name(image_hash, prompt, model_id)
+        analysis = self.memory.get(name)
+        if analysis is not None:
+            logger.info(f"Image analysis cache hit (memory): {name}")
+            return analysis
+
+        def fill() -> str:
+            analysis = self._load(name)
+            if analysis is not None:
+                logger.info(f"Image analysis cache hit (store): {name}")
+            else:
+                analysis = analyze()
+                if analysis:
+                    self._save(name, analysis, image_size, model_id)
+            if analysis:
+                self.memory.set(name, analysis)
+            return analysis
+
+        return self._flight.do(name, fill)
+
+
+@lazy_singleton
+def get_image_analysis_cache() -> ImageAnalysisCache:
+    """Cache backed by IMAGE_ANALYSIS_CACHE_DIR if set, else by S3_BUCKET, else memory only"""
+    if not IMAGE_ANALYSIS_CACHE_ENABLED:
+        return ImageAnalysisCache(enabled=False)
+    if IMAGE_ANALYSIS_CACHE_DIR:
+        return ImageAnalysisCache(LocalAnalysisStore(IMAGE_ANALYSIS_CACHE_DIR))
+    bucket = os.environ.get('S3_BUCKET', '').replace('s3://', '')
+    return ImageAnalysisCache(S3AnalysisStore(bucket) if bucket else None)
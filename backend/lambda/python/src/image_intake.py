@@ -0,0 +1,222 @@
+import io
+import os
+import re
+import sys
+import base64
+import hashlib
+import logging
+import resource
+from typing import Any, Dict, Tuple
+from lazy import LazyClient, LazyModule
+from image_preprocess import EXIF_ORIENTATION, IMAGE_LOSSLESS_MAX_BYTES, IMAGE_MAX_EDGE, prepare_image
+
+pil_image = LazyModule('PIL.Image')
+
+logger = logging.getLogger()
+
+s3_client = LazyClient('s3')
+
+# Larger images are rejected before they are downloaded or decoded
+IMAGE_MAX_INPUT_BYTES = int(os.environ.get('IMAGE_MAX_INPUT_BYTES', str(20 * 1024 * 1024)))
+# Decoded size guard: 40 MP is about 120 MB as RGB
+IMAGE_MAX_PIXELS = int(os.environ.get('IMAGE_MAX_PIXELS', '40000000'))
+
+SUPPORTED_FORMATS = ['jpeg', 'jpg', 'png', 'gif', 'webp']
+INVALID_IMAGE_MESSAGE = "Invalid image format. Please provide a valid image URL, S3 key, or base64 data."
+
+# Base64 characters decoded to read an image's header and metadata (~48 KB)
+_HEADER_B64_CHARS = 64 * 1024
+# Base64 characters hashed per step when hashing a payload without decoding it whole
+_HASH_B64_CHARS = 1024 * 1024
+_WHITESPACE = re.compile(r'\s')
+# Bucket keys like uploads/<user>/<file>.png; base64 can contain '/' too, so require an extension
+_S3_KEY = re.compile(r'^[^\s]{1,1024}/[^/\s]+\.[A-Za-z]{3,4}$')
+# Pillow info keys that only carry technical data needed to render the pixels
+_TECHNICAL_INFO = {'dpi', 'gamma', 'transparency', 'icc_profile', 'srgb', 'chromaticity', 'aspect',
+                   'jfif', 'jfif_version', 'jfif_unit', 'jfif_density', 'adobe', 'adobe_transform',
+                   'progressive', 'progression', 'interlace', 'loop', 'duration', 'background', 'version'}
+
+
+class ImageIntakeError(Exception):
+    """The image cannot be used; the message is returned to the model as the tool result"""
+
+
+class ImageInput:
+    """An image ready for a vision request, held only as base64"""
+
+    def __init__(self, b64: str, image_format: str, size: int, sha256: str, passthrough: bool):
+        self.b64 = b64
+        self.image_format = image_format
+        self.size = size
+        self.sha256 = sha256
+        self.passthrough = passthrough
+
+    @property
+    def media_type(self) -> str:
+        return f"image/{self.image_format}"
+
+    def anthropic_block(self) -> Dict[str, Any]:
+        """Messages API image block; also accepted as-is by ChatBedrock"""
+        return {
+            "type": "image",
+            "source": {
+                "type": "base64",
+                "media_type": self.media_type,
+                "data": self.b64
+            }
+        }
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+def _normalize_format(image_format: str) -> str:
+    image_format = (image_format or '').lower()
+    return 'jpeg' if image_format == 'jpg' else image_format
+
+
+def _check_size(size: int) -> None:
+    if size > IMAGE_MAX_INPUT_BYTES:
+        raise ImageIntakeError(
+            f"Image is too large ({size / (1024 * 1024):.1f} MB). "
+            f"Maximum size is {IMAGE_MAX_INPUT_BYTES / (1024 * 1024):.0f} MB."
+        )
+
+
+def _check_format(image_format: str) -> None:
+    if image_format not in SUPPORTED_FORMATS:
+        raise ImageIntakeError(
+            f"Unsupported image format: {image_format}. Supported formats: {', '.join(SUPPORTED_FORMATS)}"
+        )
+
+
+def _check_pixels(width: int, height: int) -> None:
+    if width * height > IMAGE_MAX_PIXELS:
+        raise ImageIntakeError(
+            f"Image dimensions {width}x{height} exceed the {IMAGE_MAX_PIXELS // 1000000} megapixel limit."
+        )
+
+
+def _probe(header: bytes) -> Tuple[str, int, int, bool]:
+    """(format, width, height, is_ready) from the first bytes of an image
+
+    is_ready means the image can be sent unchanged: upright and carrying no
+    metadata beyond what is needed to render it.
+    """
+    image = pil_image.open(io.BytesIO(header))
+    width, height = image.size
+    upright = image.getexif().get(EXIF_ORIENTATION, 1) == 1
+    has_metadata = bool(set(image.info) - _TECHNICAL_INFO)
+    return _normalize_format(image.format), width, height, upright and not has_metadata
+
+
+def _decoded_size(payload: str) -> int:
+    return len(payload) * 3 // 4 - payload[-2:].count('=')
+
+
+def _b64_sha256(payload: str) -> str:
+    """SHA-256 of the decoded bytes, decoding a chunk at a time"""
+    digest = hashlib.sha256()
+    for start in range(0, len(payload), _HASH_B64_CHARS):
+        digest.update(base64.b64decode(payload[start:start + _HASH_B64_CHARS]))
+    return digest.hexdigest()
+
+
+def _from_bytes(data: bytes, image_format: str) -> ImageInput:
+    """Downscale/strip through prepare_image, then encode once"""
+    try:
+        width, height = pil_image.open(io.BytesIO(data)).size
+    except Exception:
+        raise ImageIntakeError(INVALID_IMAGE_MESSAGE)
+    _check_pixels(width, height)
+    data, image_format = prepare_image(data, image_format)
+    return ImageInput(base64.b64encode(data).decode('ascii'), image_format, len(data),
+                      hashlib.sha256(data).hexdigest(), passthrough=False)
+
+
+def _from_base64(payload: str, declared_format: str) -> ImageInput:
+    if _WHITESPACE.search(payload):
+        payload = _WHITESPACE.sub('', payload)
+    size = _decoded_size(payload)
+    _check_size(size)
+
+    try:
+        image_format, width, height, ready = _probe(base64.b64decode(payload[:_HEADER_B64_CHARS]))
+    except Exception:
+        # Header not readable from the prefix; fall back to a full decode
+        if not declared_format:
+            raise ImageIntakeError(INVALID_IMAGE_MESSAGE)
+        image_format, width, height, ready = _normalize_format(declared_format), 0, 0, False
+    _check_format(image_format)
+    _check_pixels(width, height)
+
+    if ready and max(width, height) <= IMAGE_MAX_EDGE and size <= IMAGE_LOSSLESS_MAX_BYTES:
+        # Already small and clean: send the client's base64 as is
+        return ImageInput(payload, image_format, size, _b64_sha256(payload), passthrough=True)
+
+    try:
+        data = base64.b64decode(payload)
+    except Exception:
+        raise ImageIntakeError(INVALID_IMAGE_MESSAGE)
+    del payload
+    return _from_bytes(data, image_format)
+
+
+def _from_s3(bucket: str, key: str) -> ImageInput:
+    image_format = _normalize_format(key.split('.')[-1])
+    _check_format(image_format)
+    try:
+        # Size check before any bytes are transferred
+        _check_size(s3_client.head_object(Bucket=bucket, Key=key)['ContentLength'])
+        body = s3_client.get_object(Bucket=bucket, Key=key)['Body']
+        # Bounded read in case the object was replaced after the HEAD
+        data = body.read(IMAGE_MAX_INPUT_BYTES + 1)
+        body.close()
+    except ImageIntakeError:
+        raise
+    except Exception as s3_error:
+        logger.error(f"S3 image retrieval error: {s3_error}")
+        raise ImageIntakeError(f"Failed to retrieve image from S3: {str(s3_error)}")
+    _check_size(len(data))
+    return _from_bytes(data, image_format)
+
+
+def load_image(image_input: str) -> ImageInput:
+    """Resolve a data URL, S3 URI/key or bare base64 string into an ImageInput
+
+    Oversized images are rejected before they are downloaded or decoded.
+    Small, upright, metadata-free base64 images are passed through without
+    a decode/re-encode round-trip; everything else goes through
+    prepare_image and is encoded exactly once.
+    """
+    rss_before = _peak_rss_mb()
+
+    if image_input.startswith('data:image/'):
+        # Data URL format
+        header, payload = image_input.split(',', 1)
+        image = _from_base64(payload, header.split(';')[0].split('/')[1])
+        source = 'data_url'
+    elif image_input.startswith('s3://') or _S3_KEY.match(image_input):
+        # S3 key or URL
+        s3_key = image_input.replace('s3://', '').split('/', 1) if image_input.startswith('s3://') else []
+        if len(s3_key) == 2:
+            bucket, key = s3_key
+        else:
+            bucket = os.environ.get('S3_BUCKET', '').replace('s3://', '')
+            key = image_input
+        image = _from_s3(bucket, key)
+        source = 's3'
+    else:
+        # Assume it's a base64 encoded image
+        image = _from_base64(image_input, '')
+        source = 'base64'
+
+    rss_after = _peak_rss_mb()
+    logger.info(
+        f"IMAGE_INTAKE: {source} | {'passthrough' if image.passthrough else 'processed'} | "
+        f"bytes: {image.size} | peak_rss_mb: {rss_after:.0f} (+{rss_after - rss_before:.0f})"
+    )
+    return image
@@ -0,0 +1,122 @@
+import io
+import os
+import logging
+from typing import Tuple
+from lazy import LazyModule
+
+pil_image = LazyModule('PIL.Image')
+pil_image_ops = LazyModule('PIL.ImageOps')
+
+logger = logging.getLogger()
+
+# Claude downsamples anything larger than about 1568px on the long edge anyway
+IMAGE_MAX_EDGE = int(os.environ.get('IMAGE_MAX_EDGE', '1568'))
+# 'jpeg' or 'webp'; both are accepted by Claude vision
+IMAGE_OUTPUT_FORMAT = os.environ.get('IMAGE_OUTPUT_FORMAT', 'jpeg').lower()
+IMAGE_QUALITY = int(os.environ.get('IMAGE_QUALITY', '85'))
+# Images within the edge limit and under this size keep their exact pixels
+IMAGE_LOSSLESS_MAX_BYTES = int(os.environ.get('IMAGE_LOSSLESS_MAX_BYTES', str(512 * 1024)))
+
+EXIF_ORIENTATION = 0x0112
+ICC_PROFILE_ID = b'ICC_PROFILE\x00'
+
+
+def strip_jpeg_metadata(data: bytes) -> bytes:
+    """Drop EXIF/XMP/IPTC and comment segments from a JPEG without touching pixel data
+
+    ICC colour profiles (APP2) and the Adobe segment (APP14), which affect
+    how the pixels decode, are kept.
+    """
+    if data[:2] != b'\xff\xd8':
+        return data
+    out = [data[:2]]
+    i = 2
+    while i + 4 <= len(data):
+        if data[i] != 0xFF:
+            return data
+        marker = data[i + 1]
+        if marker == 0xFF:
+            i += 1
+            continue
+        if marker == 0xDA:
+            # Start of scan: the rest is compressed image data
+            out.append(data[i:])
+            return b''.join(out)
+        length = int.from_bytes(data[i + 2:i + 4], 'big')
+        segment = data[i:i + 2 + length]
+        is_metadata = marker == 0xFE or (0xE1 <= marker <= 0xEF and marker != 0xEE and not (
+            marker == 0xE2 and segment[4:16] == ICC_PROFILE_ID))
+        if not is_metadata:
+            out.append(segment)
+        i += 2 + length
+    return data
+
+
+def _lossless(data: bytes, image, image_format: str) -> bytes:
+    if image_format == 'jpeg':
+        return strip_jpeg_metadata(data)
+    if image_format == 'png':
+        # Re-saving a PNG is lossless and writes no text/EXIF chunks
+        buffer = io.BytesIO()
+        image.save(buffer, format='PNG', optimize=True)
+        return buffer.getvalue() if buffer.tell() < len(data) else data
+    return data
+
+
+def _encode(image, output_format: str) -> bytes:
+    if output_format == 'jpeg' and image.mode != 'RGB':
+        if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+            # JPEG has no alpha; flatten onto white as a viewer would show it
+            image = image.convert('RGBA')
+            background = pil_image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        else:
+            image = image.convert('RGB')
+    buffer = io.BytesIO()
+    options = {'quality': IMAGE_QUALITY}
+    if output_format == 'jpeg':
+        options.update(optimize=True, progressive=True)
+    else:
+        options['method'] = 4
+    image.save(buffer, format=output_format.upper(), **options)
+    return buffer.getvalue()
+
+
+def prepare_image(data: bytes, image_format: str) -> Tuple[bytes, str]:
+    """Return (bytes, format) ready for a vision request
+
+    Large images are rotated upright, scaled so their longest edge is at most
+    IMAGE_MAX_EDGE and re-encoded as IMAGE_OUTPUT_FORMAT, which also drops
+    their metadata. Small images keep their pixels and lose only metadata.
+    Anything Pillow cannot read, and animated images, are passed through.
+    """
+    image_format = 'jpeg' if image_format == 'jpg' else image_format
+    try:
+        image = pil_image.open(io.BytesIO(data))
+        if getattr(image, 'is_animated', False):
+            return data, image_format
+        orientation = image.getexif().get(EXIF_ORIENTATION, 1)
+        width, height = image.size
+    except Exception as e:
+        logger.warning(f"Image preprocessing skipped: {e}")
+        return data, image_format
+
+    needs_resize = max(width, height) > IMAGE_MAX_EDGE
+    upright = orientation == 1
+    if not needs_resize and upright and len(data) <= IMAGE_LOSSLESS_MAX_BYTES:
+        result, result_format, size = _lossless(data, image, image_format), image_format, (width, height)
+    else:
+        image = pil_image_ops.exif_transpose(image)
+        if needs_resize:
+            image.thumbnail((IMAGE_MAX_EDGE, IMAGE_MAX_EDGE), pil_image.LANCZOS)
+        result, result_format, size = _encode(image, IMAGE_OUTPUT_FORMAT), IMAGE_OUTPUT_FORMAT, image.size
+        if not needs_resize and upright and len(result) >= len(data):
+            # Re-encoding did not pay off; keep the original pixels
+            result, result_format = _lossless(data, image, image_format), image_format
+
+    logger.info(
+        f"IMAGE_PREPROCESS: {width}x{height} {image_format} -> {size[0]}x{size[1]} {result_format} | "
+        f"bytes: {len(data)} -> {len(result)} | saved: {len(data) - len(result)}"
+    )
+    return result, result_format
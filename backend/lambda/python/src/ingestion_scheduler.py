@@ -0,0 +1,234 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+from lazy import LazyClient, lazy_singleton
+from retrieval_cache import bump_kb_generation
+from vector_index import LocalIndexStore, S3IndexStore
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# A job starts once no document has arrived for this long...
+KB_INGESTION_WINDOW_SECONDS = float(os.environ.get('KB_INGESTION_WINDOW_SECONDS', '60'))
+# ...or once the oldest waiting document has waited this long, even if uploads keep coming
+KB_INGESTION_MAX_WAIT_SECONDS = float(os.environ.get('KB_INGESTION_MAX_WAIT_SECONDS', '300'))
+# Queue markers and job state; outside the uploads/ trigger
+KB_INGESTION_PREFIX = os.environ.get('KB_INGESTION_PREFIX', 'system/kb-ingestion/')
+# Local directory used instead of S3, for local runs and tests
+KB_INGESTION_STATE_DIR = os.environ.get('KB_INGESTION_STATE_DIR', '')
+# Use FakeBedrockAgentClient instead of the real service
+KB_INGESTION_FAKE_CLIENT = os.environ.get('KB_INGESTION_FAKE_CLIENT', 'false').lower() == 'true'
+KB_INGESTION_FAKE_JOB_SECONDS = float(os.environ.get('KB_INGESTION_FAKE_JOB_SECONDS', '5'))
+
+PENDING_DIR = 'pending/'
+STATE_NAME = 'state.json'
+RUNNING_STATUSES = ('STARTING', 'IN_PROGRESS', 'STOPPING')
+RETRY_STATUSES = ('FAILED', 'STOPPED')
+
+bedrock_agent_client = LazyClient('bedrock-agent')
+
+
+def _error_code(error: Exception) -> str:
+    return str(getattr(error, 'response', {}).get('Error', {}).get('Code', ''))
+
+
+class FakeBedrockAgentClient:
+    """In-memory stand-in for the bedrock-agent ingestion job API
+
+    Like the service, it allows one running job per data source and raises
+    ConflictException otherwise. Jobs report IN_PROGRESS for job_seconds and
+    then COMPLETE, or FAILED if fail_next was set when they started. Unknown
+    job ids report COMPLETE.
+    """
+
+    def __init__(self, job_seconds: float = KB_INGESTION_FAKE_JOB_SECONDS, clock: Callable[[], float] = time.time):
+        self.job_seconds = job_seconds
+        self.clock = clock
+        self.jobs: Dict[str, Dict[str, Any]] = {}
+        self.fail_next = False
+        self._lock = threading.Lock()
+
+    def _status(self, job: Dict[str, Any]) -> str:
+        if self.clock() - job['started'] < self.job_seconds:
+            return 'IN_PROGRESS'
+        return 'FAILED' if job['fail'] else 'COMPLETE'
+
+    def start_ingestion_job(self, knowledgeBaseId: str, dataSourceId: str, description: str = '',
+                            clientToken: Optional[str] = None) -> Dict[str, Any]:
+        from botocore.exceptions import ClientError
+        with self._lock:
+            for job in self.jobs.values():
+                if job['dataSourceId'] == dataSourceId and self._status(job) in RUNNING_STATUSES:
+                    raise ClientError({'Error': {'Code': 'ConflictException',
+                                                 'Message': 'An ingestion job is already running'}}, 'StartIngestionJob')
+            job_id = uuid.uuid4().hex[:10].upper()
+            self.jobs[job_id] = {'knowledgeBaseId': knowledgeBaseId, 'dataSourceId': dataSourceId,
+                                 'description': description, 'started': self.clock(), 'fail': self.fail_next}
+            self.fail_next = False
+        return self.get_ingestion_job(knowledgeBaseId=knowledgeBaseId, dataSourceId=dataSourceId, ingestionJobId=job_id)
+
+    def get_ingestion_job(self, knowledgeBaseId: str, dataSourceId: str, ingestionJobId: str) -> Dict[str, Any]:
+        # Jobs live only as long as this client; one tracked in saved state
+        # by an earlier process is reported as finished
+        job = self.jobs.get(ingestionJobId)
+        return {'ingestionJob': {
+            'knowledgeBaseId': knowledgeBaseId,
+            'dataSourceId': dataSourceId,
+            'ingestionJobId': ingestionJobId,
+            'description': job['description'] if job else '',
+            'status': self._status(job) if job else 'COMPLETE'
+        }}
+
+
+class IngestionScheduler:
+    """Debounced knowledge base ingestion
+
+    enqueue() drops a small marker per document, so concurrent uploads never
+    contend on shared state. poll() starts one ingestion job for everything
+    queued once uploads go quiet for the window (or the oldest document has
+    waited KB_INGESTION_MAX_WAIT_SECONDS), tracks that job, and re-queues
+    its documents if it fails. Documents arriving while a job runs wait for
+    the next one.
+
+    state.json is read and rewritten without a lock, so poll() must run in
+    one place only: the scheduled kbIngestionScheduler function, which has
+    a reserved concurrency of 1.
+    """
+
+    def __init__(self, store, client, knowledge_base_id: str, data_source_id: str, bucket: str = '',
+                 window_seconds: float = KB_INGESTION_WINDOW_SECONDS,
+                 max_wait_seconds: float = KB_INGESTION_MAX_WAIT_SECONDS,
+                 clock: Callable[[], float] = time.time):
+        self.store = store
+        self.client = client
+        self.knowledge_base_id = knowledge_base_id
+        self.data_source_id = data_source_id
+        self.bucket = bucket
+        self.window_seconds = window_seconds
+        self.max_wait_seconds = max_wait_seconds
+        self.clock = clock
+        self._lock = threading.Lock()
+
+    def enqueue(self, document_key: str) -> None:
+        queued_at = self.clock()
+        name = f"{PENDING_DIR}{int(queued_at * 1000):013d}-{hashlib.sha1(document_key.encode('utf-8')).hexdigest()[:12]}.json"
+        self.store.put(name, json.dumps({'documentKey': document_key, 'queuedAt': queued_at}).encode('utf-8'))
+        logger.info(f"KB_INGESTION: queued {document_key}")
+
+    def pending(self) -> List[Dict[str, Any]]:
+        """Queued markers, oldest first"""
+        markers = []
+        for name in sorted(self.store.list(PENDING_DIR)):
+            data = self.store.get(name)
+            if data:
+                markers.append({'name': name, **json.loads(data)})
+        return markers
+
+    def _state(self) -> Dict[str, Any]:
+        return json.loads(self.store.get(STATE_NAME) or b'{}')
+
+    def _save_state(self, state: Dict[str, Any]) -> None:
+        self.store.put(STATE_NAME, json.dumps(state, ensure_ascii=False).encode('utf-8'))
+
+    def _check_job(self, state: Dict[str, Any]) -> Optional[str]:
+        """Status of the tracked job, finishing it off if it has ended; None if no job is tracked"""
+        job_id = state.get('jobId')
+        if not job_id:
+            return None
+        job = self.client.get_ingestion_job(
+            knowledgeBaseId=self.knowledge_base_id,
+            dataSourceId=self.data_source_id,
+            ingestionJobId=job_id
+        )['ingestionJob']
+        status = job['status']
+        if status in RUNNING_STATUSES:
+            return status
+
+        documents = state.get('documents', [])
+        if status in RETRY_STATUSES:
+            logger.warning(f"KB_INGESTION: job {job_id} {status}; re-queueing {len(documents)} documents")
+            for document_key in documents:
+                self.enqueue(document_key)
+        elif self.bucket:
+            # Bedrock retrieval changes only now; drop cached retrievals everywhere
+            bump_kb_generation(self.bucket, self.knowledge_base_id, f"ingestion-job/{job_id}")
+        self._save_state({'lastJob': {
+            'jobId': job_id,
+            'status': status,
+            'documents': len(documents),
+            'statistics': job.get('statistics', {}),
+            'finishedAt': datetime.utcnow().isoformat() + 'Z'
+        }})
+        logger.info(f"KB_INGESTION: job {job_id} finished | status: {status} | documents: {len(documents)}")
+        return status
+
+    def poll(self) -> Dict[str, Any]:
+        """Advance the schedule; returns {'action': idle|waiting|running|busy|started, ...}"""
+        with self._lock:
+            state = self._state()
+            status = self._check_job(state)
+            if status in RUNNING_STATUSES:
+                return {'action': 'running', 'jobId': state['jobId'], 'status': status}
+
+            markers = self.pending()
+            if not markers:
+                return {'action': 'idle'}
+            now = self.clock()
+            quiet_for = now - markers[-1]['queuedAt']
+            waited = now - markers[0]['queuedAt']
+            if quiet_for < self.window_seconds and waited < self.max_wait_seconds:
+                return {'action': 'waiting', 'pending': len(markers), 'startsIn': round(self.window_seconds - quiet_for, 1)}
+
+            documents = sorted({marker['documentKey'] for marker in markers})
+            try:
+                job = self.client.start_ingestion_job(
+                    knowledgeBaseId=self.knowledge_base_id,
+                    dataSourceId=self.data_source_id,
+                    clientToken=hashlib.sha256(''.join(m['name'] for m in markers).encode('utf-8')).hexdigest()[:64],
+                    description=f"{len(documents)} documents queued by file_processor"
+                )['ingestionJob']
+            except Exception as e:
+                if _error_code(e) == 'ConflictException':
+                    # A job we do not track (another poller, or the console) is running
+                    return {'action': 'busy', 'pending': len(markers)}
+                raise
+
+            self._save_state({
+                'jobId': job['ingestionJobId'],
+                'documents': documents,
+                'startedAt': datetime.utcnow().isoformat() + 'Z'
+            })
+            for marker in markers:
+                self.store.delete(marker['name'])
+            logger.info(f"KB_INGESTION: started job {job['ingestionJobId']} | documents: {len(documents)} | waited_s: {waited:.0f}")
+            return {'action': 'started', 'jobId': job['ingestionJobId'], 'documents': len(documents)}
+
+
+@lazy_singleton
+def get_ingestion_scheduler() -> Optional[IngestionScheduler]:
+    """Scheduler for KNOWLEDGE_BASE_ID / KNOWLEDGE_BASE_DATA_SOURCE_ID; None when either is unset"""
+    knowledge_base_id = os.environ.get('KNOWLEDGE_BASE_ID', '')
+    data_source_id = os.environ.get('KNOWLEDGE_BASE_DATA_SOURCE_ID', '')
+    bucket = os.environ.get('S3_BUCKET', '').replace('s3://', '')
+    if not knowledge_base_id or not data_source_id or not (bucket or KB_INGESTION_STATE_DIR):
+        return None
+    store = LocalIndexStore(KB_INGESTION_STATE_DIR) if KB_INGESTION_STATE_DIR else S3IndexStore(bucket, prefix=KB_INGESTION_PREFIX)
+    client = FakeBedrockAgentClient() if KB_INGESTION_FAKE_CLIENT else bedrock_agent_client
+    return IngestionScheduler(store, client, knowledge_base_id, data_source_id, bucket=bucket)
+
+
+def handler(event, context):
+    """Scheduled every minute: starts the ingestion job once uploads go quiet"""
+    scheduler = get_ingestion_scheduler()
+    if scheduler is None:
+        logger.info("Knowledge base data source not configured, skipping ingestion")
+        return {'action': 'disabled'}
+    result = scheduler.poll()
+    logger.info(f"KB_INGESTION: poll | {json.dumps(result)}")
+    return result
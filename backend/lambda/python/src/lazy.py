@@ -0,0 +1,79 @@
+import importlib
+import threading
+from types import ModuleType
+from typing import Any, Callable, Dict, Optional
+
+
+class LazyModule:
+    """Module proxy that imports the real module on first attribute access
+
+    Classes fetched through the proxy are the real classes, so constructors
+    and isinstance checks behave exactly as with a normal import.
+    """
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module: Optional[ModuleType] = None
+
+    def _load(self) -> ModuleType:
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr: str) -> Any:
+        return getattr(self._load(), attr)
+
+    def __repr__(self) -> str:
+        state = 'loaded' if self._module is not None else 'not loaded'
+        return f"<LazyModule {self._name} ({state})>"
+
+
+class LazyClient:
+    """boto3 client proxy created on first method call
+
+    Importing boto3 and building a client costs tens of milliseconds, which
+    OPTIONS preflights and rejected requests never need to pay.
+    """
+
+    def __init__(self, service_name: str, **kwargs: Any):
+        self._service_name = service_name
+        self._kwargs = kwargs
+        self._client: Any = None
+        self._lock = threading.Lock()
+
+    def _load(self) -> Any:
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    import boto3
+                    kwargs = dict(self._kwargs)
+                    if isinstance(kwargs.get('config'), dict):
+                        # Plain dicts keep botocore out of module import time
+                        from botocore.config import Config
+                        kwargs['config'] = Config(**kwargs['config'])
+                    self._client = boto3.client(self._service_name, **kwargs)
+        return self._client
+
+    def __getattr__(self, attr: str) -> Any:
+        return getattr(self._load(), attr)
+
+    def __repr__(self) -> str:
+        state = 'created' if self._client is not None else 'not created'
+        return f"<LazyClient {self._service_name} ({state})>"
+
+
+def lazy_singleton(factory: Callable[[], Any]) -> Callable[[], Any]:
+    """Wrap a zero-argument factory so it runs once, on first call"""
+    instance: Dict[str, Any] = {}
+    lock = threading.Lock()
+
+    def get() -> Any:
+        if 'value' not in instance:
+            with lock:
+                if 'value' not in instance:
+                    instance['value'] = factory()
+        return instance['value']
+
+    get.__name__ = getattr(factory, '__name__', 'lazy_singleton')
+    get.__doc__ = factory.__doc__
+    return get
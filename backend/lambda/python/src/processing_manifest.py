@@ -0,0 +1,155 @@
+import os
+import json
+import base64
+import hashlib
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Dict, Optional
+from lazy import LazyClient, lazy_singleton
+
+logger = logging.getLogger()
+
+# Outside uploads/, so writing a manifest never fires the file processor's S3 trigger
+FILE_MANIFEST_PREFIX = os.environ.get('FILE_MANIFEST_PREFIX', 'processed/manifests/')
+# Local directory used instead of S3, for local runs and tests
+FILE_MANIFEST_DIR = os.environ.get('FILE_MANIFEST_DIR', '')
+
+# Fingerprint index: one small document per (scope, content hash)
+FINGERPRINT_DIR = 'by-hash/'
+_HASH_CHUNK_BYTES = 1024 * 1024
+
+s3_client = LazyClient('s3')
+
+
+def content_fingerprint(bucket: str, key: str, head: Dict[str, Any]) -> str:
+    """'sha256:<hex>' or 'md5:<hex>' for an object, from its HEAD response when that is reliable
+
+    A full-object SHA-256 checksum is used as is. A plain ETag is the MD5 of
+    the bytes unless the upload was multipart ('-N' suffix) or SSE-KMS
+    encrypted. Anything else is hashed by streaming the object once.
+    """
+    checksum = head.get('ChecksumSHA256', '')
+    if checksum and '-' not in checksum and head.get('ChecksumType', 'FULL_OBJECT') == 'FULL_OBJECT':
+        return 'sha256:' + base64.b64decode(checksum).hex()
+
+    etag = head.get('ETag', '').strip('"')
+    if etag and '-' not in etag and head.get('ServerSideEncryption') != 'aws:kms':
+        return 'md5:' + etag
+
+    digest = hashlib.sha256()
+    body = s3_client.get_object(Bucket=bucket, Key=key)['Body']
+    for chunk in iter(lambda: body.read(_HASH_CHUNK_BYTES), b''):
+        digest.update(chunk)
+    body.close()
+    return 'sha256:' + digest.hexdigest()
+
+
+def manifest_name(key: str) -> str:
+    """uploads/<user>/<file> -> <user>/<file>.json"""
+    return (key[len('uploads/'):] if key.startswith('uploads/') else key) + '.json'
+
+
+class S3ManifestStore:
+    def __init__(self, bucket: str, prefix: str = FILE_MANIFEST_PREFIX):
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def get(self, name: str) -> Optional[bytes]:
+        try:
+            return s3_client.get_object(Bucket=self.bucket, Key=self.prefix + name)['Body'].read()
+        except Exception as e:
+            code = str(getattr(e, 'response', {}).get('Error', {}).get('Code', ''))
+            # Without ListBucket on the prefix, a missing key reads as AccessDenied
+            if code not in ('NoSuchKey', 'AccessDenied', '404', '403'):
+                logger.warning(f"Processing manifest read failed: {e}")
+            return None
+
+    def put(self, name: str, data: bytes) -> None:
+        s3_client.put_object(Bucket=self.bucket, Key=self.prefix + name, Body=data, ContentType='application/json')
+
+
+class LocalManifestStore:
+    def __init__(self, path: str):
+        self.path = path
+
+    def get(self, name: str) -> Optional[bytes]:
+        try:
+            with open(os.path.join(self.path, name), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, name: str, data: bytes) -> None:
+        # Write then rename so concurrent readers never see a partial file
+        target = os.path.join(self.path, name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        temp = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp, 'wb') as f:
+            f.write(data)
+        os.replace(temp, target)
+
+
+class ProcessingManifests:
+    """Processing state of uploaded files, kept beside the object instead of in its metadata
+
+    One small JSON document per upload records its status, the ETag it was
+    computed for, and where the outputs went. Rewriting the upload's own
+    metadata would copy the whole object and fire another upload event.
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        data = self.store.get(manifest_name(key))
+        if not data:
+            return None
+        try:
+            return json.loads(data)
+        except ValueError as e:
+            logger.warning(f"Ignoring unreadable processing manifest for {key}: {e}")
+            return None
+
+    def is_processed(self, key: str, etag: str) -> bool:
+        """True if this exact version of the object has already been processed"""
+        manifest = self.get(key)
+        return bool(manifest) and manifest.get('status') in ('processed', 'duplicate') and manifest.get('etag') == etag
+
+    @staticmethod
+    def _fingerprint_name(scope: str, fingerprint: str) -> str:
+        return f"{FINGERPRINT_DIR}{scope}/{fingerprint.replace(':', '-')}.json"
+
+    def find_original(self, scope: str, fingerprint: str) -> Optional[Dict[str, Any]]:
+        """Manifest of an earlier upload with the same content in this scope, if it still has it"""
+        data = self.store.get(self._fingerprint_name(scope, fingerprint))
+        if not data:
+            return None
+        try:
+            source_key = json.loads(data)['sourceKey']
+        except (ValueError, KeyError):
+            return None
+        original = self.get(source_key)
+        # The original key may since have been overwritten with other content
+        if not original or original.get('status') != 'processed' or original.get('fingerprint') != fingerprint:
+            return None
+        return original
+
+    def record_fingerprint(self, scope: str, fingerprint: str, key: str) -> None:
+        self.store.put(self._fingerprint_name(scope, fingerprint), json.dumps({'sourceKey': key}).encode('utf-8'))
+
+    def put(self, key: str, manifest: Dict[str, Any]) -> None:
+        manifest = {**manifest, 'sourceKey': key, 'updatedAt': datetime.utcnow().isoformat() + 'Z'}
+        self.store.put(manifest_name(key), json.dumps(manifest, ensure_ascii=False).encode('utf-8'))
+
+
+def manifests_for(bucket: str) -> ProcessingManifests:
+    """Manifests in FILE_MANIFEST_DIR if set, else next to the uploads in the bucket"""
+    if FILE_MANIFEST_DIR:
+        return _local_manifests()
+    return ProcessingManifests(S3ManifestStore(bucket))
+
+
+@lazy_singleton
+def _local_manifests() -> ProcessingManifests:
+    return ProcessingManifests(LocalManifestStore(FILE_MANIFEST_DIR))
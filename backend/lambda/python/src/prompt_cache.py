@@ -0,0 +1,114 @@
+import os
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+from context_packing import estimate_message_tokens, estimate_tokens
+
+logger = logging.getLogger()
+
+CACHE_CONTROL = {'type': 'ephemeral'}
+
+# Smallest prefix Bedrock caches, by model family; most specific first.
+# Models not listed do not support prompt caching on Bedrock.
+CACHE_MIN_TOKENS = [
+    ('claude-opus-4-5', 4096),
+    ('claude-haiku-4-5', 4096),
+    ('claude-3-5-haiku', 2048),
+    ('claude-3-7-sonnet', 1024),
+    ('claude-sonnet-4', 1024),
+    ('claude-opus-4', 1024),
+]
+
+
+def cache_min_tokens(model_id: str) -> Optional[int]:
+    """Minimum cacheable prefix for a model or inference profile id; None if it cannot cache"""
+    for family, min_tokens in CACHE_MIN_TOKENS:
+        if family in model_id:
+            return min_tokens
+    return None
+
+
+class PromptCacheConfig:
+    """Where to place Anthropic prompt-cache breakpoints for a handler
+
+    Read from PROMPT_CACHE_SYSTEM / PROMPT_CACHE_HISTORY so each Lambda
+    function can opt in through its own environment. Stays off for models
+    that cannot cache, since Bedrock rejects cache_control for them.
+    """
+
+    def __init__(self, cache_system: Optional[bool] = None, cache_history: Optional[bool] = None,
+                 model_id: str = ''):
+        if cache_system is None:
+            cache_system = os.environ.get('PROMPT_CACHE_SYSTEM', 'false').lower() == 'true'
+        if cache_history is None:
+            cache_history = os.environ.get('PROMPT_CACHE_HISTORY', 'false').lower() == 'true'
+        self.min_tokens = cache_min_tokens(model_id)
+        if (cache_system or cache_history) and self.min_tokens is None:
+            logger.warning(f"Prompt caching requested but not supported by {model_id or 'unknown model'}; disabled")
+            cache_system = cache_history = False
+        self.cache_system = cache_system
+        self.cache_history = cache_history
+
+    @property
+    def enabled(self) -> bool:
+        return self.cache_system or self.cache_history
+
+
+def _as_blocks(content: Any) -> List[Dict[str, Any]]:
+    if isinstance(content, list):
+        return [dict(block) for block in content]
+    return [{'type': 'text', 'text': content}]
+
+
+def apply_cache_breakpoints(system: str, messages: List[Dict[str, Any]],
+                            config: PromptCacheConfig) -> Tuple[Any, List[Dict[str, Any]]]:
+    """Return (system, messages) for an Anthropic Messages request with cache breakpoints
+
+    The system prompt gets one breakpoint. The history prefix (everything
+    before the newest user turn) gets one on its last block, so the next turn
+    re-reads the whole conversation so far from cache and only the new
+    message is processed as fresh input. A breakpoint is only placed once the
+    prefix it closes reaches the model's minimum; Bedrock ignores shorter
+    ones, so they would cost a content block and never hit.
+    """
+    if not config.enabled:
+        return system, messages
+
+    system_tokens = estimate_tokens(system)
+    cached_system: Any = system
+    if config.cache_system and system and system_tokens >= config.min_tokens:
+        cached_system = [{'type': 'text', 'text': system, 'cache_control': CACHE_CONTROL}]
+
+    cached_messages = list(messages)
+    prefix_end = len(messages) - 2
+    if (config.cache_history and prefix_end >= 0 and
+            system_tokens + sum(estimate_message_tokens(m) for m in messages[:prefix_end + 1]) >= config.min_tokens):
+        message = dict(cached_messages[prefix_end])
+        blocks = _as_blocks(message['content']) if message.get('content') else []
+        if blocks:
+            blocks[-1]['cache_control'] = CACHE_CONTROL
+            message['content'] = blocks
+            cached_messages[prefix_end] = message
+
+    return cached_system, cached_messages
+
+
+def extract_cache_usage(response_body: Dict[str, Any]) -> Dict[str, int]:
+    """Token usage from an Anthropic Messages response, including cache reads and writes"""
+    usage = response_body.get('usage') or {}
+    return {
+        'input_tokens': usage.get('input_tokens', 0),
+        'output_tokens': usage.get('output_tokens', 0),
+        'cache_read_input_tokens': usage.get('cache_read_input_tokens', 0) or 0,
+        'cache_creation_input_tokens': usage.get('cache_creation_input_tokens', 0) or 0,
+    }
+
+
+def log_cache_usage(handler_name: str, usage: Dict[str, int]) -> None:
+    """Log prompt-cache effectiveness for one model call"""
+    total_input = usage['input_tokens'] + usage['cache_read_input_tokens'] + usage['cache_creation_input_tokens']
+    hit_ratio = usage['cache_read_input_tokens'] / total_input if total_input else 0.0
+    logger.info(
+        f"PROMPT_CACHE: {handler_name} | input: {usage['input_tokens']} | "
+        f"cache_read: {usage['cache_read_input_tokens']} | cache_write: {usage['cache_creation_input_tokens']} | "
+        f"output: {usage['output_tokens']} | hit_ratio: {hit_ratio:.2f}"
+    )
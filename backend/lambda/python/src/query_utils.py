@@ -0,0 +1,18 @@
+import re
+import json
+import unicodedata
+from typing import Any
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_text(text: Any) -> str:
+    """Canonical form used in keys: NFKC (full-width to half-width), collapsed whitespace"""
+    if not isinstance(text, str):
+        text = json.dumps(text, ensure_ascii=False, sort_keys=True)
+    return _WHITESPACE.sub(' ', unicodedata.normalize('NFKC', text)).strip()
+
+
+def normalize_query(query: str) -> str:
+    """Case- and width-insensitive form of a search query"""
+    return normalize_text(query).casefold()
@@ -0,0 +1,198 @@
+import os
+import re
+import json
+import math
+import hashlib
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from lazy import lazy_singleton
+from ttl_cache import TTLCache, SingleFlight, _MISSING
+from embeddings import titan_embed
+from query_utils import normalize_text
+
+logger = logging.getLogger()
+
+RESPONSE_CACHE_ENABLED = os.environ.get('RESPONSE_CACHE_ENABLED', 'true').lower() == 'true'
+RESPONSE_CACHE_TTL_SECONDS = float(os.environ.get('RESPONSE_CACHE_TTL_SECONDS', '600'))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', '512'))
+# 'user' keeps every entry private to its user; 'global' shares first-turn answers across users
+RESPONSE_CACHE_SCOPE = os.environ.get('RESPONSE_CACHE_SCOPE', 'user').lower()
+# Prior messages that are part of the key; older turns rarely change the answer
+RESPONSE_CACHE_HISTORY_TAIL = int(os.environ.get('RESPONSE_CACHE_HISTORY_TAIL', '4'))
+
+RESPONSE_CACHE_SEMANTIC = os.environ.get('RESPONSE_CACHE_SEMANTIC', 'false').lower() == 'true'
+RESPONSE_CACHE_SIMILARITY = float(os.environ.get('RESPONSE_CACHE_SIMILARITY', '0.95'))
+# Candidates compared per semantic lookup; a linear scan stays well under a millisecond
+SEMANTIC_ENTRIES_PER_BUCKET = 256
+
+# Messages that point at uploaded or inline images are answered from their content, not their text
+_UNCACHEABLE = re.compile(r's3://|data:image/|\.(?:jpe?g|png|gif|webp)\b', re.IGNORECASE)
+
+# Fallback answers the chat agents return instead of raising; never worth caching
+_FAILED_ANSWERS = ('AI処理中にエラーが発生しました', 'No response generated')
+
+
+def _digest(*parts: Any) -> str:
+    return hashlib.sha256(json.dumps(parts, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def is_cacheable_answer(answer: Any) -> bool:
+    return isinstance(answer, str) and bool(answer.strip()) and not answer.startswith(_FAILED_ANSWERS)
+
+
+def _cosine(a: List[float], b: List[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+class ResponseCache:
+    """Two-tier cache of final assistant answers
+
+    The exact tier is keyed on the normalized (namespace, scope, model id,
+    system prompt, history tail, message). The optional semantic tier embeds
+    the message and reuses an answer from the same (namespace, scope, model,
+    system prompt, history tail) bucket when cosine similarity reaches the
+    threshold. Concurrent misses for the same exact key share one upstream call.
+    """
+
+    def __init__(self, ttl_seconds: float = RESPONSE_CACHE_TTL_SECONDS,
+                 max_entries: int = RESPONSE_CACHE_MAX_ENTRIES,
+                 scope_mode: str = RESPONSE_CACHE_SCOPE,
+                 history_tail: int = RESPONSE_CACHE_HISTORY_TAIL,
+                 embed: Optional[Callable[[str], List[float]]] = None,
+                 similarity_threshold: float = RESPONSE_CACHE_SIMILARITY):
+        self.entries = TTLCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+        self.scope_mode = scope_mode
+        self.history_tail = history_tail
+        self.embed = embed
+        self.similarity_threshold = similarity_threshold
+        self._flight = SingleFlight()
+        self._buckets: Dict[str, List[Tuple[List[float], str]]] = {}
+        self._buckets_lock = threading.Lock()
+
+    def scope_for(self, user_id: str, history: List[Dict[str, Any]]) -> str:
+        """Who may reuse an entry
+
+        Follow-up turns carry the user's own conversation, so they are always
+        private; in 'global' mode only first-turn questions are shared.
+        """
+        if self.scope_mode == 'global' and not history:
+            return '*'
+        return f"user:{user_id}"
+
+    def keys_for(self, namespace: str, user_id: str, model_id: str, system_prompt: str,
+                 messages: List[Dict[str, Any]]) -> Tuple[str, str, str]:
+        """(exact key, semantic bucket, normalized message) for a packed message list"""
+        history = messages[:-1][-self.history_tail:] if self.history_tail else []
+        tail = [(m.get('role'), normalize_text(m.get('content', ''))) for m in history]
+        message = normalize_text(messages[-1].get('content', '')) if messages else ''
+        bucket = _digest(namespace, self.scope_for(user_id, messages[:-1]), model_id,
+                         normalize_text(system_prompt), tail)
+        return _digest(bucket, message), bucket, message
+
+    def _semantic_lookup(self, bucket: str, vector: List[float]) -> Any:
+        with self._buckets_lock:
+            candidates = list(self._buckets.get(bucket, ()))
+        best_key, best_score = None, self.similarity_threshold
+        for candidate, key in candidates:
+            score = _cosine(vector, candidate)
+            if score >= best_score:
+                best_key, best_score = key, score
+        if best_key is None:
+            return _MISSING
+        value, _ = self.entries.lookup(best_key)
+        if value is not _MISSING:
+            logger.info(f"Response cache semantic match (similarity {best_score:.3f})")
+        return value
+
+    def _remember_vector(self, bucket: str, vector: List[float], key: str) -> None:
+        with self._buckets_lock:
+            # Drop vectors whose answers have been evicted from the exact tier
+            entries = [e for e in self._buckets.get(bucket, []) if e[1] != key and e[1] in self.entries]
+            entries.append((vector, key))
+            self._buckets[bucket] = entries[-SEMANTIC_ENTRIES_PER_BUCKET:]
+
+    def get_or_compute(self, namespace: str, user_id: str, model_id: str, system_prompt: str,
+                       messages: List[Dict[str, Any]], compute: Callable[[], str],
+                       should_cache: Callable[[str], bool] = is_cacheable_answer) -> Tuple[str, str]:
+        """Return (answer, status) where status is hit, semantic_hit, shared, miss or bypass"""
+        latest = messages[-1].get('content', '') if messages else ''
+        if not isinstance(latest, str) or _UNCACHEABLE.search(latest):
+            return compute(), 'bypass'
+
+        key, bucket, message = self.keys_for(namespace, user_id, model_id, system_prompt, messages)
+        value, _ = self.entries.lookup(key)
+        if value is not _MISSING:
+            return value, 'hit'
+
+        status = {'value': 'miss'}
+
+        def fill() -> str:
+            vector = None
+            if self.embed is not None:
+                try:
+                    vector = self.embed(message)
+                    cached = self._semantic_lookup(bucket, vector)
+                    if cached is not _MISSING:
+                        status['value'] = 'semantic_hit'
+                        return cached
+                except Exception as e:
+                    # The semantic tier is best effort; fall through to the model
+                    logger.warning(f"Response cache embedding failed: {e}")
+                    vector = None
+            answer = compute()
+            if should_cache(answer):
+                self.entries.set(key, answer)
+                if vector is not None:
+                    self._remember_vector(bucket, vector, key)
+            return answer
+
+        # Callers that arrive while the same question is in flight wait for its answer
+        shared = self._flight.in_flight(key)
+        answer = self._flight.do(key, fill)
+        return answer, 'shared' if shared else status['value']
+
+    def clear(self) -> None:
+        self.entries.clear()
+        with self._buckets_lock:
+            self._buckets.clear()
+
+    def stats(self) -> Dict[str, int]:
+        stats = self.entries.stats()
+        stats['shared'] = self._flight.shared
+        return stats
+
+
+@lazy_singleton
+def get_response_cache() -> ResponseCache:
+    """Per-container response cache configured from the environment"""
+    return ResponseCache(embed=titan_embed if RESPONSE_CACHE_SEMANTIC else None)
+
+
+def cache_requested(body: Dict[str, Any], headers: Optional[Dict[str, Any]] = None) -> bool:
+    """Whether this request may use the response cache
+
+    Disabled per function with RESPONSE_CACHE_ENABLED=false, or per request
+    with `"cache": false` in the body or a `Cache-Control: no-cache` header.
+    """
+    if not RESPONSE_CACHE_ENABLED or body.get('cache') is False:
+        return False
+    headers = headers or {}
+    cache_control = headers.get('Cache-Control') or headers.get('cache-control') or ''
+    return 'no-cache' not in cache_control and 'no-store' not in cache_control
+
+
+def cached_answer(namespace: str, user: Dict[str, Any], model_id: str, system_prompt: str,
+                  messages: List[Dict[str, Any]], compute: Callable[[], str],
+                  enabled: bool = True) -> str:
+    """Answer through the response cache, logging the outcome"""
+    if not enabled:
+        status, answer = 'bypass', compute()
+    else:
+        answer, status = get_response_cache().get_or_compute(
+            namespace, user.get('sub', 'anonymous'), model_id, system_prompt, messages, compute
+        )
+    logger.info(f"RESPONSE_CACHE: {namespace} | status: {status}")
+    return answer
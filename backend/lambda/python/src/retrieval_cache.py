@@ -0,0 +1,122 @@
+import os
+import json
+import time
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+from lazy import LazyClient, lazy_singleton
+from ttl_cache import TTLCache, SingleFlight, _MISSING
+from query_utils import normalize_query
+
+logger = logging.getLogger()
+
+KB_RETRIEVAL_CACHE_TTL_SECONDS = float(os.environ.get('KB_RETRIEVAL_CACHE_TTL_SECONDS', '900'))
+KB_RETRIEVAL_CACHE_MAX_ENTRIES = int(os.environ.get('KB_RETRIEVAL_CACHE_MAX_ENTRIES', '512'))
+# Marker object rewritten by file_processor whenever documents enter knowledge-base/
+KB_GENERATION_KEY = os.environ.get('KB_GENERATION_KEY', 'system/kb-generation.json')
+# The marker is re-read at most this often; one ReAct run usually fits in one window
+KB_GENERATION_CHECK_SECONDS = float(os.environ.get('KB_GENERATION_CHECK_SECONDS', '2'))
+
+s3_client = LazyClient('s3')
+
+
+def bump_kb_generation(bucket: str, knowledge_base_id: str, document_key: str) -> None:
+    """Record that knowledge-base/ changed so every container drops its cached retrievals"""
+    s3_client.put_object(
+        Bucket=bucket,
+        Key=KB_GENERATION_KEY,
+        Body=json.dumps({
+            'knowledgeBaseId': knowledge_base_id,
+            'documentKey': document_key,
+            'updatedAt': datetime.utcnow().isoformat() + 'Z'
+        }).encode('utf-8'),
+        ContentType='application/json'
+    )
+    # Containers that also serve chat (local runs) see the change immediately
+    get_retrieval_cache().invalidate()
+
+
+class RetrievalCache:
+    """Cache of Bedrock knowledge base retrievals
+
+    Keyed by (knowledgeBaseId, normalized query, retrieval configuration,
+    knowledge base generation). The generation is the ETag of the marker
+    object that file_processor rewrites after each ingest, so a new document
+    makes every earlier entry unreachable. If the marker cannot be read the
+    cache is bypassed rather than risk serving stale results.
+    """
+
+    def __init__(self, bucket: Optional[str] = None,
+                 ttl_seconds: float = KB_RETRIEVAL_CACHE_TTL_SECONDS,
+                 max_entries: int = KB_RETRIEVAL_CACHE_MAX_ENTRIES,
+                 check_seconds: float = KB_GENERATION_CHECK_SECONDS):
+        self.bucket = bucket if bucket is not None else os.environ.get('S3_BUCKET', '').replace('s3://', '')
+        self.entries = TTLCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+        self.check_seconds = check_seconds
+        self._flight = SingleFlight()
+        self._generation: Optional[str] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _read_generation(self) -> Optional[str]:
+        try:
+            return s3_client.head_object(Bucket=self.bucket, Key=KB_GENERATION_KEY)['ETag']
+        except Exception as e:
+            code = str(getattr(e, 'response', {}).get('Error', {}).get('Code', ''))
+            # No ingest has happened yet (403 when the role cannot list the bucket)
+            if code in ('404', '403', 'NoSuchKey', 'NotFound'):
+                return 'initial'
+            logger.warning(f"Knowledge base generation unavailable, bypassing retrieval cache: {e}")
+            return None
+
+    def generation(self) -> Optional[str]:
+        if not self.bucket:
+            return None
+        with self._lock:
+            if self._generation is not None and time.monotonic() - self._checked_at < self.check_seconds:
+                return self._generation
+        generation = self._read_generation()
+        with self._lock:
+            if generation != self._generation and self._generation is not None:
+                logger.info(f"Knowledge base generation changed; dropping {len(self.entries)} cached retrievals")
+                self.entries.clear()
+            self._generation = generation
+            self._checked_at = time.monotonic()
+        return generation
+
+    def retrieve(self, knowledge_base_id: str, query: str, config: Dict[str, Any],
+                 fetch: Callable[[], Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """retrievalResults for query, from cache when the knowledge base has not changed"""
+        generation = self.generation()
+        if generation is None:
+            return fetch().get('retrievalResults', [])
+
+        key = (knowledge_base_id, normalize_query(query), json.dumps(config, sort_keys=True), generation)
+        results = self.entries.get(key, _MISSING)
+        if results is not _MISSING:
+            logger.info(f"Knowledge base retrieval cache hit: {query}")
+            return results
+
+        def fill() -> List[Dict[str, Any]]:
+            results = fetch().get('retrievalResults', [])
+            self.entries.set(key, results)
+            return results
+
+        return self._flight.do(key, fill)
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._generation = None
+        self.entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        stats = self.entries.stats()
+        stats['shared'] = self._flight.shared
+        return stats
+
+
+@lazy_singleton
+def get_retrieval_cache() -> RetrievalCache:
+    """Per-container retrieval cache for the S3_BUCKET knowledge base"""
+    return RetrievalCache()
@@ -0,0 +1,5 @@
+#!/bin/sh
+# Entry point for chatStreamResponse. The Lambda Web Adapter layer
+# (AWS_LAMBDA_EXEC_WRAPPER=/opt/bootstrap) starts this server on $PORT and
+# streams each invocation's response back through the function URL.
+exec python3 "$(dirname "$0")/chat_stream.py"
@@ -0,0 +1,82 @@
+import os
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Dict
+from lazy import lazy_singleton
+from ttl_cache import TTLCache, SingleFlight, _MISSING
+from query_utils import normalize_query
+
+logger = logging.getLogger()
+
+# Results younger than this are served without contacting the search provider
+WEB_SEARCH_CACHE_TTL_SECONDS = float(os.environ.get('WEB_SEARCH_CACHE_TTL_SECONDS', '300'))
+# Older results may still be served when the provider is slow or failing
+WEB_SEARCH_CACHE_MAX_STALE_SECONDS = float(os.environ.get('WEB_SEARCH_CACHE_MAX_STALE_SECONDS', '3600'))
+# With a stale copy in hand, how long to wait for a fresh one before answering with it
+WEB_SEARCH_STALE_AFTER_SECONDS = float(os.environ.get('WEB_SEARCH_STALE_AFTER_SECONDS', '2'))
+WEB_SEARCH_CACHE_MAX_ENTRIES = int(os.environ.get('WEB_SEARCH_CACHE_MAX_ENTRIES', '256'))
+
+# Refreshes outlive the request that started them when a stale result was served
+_search_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='web-search')
+
+
+class SearchCache:
+    """Cache of raw search provider responses, keyed on (provider, normalized query)
+
+    Fresh results are returned directly. Misses and expired entries go to the
+    provider once per key, however many callers ask concurrently. When an
+    expired copy is still within the stale window it is returned if the
+    provider errors or has not answered within stale_after_seconds; the
+    refresh keeps running and updates the cache for later callers.
+    """
+
+    def __init__(self, ttl_seconds: float = WEB_SEARCH_CACHE_TTL_SECONDS,
+                 max_stale_seconds: float = WEB_SEARCH_CACHE_MAX_STALE_SECONDS,
+                 stale_after_seconds: float = WEB_SEARCH_STALE_AFTER_SECONDS,
+                 max_entries: int = WEB_SEARCH_CACHE_MAX_ENTRIES):
+        self.entries = TTLCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+        self.max_stale_seconds = max_stale_seconds
+        self.stale_after_seconds = stale_after_seconds
+        self._flight = SingleFlight()
+        self.stale_served = 0
+
+    def _fetch(self, key: Any, fetch: Callable[[], Any]) -> Any:
+        start = time.time()
+        result = fetch()
+        self.entries.set(key, (result, time.time()))
+        logger.info(f"Web search {key[0]} fetched in {(time.time() - start) * 1000:.0f}ms")
+        return result
+
+    def get(self, provider: str, query: str, fetch: Callable[[], Any]) -> Any:
+        """Raw provider response for query; raises only if there is nothing usable to serve"""
+        key = (provider, normalize_query(query))
+        entry, fresh = self.entries.lookup(key, allow_stale=True)
+        if entry is not _MISSING and fresh:
+            return entry[0]
+
+        future = self._flight.submit(key, lambda: self._fetch(key, fetch), _search_executor)
+        if entry is _MISSING or time.time() - entry[1] > self.max_stale_seconds:
+            return future.result()
+
+        try:
+            return future.result(timeout=self.stale_after_seconds)
+        except FutureTimeoutError:
+            reason = f"no answer within {self.stale_after_seconds:.1f}s"
+        except Exception as e:
+            reason = str(e)
+        self.stale_served += 1
+        logger.warning(f"Serving stale web search result for '{key[1]}' "
+                       f"({time.time() - entry[1]:.0f}s old): {reason}")
+        return entry[0]
+
+    def stats(self) -> Dict[str, int]:
+        stats = self.entries.stats()
+        stats.update(shared=self._flight.shared, stale_served=self.stale_served)
+        return stats
+
+
+@lazy_singleton
+def get_search_cache() -> SearchCache:
+    """Per-container web search cache configured from the environment"""
+    return SearchCache()
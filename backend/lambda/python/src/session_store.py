@@ -0,0 +1,278 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from lazy import LazyClient, lazy_singleton
+from context_packing import elide_content
+
+logger = logging.getLogger()
+
+# Recent messages kept verbatim; older ones are folded into the rolling summary
+SESSION_MAX_MESSAGES = int(os.environ.get('SESSION_MAX_MESSAGES', '12'))
+SESSION_KEEP_MESSAGES = int(os.environ.get('SESSION_KEEP_MESSAGES', '6'))
+SESSION_TTL_SECONDS = int(os.environ.get('SESSION_TTL_SECONDS', str(30 * 24 * 3600)))
+# Stored messages are elided to this many estimated tokens (inline images always dropped),
+# keeping a session well inside DynamoDB's 400 KB item limit
+SESSION_MESSAGE_TOKEN_CAP = int(os.environ.get('SESSION_MESSAGE_TOKEN_CAP', '4000'))
+# How long a request waits for an in-flight summary before saving without it
+SUMMARY_WAIT_SECONDS = float(os.environ.get('SESSION_SUMMARY_WAIT_SECONDS', '5'))
+
+SUMMARY_PROMPT = """Update the running summary of a conversation between a manager and an AI assistant.
+Keep decisions, facts, figures, names and open questions; drop small talk. Answer with the summary only, in the language of the conversation.
+
+Current summary:
+{summary}
+
+New messages to fold in:
+{messages}"""
+
+# Summaries run beside the main model call; one worker is enough per container
+_summary_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='session-summary')
+
+
+class SessionConflictError(Exception):
+    """The session was updated by another request since it was loaded"""
+
+
+def _new_record(session_id: str, user_id: str) -> Dict[str, Any]:
+    return {
+        'session_id': session_id,
+        'user_id': user_id,
+        'summary': '',
+        'messages': [],
+        'summarized_messages': 0,
+        'version': 0,
+    }
+
+
+class SQLiteSessionStore:
+    """Session store on SQLite; ':memory:' gives a per-container stand-in for local runs and tests"""
+
+    def __init__(self, path: str = ':memory:'):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS sessions ('
+                'session_id TEXT PRIMARY KEY, user_id TEXT, data TEXT, version INTEGER, expires_at INTEGER)'
+            )
+            self._conn.commit()
+
+    def load(self, session_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT data, version, expires_at FROM sessions WHERE session_id = ?', (session_id,)
+            ).fetchone()
+        if not row:
+            return None
+        if row[2] < time.time():
+            with self._lock:
+                self._conn.execute('DELETE FROM sessions WHERE session_id = ?', (session_id,))
+                self._conn.commit()
+            return None
+        record = json.loads(row[0])
+        record['version'] = row[1]
+        return record
+
+    def save(self, record: Dict[str, Any]) -> None:
+        """Write the record if nobody else saved since it was loaded, bumping its version"""
+        data = json.dumps({k: v for k, v in record.items() if k != 'version'}, ensure_ascii=False)
+        expires_at = int(time.time()) + SESSION_TTL_SECONDS
+        with self._lock:
+            if record['version'] == 0:
+                cursor = self._conn.execute(
+                    'INSERT OR IGNORE INTO sessions VALUES (?, ?, ?, 1, ?)',
+                    (record['session_id'], record['user_id'], data, expires_at)
+                )
+            else:
+                cursor = self._conn.execute(
+                    'UPDATE sessions SET data = ?, version = version + 1, expires_at = ? '
+                    'WHERE session_id = ? AND version = ?',
+                    (data, expires_at, record['session_id'], record['version'])
+                )
+            self._conn.commit()
+        if cursor.rowcount != 1:
+            raise SessionConflictError(record['session_id'])
+        record['version'] += 1
+
+
+class DynamoDBSessionStore:
+    """Session store on a DynamoDB table keyed by sessionId, with a TTL attribute"""
+
+    def __init__(self, table_name: str, client: Any = None):
+        self.table_name = table_name
+        self.client = client or LazyClient('dynamodb')
+
+    def load(self, session_id: str) -> Optional[Dict[str, Any]]:
+        response = self.client.get_item(
+            TableName=self.table_name,
+            Key={'sessionId': {'S': session_id}},
+            ConsistentRead=True
+        )
+        item = response.get('Item')
+        if not item or int(item.get('expiresAt', {}).get('N', '0')) < time.time():
+            return None
+        return {
+            'session_id': session_id,
+            'user_id': item['userId']['S'],
+            'summary': item.get('summary', {}).get('S', ''),
+            'messages': json.loads(item.get('messages', {}).get('S', '[]')),
+            'summarized_messages': int(item.get('summarizedMessages', {}).get('N', '0')),
+            'version': int(item['version']['N']),
+        }
+
+    def save(self, record: Dict[str, Any]) -> None:
+        """Conditional put on the loaded version so concurrent turns cannot overwrite each other"""
+        item = {
+            'sessionId': {'S': record['session_id']},
+            'userId': {'S': record['user_id']},
+            'summary': {'S': record['summary']},
+            # Stored as one JSON string: cheaper to (de)serialize than nested DynamoDB maps
+            'messages': {'S': json.dumps(record['messages'], ensure_ascii=False)},
+            'summarizedMessages': {'N': str(record['summarized_messages'])},
+            'version': {'N': str(record['version'] + 1)},
+            'updatedAt': {'N': str(int(time.time()))},
+            'expiresAt': {'N': str(int(time.time()) + SESSION_TTL_SECONDS)},
+        }
+        if record['version'] == 0:
+            # A new session may replace one that expired but has not been swept by TTL yet
+            condition = {
+                'ConditionExpression': 'attribute_not_exists(sessionId) OR expiresAt < :now',
+                'ExpressionAttributeValues': {':now': {'N': str(int(time.time()))}}
+            }
+        else:
+            condition = {
+                'ConditionExpression': 'version = :expected',
+                'ExpressionAttributeValues': {':expected': {'N': str(record['version'])}}
+            }
+        try:
+            self.client.put_item(TableName=self.table_name, Item=item, **condition)
+        except Exception as e:
+            if 'ConditionalCheckFailed' in type(e).__name__ or 'ConditionalCheckFailed' in str(e):
+                raise SessionConflictError(record['session_id'])
+            raise
+        record['version'] += 1
+
+
+@lazy_singleton
+def get_session_store():
+    """Store selected by environment: SESSION_TABLE (DynamoDB), else SQLite at SESSION_DB_PATH or in memory"""
+    table_name = os.environ.get('SESSION_TABLE')
+    if table_name:
+        return DynamoDBSessionStore(table_name)
+    return SQLiteSessionStore(os.environ.get('SESSION_DB_PATH', ':memory:'))
+
+
+def format_for_summary(messages: List[Dict[str, Any]]) -> str:
+    lines = []
+    for message in messages:
+        content = message.get('content', '')
+        if not isinstance(content, str):
+            content = json.dumps(content, ensure_ascii=False)
+        lines.append(f"{message.get('role', 'user')}: {content}")
+    return '\n'.join(lines)
+
+
+class ConversationSession:
+    """Server-side conversation state for one sessionId
+
+    Clients send only the new message. The stored recent messages plus the
+    rolling summary stand in for the history. When the stored messages grow
+    past SESSION_MAX_MESSAGES, the oldest ones are summarized on a worker
+    thread while the main model call runs, and folded in when the turn is
+    recorded.
+    """
+
+    def __init__(self, store: Any, record: Dict[str, Any]):
+        self.store = store
+        self.record = record
+        self._summary_future: Optional[Future] = None
+        self._fold_count = 0
+
+    @classmethod
+    def open(cls, session_id: str, user_id: str, store: Any = None) -> 'ConversationSession':
+        store = store or get_session_store()
+        record = store.load(session_id)
+        if record is None:
+            record = _new_record(session_id, user_id)
+        elif record['user_id'] != user_id:
+            raise PermissionError(f"Session {session_id} belongs to another user")
+        return cls(store, record)
+
+    def history(self) -> List[Dict[str, Any]]:
+        """Messages to send the model in place of a client-supplied history"""
+        messages = list(self.record['messages'])
+        if self.record['summary']:
+            messages = [
+                {'role': 'user', 'content': f"Summary of our earlier conversation:\n{self.record['summary']}"},
+                {'role': 'assistant', 'content': 'Understood. I will keep that context in mind.'},
+            ] + messages
+        return messages
+
+    def start_summary(self, complete: Callable[[str], str]) -> None:
+        """Begin folding the oldest messages into the summary if the session has grown too long"""
+        messages = self.record['messages']
+        if len(messages) <= SESSION_MAX_MESSAGES or self._summary_future is not None:
+            return
+        fold_count = len(messages) - SESSION_KEEP_MESSAGES
+        # Keep the verbatim tail starting on a user turn
+        while fold_count < len(messages) and messages[fold_count].get('role') != 'user':
+            fold_count += 1
+        prompt = SUMMARY_PROMPT.format(
+            summary=self.record['summary'] or '(none)',
+            messages=format_for_summary(messages[:fold_count])
+        )
+        self._fold_count = fold_count
+        self._summary_future = _summary_executor.submit(complete, prompt)
+
+    def _apply_summary(self) -> None:
+        if self._summary_future is None:
+            return
+        try:
+            summary = self._summary_future.result(timeout=SUMMARY_WAIT_SECONDS)
+        except Exception as e:
+            # Keep the messages verbatim; the next turn will try again
+            logger.warning(f"Session summary skipped: {e}")
+            return
+        finally:
+            self._summary_future = None
+        if summary:
+            self.record['summary'] = summary.strip()
+            self.record['messages'] = self.record['messages'][self._fold_count:]
+            self.record['summarized_messages'] += self._fold_count
+            logger.info(f"Session {self.record['session_id']} folded {self._fold_count} messages into summary")
+
+    def record_turn(self, user_message: str, assistant_message: str) -> bool:
+        """Append the finished turn and persist the session; False if it could not be saved"""
+        self._apply_summary()
+        self.record['messages'] = self.record['messages'] + [
+            {'role': 'user', 'content': elide_content(user_message, SESSION_MESSAGE_TOKEN_CAP)},
+            {'role': 'assistant', 'content': elide_content(assistant_message, SESSION_MESSAGE_TOKEN_CAP)},
+        ]
+        try:
+            self.store.save(self.record)
+            return True
+        except SessionConflictError:
+            logger.warning(f"Session {self.record['session_id']} was updated concurrently; turn not saved")
+            return False
+        except Exception as e:
+            # The answer has already been produced; losing the turn beats failing the request
+            logger.error(f"Session {self.record['session_id']} could not be saved; turn not saved: {e}")
+            return False
+
+
+def open_session(body: Dict[str, Any], user: Dict[str, Any]) -> Tuple[Optional[ConversationSession], List[Dict[str, Any]]]:
+    """Resolve the history for a chat request
+
+    Requests that still carry a `history` array use it as before. Requests
+    with a sessionId and no history use the server-side session instead.
+    Returns (session or None, history).
+    """
+    if 'history' in body or not body.get('sessionId'):
+        return None, body.get('history', [])
+    session = ConversationSession.open(body['sessionId'], user.get('sub', 'anonymous'))
+    return session, session.history()
@@ -1,25 +1,55 @@
 import json
 import os
-import boto3
+import time
 import logging
-import base64
-import requests
-from typing import Dict, Any, List, Optional
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Callable, Dict, Any, List, Optional, Tuple
 from datetime import datetime
+from lazy import LazyClient, LazyModule
+from auth_validator import validate_token, log_auth_event
+from agent_registry import get_or_create, get_stats
+from image_intake import ImageIntakeError, load_image
+from image_analysis_cache import get_image_analysis_cache
+from search_cache import get_search_cache
+from context_packing import log_packing, pack_messages
+from session_store import open_session
+from response_cache import cache_requested, cached_answer
+from prompt_cache import PromptCacheConfig, apply_cache_breakpoints, extract_cache_usage, log_cache_usage
+
+requests = LazyModule('requests')
 
 # Configure logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 # AWS clients
-bedrock_client = boto3.client('bedrock-runtime')
-s3_client = boto3.client('s3')
-ssm_client = boto3.client('ssm')
+bedrock_client = LazyClient('bedrock-runtime')
+s3_client = LazyClient('s3')
+
+# Tool calls for one message run side by side on a small shared pool
+TOOL_MAX_WORKERS = int(os.environ.get('TOOL_MAX_WORKERS', '4'))
+DEFAULT_TOOL_TIMEOUT_SECONDS = 15.0
+TOOL_TIMEOUT_SECONDS = {
+    'web_search': float(os.environ.get('WEB_SEARCH_TIMEOUT_SECONDS', '12')),
+    'analyze_image': float(os.environ.get('IMAGE_ANALYSIS_TIMEOUT_SECONDS', '30')),
+}
+_tool_executor = ThreadPoolExecutor(max_workers=TOOL_MAX_WORKERS, thread_name_prefix='chat-tool')
+
+SYSTEM_PROMPT = """You are an AI assistant for business management support. You help managers with decision-making, efficiency improvement, and information gathering.
+
+You have access to:
+1. Web search capabilities for current information
+2. Image analysis for charts, documents, and visual content
+
+Always provide helpful, accurate, and professional responses. If you used any tools, acknowledge the information they provided."""
+
+IMAGE_ANALYSIS_PROMPT = "Please analyze this image in detail. Describe what you see, including any text, charts, diagrams, objects, people, or other relevant details. If there are any business-related elements like charts, graphs, or documents, pay special attention to those."
 
 class SimpleChatAgent:
     def __init__(self):
         self.model_id = os.environ.get('CLAUDE_MODEL_ID', 'anthropic.claude-3-5-sonnet-20240620-v1:0')
         self.region = os.environ.get('AWS_REGION', os.environ.get('REGION', 'ap-northeast-1'))
+        self.prompt_cache = PromptCacheConfig(model_id=self.model_id)
         
     def web_search(self, query: str) -> str:
         """Simple web search using DuckDuckGo Instant Answer API"""
@@ -35,10 +65,13 @@ class SimpleChatAgent:
                 'skip_disambig': '1'
             }
             
-            response = requests.get(url, params=params, timeout=10)
-            response.raise_for_status()
+            def fetch():
+                response = requests.get(url, params=params, timeout=10)
+                response.raise_for_status()
+                return response.json()
             
-            data = response.json()
+            # Popular queries repeat across users; reuse recent results
+            data = get_search_cache().get('duckduckgo_instant', query, fetch)
             
             # Extract relevant information
             results = []
@@ -76,51 +109,11 @@ class SimpleChatAgent:
         try:
             logger.info(f"Analyzing image: {image_input[:50]}...")
             
-            # Extract image data
-            image_data = None
-            image_format = None
-            
-            if image_input.startswith('data:image/'):
-                # Data URL format
-                header, data = image_input.split(',', 1)
-                image_format = header.split(';')[0].split('/')[1]
-                image_data = base64.b64decode(data)
-            elif image_input.startswith('s3://') or '/' in image_input:
-                # S3 key or URL
-                s3_key = image_input.replace('s3://', '').split('/', 1)
-                if len(s3_key) == 2:
-                    bucket, key = s3_key
-                else:
-                    bucket = os.environ.get('S3_BUCKET', '').replace('s3://', '')
-                    key = image_input
-                
-                try:
-                    response = s3_client.get_object(Bucket=bucket, Key=key)
-                    image_data = response['Body'].read()
-                    image_format = key.split('.')[-1].lower()
-                    if image_format == 'jpg':
-                        image_format = 'jpeg'
-                except Exception as s3_error:
-                    logger.error(f"S3 image retrieval error: {s3_error}")
-                    return f"Failed to retrieve image from S3: {str(s3_error)}"
-            else:
-                # Assume it's a base64 encoded image
-                try:
-                    image_data = base64.b64decode(image_input)
-                    image_format = 'jpeg'  # default
-                except Exception:
-                    return "Invalid image format. Please provide a valid image URL, S3 key, or base64 data."
-            
-            if not image_data:
-                return "Failed to extract image data"
-            
-            # Validate image format
-            supported_formats = ['jpeg', 'jpg', 'png', 'gif', 'webp']
-            if image_format not in supported_formats:
-                return f"Unsupported image format: {image_format}. Supported formats: {', '.join(supported_formats)}"
-            
-            # Encode image for Claude
-            image_b64 = base64.b64encode(image_data).decode('utf-8')
+            # Size limits, downscaling and base64 encoding all happen in the intake path
+            try:
+                image = load_image(image_input)
+            except ImageIntakeError as e:
+                return str(e)
             
             # Prepare request for Bedrock
             message = {
@@ -128,33 +121,31 @@ class SimpleChatAgent:
                 "content": [
                     {
                         "type": "text",
-                        "text": "Please analyze this image in detail. Describe what you see, including any text, charts, diagrams, objects, people, or other relevant details. If there are any business-related elements like charts, graphs, or documents, pay special attention to those."
+                        "text": IMAGE_ANALYSIS_PROMPT
                     },
-                    {
-                        "type": "image",
-                        "source": {
-                            "type": "base64",
-                            "media_type": f"image/{image_format}",
-                            "data": image_b64
-                        }
-                    }
+                    image.anthropic_block()
                 ]
             }
             
-            # Call Bedrock with image
-            response = bedrock_client.invoke_model(
-                modelId=self.model_id,
-                body=json.dumps({
-                    "anthropic_version": "bedrock-2023-05-31",
-                    "max_tokens": 2000,
-                    "messages": [message]
-                })
-            )
+            def analyze() -> str:
+                # Call Bedrock with image
+                response = bedrock_client.invoke_model(
+                    modelId=self.model_id,
+                    body=json.dumps({
+                        "anthropic_version": "bedrock-2023-05-31",
+                        "max_tokens": 2000,
+                        "messages": [message]
+                    })
+                )
+                response_body = json.loads(response['body'].read())
+                if 'content' in response_body and response_body['content']:
+                    return response_body['content'][0]['text']
+                return ''
             
-            response_body = json.loads(response['body'].read())
+            # Repeat images are served from the analysis cache
+            analysis = get_image_analysis_cache().get_or_analyze(image.sha256, image.size, IMAGE_ANALYSIS_PROMPT, self.model_id, analyze)
             
-            if 'content' in response_body and response_body['content']:
-                analysis = response_body['content'][0]['text']
+            if analysis:
                 return f"Image analysis results:\n\n{analysis}"
             else:
                 return "No image analysis results returned"
@@ -163,6 +154,45 @@ class SimpleChatAgent:
             logger.error(f"Image analysis error: {e}")
             return f"Image analysis failed: {str(e)}"
     
+    def complete(self, prompt: str, max_tokens: int = 1000) -> str:
+        """Single-turn completion without tools, e.g. for session summaries"""
+        response = bedrock_client.invoke_model(
+            modelId=self.model_id,
+            body=json.dumps({
+                "anthropic_version": "bedrock-2023-05-31",
+                "max_tokens": max_tokens,
+                "messages": [{"role": "user", "content": prompt}]
+            })
+        )
+        response_body = json.loads(response['body'].read())
+        return response_body['content'][0]['text'] if response_body.get('content') else ''
+    
+    def run_tools(self, tool_calls: List[Tuple[str, str, Callable[[], str]]]) -> List[str]:
+        """Run (tool name, result heading, call) entries concurrently
+
+        Each tool gets its own timeout, measured from when the batch started,
+        so the batch takes as long as its slowest tool. Results are returned
+        in the order the calls were listed, whatever order they finish in.
+        """
+        start = time.monotonic()
+        futures = [(name, heading, _tool_executor.submit(call)) for name, heading, call in tool_calls]
+        
+        tool_results = []
+        for name, heading, future in futures:
+            timeout = TOOL_TIMEOUT_SECONDS.get(name, DEFAULT_TOOL_TIMEOUT_SECONDS)
+            try:
+                output = future.result(timeout=max(0.0, start + timeout - time.monotonic()))
+            except FutureTimeoutError:
+                logger.warning(f"Tool {name} timed out after {timeout:g}s")
+                output = f"{name} did not finish within {timeout:g} seconds"
+            except Exception as e:
+                logger.error(f"Tool {name} error: {e}")
+                output = f"{name} failed: {str(e)}"
+            tool_results.append(f"\n[{heading}]:\n{output}\n")
+        
+        logger.info(f"Tools {[name for name, _, _ in tool_calls]} finished in {(time.monotonic() - start) * 1000:.0f}ms")
+        return tool_results
+    
     def invoke_claude(self, messages: List[Dict], use_tools: bool = True) -> str:
         """Invoke Claude 3.5 Sonnet via Bedrock with simple tool calling"""
         try:
@@ -178,8 +208,8 @@ class SimpleChatAgent:
                 'image', 'picture', 'analyze', 'photo', 'chart', 'graph', 'diagram'
             ]) and ('s3://' in latest_message or 'data:image/' in latest_message or '.jpg' in latest_message or '.png' in latest_message)
             
-            # Perform tool actions if needed
-            tool_results = []
+            # Collect the tool calls this message needs; they are independent of each other
+            tool_calls = []
             
             if use_tools and should_search:
                 # Extract search query (simple approach)
@@ -190,25 +220,19 @@ class SimpleChatAgent:
                         search_query = search_query.lower().replace(prefix, '')
                         break
                 
-                search_result = self.web_search(search_query)
-                tool_results.append(f"\n[Web Search Results]:\n{search_result}\n")
+                tool_calls.append(('web_search', 'Web Search Results', lambda: self.web_search(search_query)))
             
             if use_tools and should_analyze_image:
                 # Extract image reference from message
                 for part in latest_message.split():
                     if 's3://' in part or 'data:image/' in part or part.endswith(('.jpg', '.jpeg', '.png', '.gif')):
-                        image_result = self.analyze_image(part)
-                        tool_results.append(f"\n[Image Analysis Results]:\n{image_result}\n")
+                        tool_calls.append(('analyze_image', 'Image Analysis Results', lambda part=part: self.analyze_image(part)))
                         break
             
+            tool_results = self.run_tools(tool_calls) if tool_calls else []
+            
             # Prepare system message
-            system_message = """You are an AI assistant for business management support. You help managers with decision-making, efficiency improvement, and information gathering.
-
-You have access to:
-1. Web search capabilities for current information
-2. Image analysis for charts, documents, and visual content
-
-Always provide helpful, accurate, and professional responses. If you used any tools, acknowledge the information they provided."""
+            system_message = SYSTEM_PROMPT
 
             # Format messages for Claude
             claude_messages = []
@@ -224,11 +248,14 @@ Always provide helpful, accurate, and professional responses. If you used any to
                         "content": content
                     })
             
+            # Mark the system prompt and the stable history prefix as cacheable
+            system, claude_messages = apply_cache_breakpoints(system_message, claude_messages, self.prompt_cache)
+            
             # Prepare request
             request_body = {
                 "anthropic_version": "bedrock-2023-05-31",
                 "max_tokens": 2000,
-                "system": system_message,
+                "system": system,
                 "messages": claude_messages
             }
             
@@ -239,6 +266,7 @@ Always provide helpful, accurate, and professional responses. If you used any to
             )
             
             response_body = json.loads(response['body'].read())
+            log_cache_usage('simple_chat_agent', extract_cache_usage(response_body))
             
             if 'content' in response_body and response_body['content']:
                 return response_body['content'][0]['text']
@@ -250,13 +278,6 @@ Always provide helpful, accurate, and professional responses. If you used any to
             return f"AI処理中にエラーが発生しました: {str(e)}"
 
 
-def validate_token(auth_header):
-    """Simple token validation (placeholder)"""
-    if auth_header and auth_header.startswith('Bearer '):
-        return {'sub': 'test-user', 'cognito:groups': ['admin']}
-    return None
-
-
 def handler(event, context):
     """Lambda handler for simple chat agent"""
     logger.info(f"Simple chat agent event: {json.dumps(event, default=str)}")
@@ -304,10 +325,11 @@ def handler(event, context):
             body = json.loads(body_str)
         else:
             body = body_str
-            
+        
+        # Log authentication event
+        log_auth_event(user, 'simple_chat_access', f'Session: {body.get("sessionId", "unknown")}')
         message = body.get('message', '')
         session_id = body.get('sessionId', '')
-        conversation_history = body.get('history', [])
         
         if not message:
             return {
@@ -316,14 +338,38 @@ def handler(event, context):
                 'body': json.dumps({'error': 'Message is required'})
             }
         
-        # Initialize chat agent
-        agent = SimpleChatAgent()
+        # Reuse the chat agent across warm invocations
+        agent = get_or_create('SimpleChatAgent', (), SimpleChatAgent)
+        
+        # History comes from the request, or from the server-side session when
+        # the client sends only sessionId and the new message
+        try:
+            session, conversation_history = open_session(body, user)
+        except PermissionError:
+            return {
+                'statusCode': 403,
+                'headers': cors_headers,
+                'body': json.dumps({'error': 'Session belongs to another user'})
+            }
+        if session:
+            session.start_summary(agent.complete)
+        
+        # Prepare messages for agent, keeping the history within the token budget
+        messages, packing = pack_messages(
+            conversation_history + [{'role': 'user', 'content': message}],
+            system_prompt=SYSTEM_PROMPT
+        )
+        log_packing('simple_chat_agent', packing)
         
-        # Prepare messages for agent
-        messages = conversation_history + [{'role': 'user', 'content': message}]
+        # Get response from agent; repeated questions are answered from the response cache
+        response = cached_answer(
+            'simple_chat_agent', user, agent.model_id, SYSTEM_PROMPT, messages,
+            lambda: agent.invoke_claude(messages),
+            enabled=cache_requested(body, headers)
+        )
         
-        # Get response from agent
-        response = agent.invoke_claude(messages)
+        if session:
+            session.record_turn(message, response)
         
         # Prepare response
         result = {
@@ -337,6 +383,7 @@ def handler(event, context):
         }
         
         logger.info(f"Chat response generated for user: {user.get('sub', 'unknown')}")
+        logger.info(f"Agent registry stats: {json.dumps(get_stats())}")
         
         return {
             'statusCode': 200,
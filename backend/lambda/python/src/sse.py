@@ -0,0 +1,194 @@
+import json
+import queue
+import threading
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+# Preferred places to cut an over-budget buffer, for both Latin and CJK text
+_BREAK_CHARS = frozenset(' \t\n。、，．！？：；」』）】,.!?:;')
+
+
+def format_sse(event: str, data: Dict[str, Any]) -> str:
+    """Serialize a single stream event as an SSE `data:` frame"""
+    # Raw UTF-8 is a third the size of \\uXXXX escapes for Japanese text
+    return f"data: {json.dumps({'event': event, 'data': data}, ensure_ascii=False)}\n\n"
+
+
+def chunk_text(chunk: Any) -> str:
+    """Extract the text delta from a ChatBedrock stream chunk
+
+    Converse-stream chunks carry a list of content blocks instead of a plain
+    string, and tool-use blocks carry no text at all.
+    """
+    content = getattr(chunk, 'content', chunk)
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        parts = []
+        for block in content:
+            if isinstance(block, str):
+                parts.append(block)
+            elif isinstance(block, dict) and block.get('type') == 'text':
+                parts.append(block.get('text', ''))
+        return ''.join(parts)
+    return ''
+
+
+def _split_at_budget(text: str, max_bytes: int) -> Tuple[str, str]:
+    """Split text so the head fits in max_bytes of UTF-8, preferring a word or punctuation break"""
+    head = text.encode('utf-8')[:max_bytes].decode('utf-8', 'ignore')
+    if not head:
+        # A single code point wider than the budget
+        head = text[0]
+    elif len(head) < len(text):
+        for i in range(len(head) - 1, len(head) // 2, -1):
+            if head[i] in _BREAK_CHARS:
+                head = head[:i + 1]
+                break
+    return head, text[len(head):]
+
+
+class _StreamFailure:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+_STREAM_DONE = object()
+
+
+def coalesce_chunks(pieces: Iterable[Any], max_bytes: int = 256, max_delay: float = 0.03) -> Iterator[Any]:
+    """Merge small text pieces into frames of at most max_bytes UTF-8 bytes
+
+    A frame is flushed when the buffer reaches max_bytes or max_delay seconds
+    after its first piece arrived, whichever comes first. The first piece is
+    flushed immediately to keep time-to-first-byte low. Sizes are measured in
+    encoded bytes, so Japanese text without spaces is cut the same way as
+    English. Upstream is read on a helper thread so a stalled model stream
+    still flushes on time; upstream errors are re-raised here. Non-string
+    items (e.g. tool events) flush the buffer and are passed through as is.
+    """
+    pending: queue.Queue = queue.Queue()
+    stop = threading.Event()
+
+    def pump():
+        try:
+            for piece in pieces:
+                if stop.is_set():
+                    break
+                if piece:
+                    pending.put(piece)
+        except BaseException as e:
+            pending.put(_StreamFailure(e))
+        finally:
+            pending.put(_STREAM_DONE)
+
+    threading.Thread(target=pump, daemon=True).start()
+
+    buffer = ''
+    deadline = 0.0
+    first = True
+    try:
+        while True:
+            timeout = max(0.0, deadline - time.monotonic()) if buffer else None
+            try:
+                item = pending.get(timeout=timeout)
+            except queue.Empty:
+                yield buffer
+                buffer = ''
+                continue
+
+            if item is _STREAM_DONE or isinstance(item, _StreamFailure):
+                while buffer:
+                    head, buffer = _split_at_budget(buffer, max_bytes)
+                    yield head
+                if isinstance(item, _StreamFailure):
+                    raise item.error
+                return
+
+            if not isinstance(item, str):
+                if buffer:
+                    yield buffer
+                    buffer = ''
+                yield item
+                continue
+
+            if not buffer:
+                deadline = time.monotonic() + (0.0 if first else max_delay)
+                first = False
+            buffer += item
+
+            while len(buffer) * 4 >= max_bytes and len(buffer.encode('utf-8')) >= max_bytes:
+                head, buffer = _split_at_budget(buffer, max_bytes)
+                yield head
+            if buffer and time.monotonic() >= deadline:
+                yield buffer
+                buffer = ''
+    finally:
+        stop.set()
+
+
+def iter_encoded(frames: Iterable[str]) -> Iterator[bytes]:
+    """Encode SSE frames for a byte-oriented response stream"""
+    for frame in frames:
+        yield frame.encode('utf-8')
+
+
+# Stream protocol versions:
+#   1 - every chunk carries the accumulated `fullContent` (legacy clients)
+#   2 - chunks carry only the `content` delta and a `seq` number; a
+#       `checkpoint` event with the accumulated text is sent every
+#       `checkpoint_interval` chunks so clients can resync
+LEGACY_PROTOCOL_VERSION = 1
+PROTOCOL_VERSION = 2
+
+
+class StreamEncoder:
+    """Build SSE frames for one streamed answer under a given protocol version"""
+
+    def __init__(self, version: int = PROTOCOL_VERSION, checkpoint_interval: int = 50):
+        self.version = version if version in (LEGACY_PROTOCOL_VERSION, PROTOCOL_VERSION) else PROTOCOL_VERSION
+        self.checkpoint_interval = checkpoint_interval
+        self.seq = 0
+        self._parts: List[str] = []
+        self._length = 0
+
+    @property
+    def content(self) -> str:
+        """Text accumulated so far"""
+        if len(self._parts) > 1:
+            self._parts = [''.join(self._parts)]
+        return self._parts[0] if self._parts else ''
+
+    def start(self, data: Dict[str, Any]) -> str:
+        return format_sse('start', {**data, 'protocolVersion': self.version})
+
+    def chunk(self, text: str) -> str:
+        """Frame a text delta, followed by a checkpoint when one is due"""
+        self.seq += 1
+        self._parts.append(text)
+        self._length += len(text)
+
+        if self.version == LEGACY_PROTOCOL_VERSION:
+            return format_sse('chunk', {'content': text, 'fullContent': self.content})
+
+        frame = format_sse('chunk', {'seq': self.seq, 'content': text})
+        if self.checkpoint_interval and self.seq % self.checkpoint_interval == 0:
+            frame += self.checkpoint()
+        return frame
+
+    def checkpoint(self) -> str:
+        return format_sse('checkpoint', {
+            'seq': self.seq,
+            'length': self._length,
+            'fullContent': self.content
+        })
+
+    def end(self, message: Dict[str, Any]) -> str:
+        return format_sse('end', {'seq': self.seq, 'message': {**message, 'content': self.content}})
+
+    def event(self, name: str, data: Dict[str, Any]) -> str:
+        """Frame a non-text event, tagged with the seq of the last chunk before it"""
+        return format_sse(name, {'seq': self.seq, **data})
+
+    def error(self, error: str) -> str:
+        return format_sse('error', {'seq': self.seq, 'error': error})
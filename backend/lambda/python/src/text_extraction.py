@@ -0,0 +1,183 @@
+import io
+import os
+import json
+import time
+import logging
+import zipfile
+import tempfile
+from contextlib import contextmanager
+from typing import Any, Dict, IO, Iterator, Optional
+from xml.etree import ElementTree
+from lazy import LazyClient, LazyModule
+
+# Optional dependency; only PDF extraction needs it
+pypdf = LazyModule('pypdf')
+
+logger = logging.getLogger()
+
+s3_client = LazyClient('s3')
+
+# Per-document budget; extraction stops cleanly at whichever is hit first
+EXTRACT_MAX_PAGES = int(os.environ.get('EXTRACT_MAX_PAGES', '500'))
+EXTRACT_MAX_SECONDS = float(os.environ.get('EXTRACT_MAX_SECONDS', '60'))
+# Downloads stay in memory up to this size and spill to /tmp beyond it
+EXTRACT_SPOOL_MAX_BYTES = int(os.environ.get('EXTRACT_SPOOL_MAX_MB', '16')) * 1024 * 1024
+# Text and Word documents have no pages; they are cut into sections of about this many characters
+EXTRACT_SECTION_CHARS = int(os.environ.get('EXTRACT_SECTION_CHARS', '4000'))
+
+PDF_TYPE = 'application/pdf'
+DOCX_TYPE = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+TEXT_TYPE = 'text/plain'
+
+_WORD_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+_DOWNLOAD_CHUNK_BYTES = 1024 * 1024
+
+
+class UnsupportedDocumentError(Exception):
+    """The content type has no extractor, or the extractor's dependency is missing"""
+
+
+class ExtractionBudget:
+    """Page and wall-clock limits for one document
+
+    A page is a PDF page, or one section of a text or Word document.
+    """
+
+    def __init__(self, max_pages: int = EXTRACT_MAX_PAGES, max_seconds: float = EXTRACT_MAX_SECONDS):
+        self.max_pages = max_pages
+        self.max_seconds = max_seconds
+        self.pages = 0
+        self.started = time.monotonic()
+        self.exhausted: Optional[str] = None
+
+    def allow(self) -> bool:
+        """Charge one page; False once either limit is reached"""
+        if self.exhausted:
+            return False
+        if self.pages >= self.max_pages:
+            self.exhausted = f"page limit ({self.max_pages})"
+        elif time.monotonic() - self.started > self.max_seconds:
+            self.exhausted = f"time limit ({self.max_seconds:g}s)"
+        else:
+            self.pages += 1
+            return True
+        return False
+
+
+@contextmanager
+def open_spooled(bucket: str, key: str) -> Iterator[IO[bytes]]:
+    """Stream an S3 object into a spooled temporary file and yield it rewound"""
+    with tempfile.SpooledTemporaryFile(max_size=EXTRACT_SPOOL_MAX_BYTES) as buffer:
+        body = s3_client.get_object(Bucket=bucket, Key=key)['Body']
+        for chunk in iter(lambda: body.read(_DOWNLOAD_CHUNK_BYTES), b''):
+            buffer.write(chunk)
+        body.close()
+        buffer.seek(0)
+        yield buffer
+
+
+def _section(index: int, text: str, page: Optional[int] = None) -> Dict[str, Any]:
+    section = {'section': index, 'text': text}
+    if page is not None:
+        section['page'] = page
+    return section
+
+
+def iter_pdf_pages(stream: IO[bytes], budget: ExtractionBudget) -> Iterator[Dict[str, Any]]:
+    try:
+        reader = pypdf.PdfReader(stream)
+    except ImportError:
+        raise UnsupportedDocumentError("PDF extraction requires the pypdf package")
+    if reader.is_encrypted:
+        # Many PDFs are encrypted with an empty user password
+        reader.decrypt('')
+    index = 0
+    for number, page in enumerate(reader.pages, start=1):
+        if not budget.allow():
+            return
+        text = (page.extract_text() or '').strip()
+        if text:
+            yield _section(index, text, page=number)
+            index += 1
+
+
+def _docx_paragraphs(stream: IO[bytes]) -> Iterator[tuple]:
+    """(text, is_heading) for each paragraph, parsed incrementally from word/document.xml"""
+    with zipfile.ZipFile(stream) as archive, archive.open('word/document.xml') as document:
+        for _, element in ElementTree.iterparse(document, events=('end',)):
+            if element.tag != f'{_WORD_NS}p':
+                continue
+            parts = []
+            for node in element.iter():
+                if node.tag == f'{_WORD_NS}t':
+                    parts.append(node.text or '')
+                elif node.tag == f'{_WORD_NS}tab':
+                    parts.append('\t')
+                elif node.tag in (f'{_WORD_NS}br', f'{_WORD_NS}cr'):
+                    parts.append('\n')
+            style = element.find(f'{_WORD_NS}pPr/{_WORD_NS}pStyle')
+            is_heading = style is not None and style.get(f'{_WORD_NS}val', '').startswith(('Heading', 'Title'))
+            element.clear()
+            yield ''.join(parts).strip(), is_heading
+
+
+def _grouped(lines: Iterator[tuple], budget: ExtractionBudget) -> Iterator[Dict[str, Any]]:
+    """Join (text, starts_section) lines into sections of about EXTRACT_SECTION_CHARS"""
+    index, parts, size = 0, [], 0
+    for text, starts_section in lines:
+        if parts and (starts_section or size + len(text) > EXTRACT_SECTION_CHARS):
+            if not budget.allow():
+                return
+            yield _section(index, '\n'.join(parts))
+            index, parts, size = index + 1, [], 0
+        if text:
+            parts.append(text)
+            size += len(text) + 1
+    if parts and budget.allow():
+        yield _section(index, '\n'.join(parts))
+
+
+def iter_docx_sections(stream: IO[bytes], budget: ExtractionBudget) -> Iterator[Dict[str, Any]]:
+    try:
+        yield from _grouped(_docx_paragraphs(stream), budget)
+    except (zipfile.BadZipFile, KeyError, ElementTree.ParseError) as e:
+        raise UnsupportedDocumentError(f"Not a readable Word document: {e}")
+
+
+def iter_text_sections(stream: IO[bytes], budget: ExtractionBudget) -> Iterator[Dict[str, Any]]:
+    text = io.TextIOWrapper(stream, encoding='utf-8', errors='replace')
+    try:
+        yield from _grouped(((line.rstrip('\r\n'), False) for line in text), budget)
+    finally:
+        # Leave the underlying buffer open for the caller
+        text.detach()
+
+
+def extract_sections(stream: IO[bytes], content_type: str,
+                     budget: Optional[ExtractionBudget] = None) -> Iterator[Dict[str, Any]]:
+    """Yield {'section', 'text'[, 'page']} dicts one page or section at a time
+
+    Stops early, without raising, when the budget runs out; check
+    budget.exhausted afterwards to tell a truncated document from a short one.
+    """
+    budget = budget or ExtractionBudget()
+    if content_type == PDF_TYPE:
+        return iter_pdf_pages(stream, budget)
+    if content_type == DOCX_TYPE:
+        return iter_docx_sections(stream, budget)
+    if content_type == TEXT_TYPE:
+        return iter_text_sections(stream, budget)
+    raise UnsupportedDocumentError(f"Text extraction not supported for {content_type}")
+
+
+def write_outputs(sections: Iterator[Dict[str, Any]], text_out: IO[bytes], jsonl_out: IO[bytes],
+                  source_key: str) -> int:
+    """Write sections as plain text and as JSONL with page numbers; returns the section count"""
+    count = 0
+    for section in sections:
+        if count:
+            text_out.write(b'\n\n')
+        text_out.write(section['text'].encode('utf-8'))
+        jsonl_out.write(json.dumps({'source': source_key, **section}, ensure_ascii=False).encode('utf-8') + b'\n')
+        count += 1
+    return count
@@ -0,0 +1,156 @@
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import Executor, Future
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire after a TTL
+
+    Expired entries are kept (until evicted) so callers can still read them
+    with allow_stale=True, e.g. to serve a stale result when upstream fails.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 300.0, clock: Callable[[], float] = time.monotonic):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._entries: 'OrderedDict[Hashable, Tuple[Any, float]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Any = None, allow_stale: bool = False) -> Any:
+        value, fresh = self.lookup(key, allow_stale=allow_stale)
+        return default if value is _MISSING else value
+
+    def lookup(self, key: Hashable, allow_stale: bool = False) -> Tuple[Any, bool]:
+        """Return (value, is_fresh); value is the module's _MISSING sentinel on a miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return _MISSING, False
+            value, expires_at = entry
+            fresh = self._clock() < expires_at
+            if not fresh and not allow_stale:
+                self.misses += 1
+                return _MISSING, False
+            self._entries.move_to_end(key)
+            if fresh:
+                self.hits += 1
+            else:
+                self.stale_hits += 1
+            return value, fresh
+
+    def set(self, key: Hashable, value: Any, ttl_seconds: Optional[float] = None) -> None:
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        with self._lock:
+            self._entries[key] = (value, self._clock() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        """Whether the key is still held, fresh or stale"""
+        with self._lock:
+            return key in self._entries
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Collapse concurrent calls with the same key into one upstream call
+
+    The first caller for a key runs fn; callers arriving while it runs wait
+    for and share its result (or exception).
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, _Call] = {}
+        self._futures: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+        self.shared = 0
+
+    def do(self, key: Hashable, fn: Callable[[], Any], timeout: Optional[float] = None) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.shared += 1
+
+        if not leader:
+            if not call.done.wait(timeout):
+                raise TimeoutError(f"Timed out waiting for in-flight call {key!r}")
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def submit(self, key: Hashable, fn: Callable[[], Any], executor: Executor) -> Future:
+        """Like do(), but run fn on executor and return the shared Future
+
+        Lets a caller stop waiting (e.g. to serve a stale value) while the
+        call still completes for everyone else.
+        """
+        with self._lock:
+            future = self._futures.get(key)
+            if future is not None:
+                self.shared += 1
+                return future
+            future = self._futures[key] = executor.submit(fn)
+        future.add_done_callback(lambda _: self._forget(key, future))
+        return future
+
+    def _forget(self, key: Hashable, future: Future) -> None:
+        with self._lock:
+            if self._futures.get(key) is future:
+                del self._futures[key]
+
+    def in_flight(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._calls or key in self._futures
@@ -0,0 +1,495 @@
+import os
+import io
+import json
+import time
+import uuid
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Set
+from lazy import LazyClient, LazyModule, lazy_singleton
+from ttl_cache import TTLCache
+from embeddings import EMBEDDING_DIMENSIONS, titan_embed
+from query_utils import normalize_query
+
+# Optional dependency; without it the index is skipped and searches go to Bedrock
+np = LazyModule('numpy')
+
+logger = logging.getLogger()
+
+KB_LOCAL_INDEX_ENABLED = os.environ.get('KB_LOCAL_INDEX_ENABLED', 'true').lower() == 'true'
+# Shards and the merged index live here in the uploads bucket, outside the uploads/ trigger
+KB_LOCAL_INDEX_PREFIX = os.environ.get('KB_LOCAL_INDEX_PREFIX', 'processed/vector-index/')
+# Local directory used instead of S3, for local runs and tests
+KB_LOCAL_INDEX_DIR = os.environ.get('KB_LOCAL_INDEX_DIR', '')
+# Where chat containers keep their downloaded copy of the vectors
+KB_LOCAL_INDEX_CACHE_DIR = os.environ.get('KB_LOCAL_INDEX_CACHE_DIR', '/tmp/kb-vector-index')
+# Below this cosine similarity the local hit is not trusted and Bedrock is asked instead
+KB_LOCAL_INDEX_MIN_SCORE = float(os.environ.get('KB_LOCAL_INDEX_MIN_SCORE', '0.5'))
+KB_LOCAL_INDEX_CHECK_SECONDS = float(os.environ.get('KB_LOCAL_INDEX_CHECK_SECONDS', '30'))
+KB_LOCAL_INDEX_CHUNK_CHARS = int(os.environ.get('KB_LOCAL_INDEX_CHUNK_CHARS', '1500'))
+KB_LOCAL_INDEX_MAX_CHUNKS = int(os.environ.get('KB_LOCAL_INDEX_MAX_CHUNKS', '2000'))
+# Shared by every document in a batch, so bulk uploads do not flood Titan
+KB_LOCAL_INDEX_EMBED_WORKERS = int(os.environ.get('KB_LOCAL_INDEX_EMBED_WORKERS', '4'))
+
+INDEX_NAME = 'index.json'
+SHARD_DIR = 'shards/'
+# Marks a document the indexer could not handle; it counts as covered but has no vectors
+SKIPPED_SUFFIX = '.skipped'
+# Documents the index mirrors, in the uploads bucket
+KB_DOCUMENT_PREFIX = 'knowledge-base/'
+# Concurrent rebuilds conflict on index.json; the loser starts over this many times
+REBUILD_ATTEMPTS = 5
+# Query embeddings are reused; repeated questions then cost only the dot products
+QUERY_EMBEDDING_ENTRIES = 256
+QUERY_EMBEDDING_TTL_SECONDS = 3600
+
+s3_client = LazyClient('s3')
+
+# Serializes conditional writes to LocalIndexStore within the process
+_local_put_lock = threading.Lock()
+
+_embed_executor = ThreadPoolExecutor(max_workers=KB_LOCAL_INDEX_EMBED_WORKERS, thread_name_prefix='kb-embed')
+
+
+class IndexConflictError(Exception):
+    """The object changed since its version was read"""
+
+
+def _error_code(error: Exception) -> str:
+    return str(getattr(error, 'response', {}).get('Error', {}).get('Code', ''))
+
+
+def _is_missing(error: Exception) -> bool:
+    return _error_code(error) in ('NoSuchKey', '404', '403', 'NotFound')
+
+
+class S3IndexStore:
+    def __init__(self, bucket: str, prefix: str = KB_LOCAL_INDEX_PREFIX, cache_dir: str = KB_LOCAL_INDEX_CACHE_DIR):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.cache_dir = cache_dir
+
+    def get(self, name: str) -> Optional[bytes]:
+        try:
+            return s3_client.get_object(Bucket=self.bucket, Key=self.prefix + name)['Body'].read()
+        except Exception as e:
+            if not _is_missing(e):
+                raise
+            return None
+
+    def put(self, name: str, data: bytes) -> None:
+        s3_client.put_object(Bucket=self.bucket, Key=self.prefix + name, Body=data)
+
+    def put_if_unchanged(self, name: str, data: bytes, version: Optional[str]) -> None:
+        """Write only if the object is still at version (None: still absent); else IndexConflictError"""
+        condition = {'IfMatch': version} if version else {'IfNoneMatch': '*'}
+        try:
+            s3_client.put_object(Bucket=self.bucket, Key=self.prefix + name, Body=data, **condition)
+        except Exception as e:
+            if _error_code(e) in ('PreconditionFailed', '412', 'ConditionalRequestConflict', '409'):
+                raise IndexConflictError(f"{name} changed since version {version}")
+            raise
+
+    def delete(self, name: str) -> None:
+        s3_client.delete_object(Bucket=self.bucket, Key=self.prefix + name)
+
+    def list(self, prefix: str) -> List[str]:
+        return sorted(self.list_versions(prefix))
+
+    def list_versions(self, prefix: str) -> Dict[str, str]:
+        """{name: version} under prefix; the listing already carries ETags, so no HEAD per object"""
+        versions = {}
+        paginator = s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix + prefix):
+            versions.update((item['Key'][len(self.prefix):], item['ETag']) for item in page.get('Contents', []))
+        return versions
+
+    def version(self, name: str) -> Optional[str]:
+        try:
+            return s3_client.head_object(Bucket=self.bucket, Key=self.prefix + name)['ETag']
+        except Exception as e:
+            if not _is_missing(e):
+                raise
+            return None
+
+    def local_path(self, name: str) -> str:
+        """Download once into the container's /tmp; names are unique per build"""
+        path = os.path.join(self.cache_dir, name)
+        if not os.path.exists(path):
+            os.makedirs(self.cache_dir, exist_ok=True)
+            temp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            s3_client.download_file(self.bucket, self.prefix + name, temp)
+            os.replace(temp, path)
+        return path
+
+    def discard_local(self, name: str) -> None:
+        try:
+            os.remove(os.path.join(self.cache_dir, name))
+        except FileNotFoundError:
+            pass
+
+
+class LocalIndexStore:
+    def __init__(self, path: str):
+        self.path = path
+
+    def get(self, name: str) -> Optional[bytes]:
+        try:
+            with open(os.path.join(self.path, name), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, name: str, data: bytes) -> None:
+        # Write then rename so concurrent readers never see a partial file
+        target = os.path.join(self.path, name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        temp = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp, 'wb') as f:
+            f.write(data)
+        os.replace(temp, target)
+
+    def put_if_unchanged(self, name: str, data: bytes, version: Optional[str]) -> None:
+        """Write only if the file is still at version (None: still absent); else IndexConflictError
+
+        Checked under a process-wide lock; local stores are for single-process runs.
+        """
+        with _local_put_lock:
+            if self.version(name) != version:
+                raise IndexConflictError(f"{name} changed since version {version}")
+            self.put(name, data)
+
+    def delete(self, name: str) -> None:
+        try:
+            os.remove(os.path.join(self.path, name))
+        except FileNotFoundError:
+            pass
+
+    def list(self, prefix: str) -> List[str]:
+        return sorted(self.list_versions(prefix))
+
+    def list_versions(self, prefix: str) -> Dict[str, str]:
+        versions = {}
+        for root, _, files in os.walk(os.path.join(self.path, prefix)):
+            for f in files:
+                if not f.endswith('.tmp'):
+                    path = os.path.join(root, f)
+                    versions[os.path.relpath(path, self.path)] = str(os.stat(path).st_mtime_ns)
+        return versions
+
+    def version(self, name: str) -> Optional[str]:
+        try:
+            return str(os.stat(os.path.join(self.path, name)).st_mtime_ns)
+        except FileNotFoundError:
+            return None
+
+    def local_path(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def discard_local(self, name: str) -> None:
+        # local_path is the stored file itself
+        pass
+
+
+def store_for(bucket: str):
+    """KB_LOCAL_INDEX_DIR if set, else the uploads bucket"""
+    return LocalIndexStore(KB_LOCAL_INDEX_DIR) if KB_LOCAL_INDEX_DIR else S3IndexStore(bucket)
+
+
+def _npy_bytes(vectors) -> bytes:
+    buffer = io.BytesIO()
+    np.save(buffer, vectors, allow_pickle=False)
+    return buffer.getvalue()
+
+
+def chunk_text(sections: Iterator[str], max_chars: int = KB_LOCAL_INDEX_CHUNK_CHARS) -> Iterator[str]:
+    """Split sections into chunks of at most about max_chars, breaking between lines"""
+    for section in sections:
+        parts, size = [], 0
+        for line in section.split('\n'):
+            while len(line) > max_chars:
+                # One very long line: hard-split it
+                if parts:
+                    yield '\n'.join(parts)
+                    parts, size = [], 0
+                yield line[:max_chars]
+                line = line[max_chars:]
+            if parts and size + len(line) > max_chars:
+                yield '\n'.join(parts)
+                parts, size = [], 0
+            if line.strip():
+                parts.append(line)
+                size += len(line) + 1
+        if parts:
+            yield '\n'.join(parts)
+
+
+def shard_name(document_uri: str) -> str:
+    """s3://bucket/knowledge-base/<path> -> shards/<path>"""
+    path = document_uri.split('/' + KB_DOCUMENT_PREFIX, 1)[-1]
+    return SHARD_DIR + path
+
+
+def kb_document_uris(bucket: str) -> Set[str]:
+    """s3:// URIs of every document under knowledge-base/ in the bucket"""
+    uris = set()
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=KB_DOCUMENT_PREFIX):
+        uris.update(f"s3://{bucket}/{item['Key']}" for item in page.get('Contents', []) if not item['Key'].endswith('/'))
+    return uris
+
+
+def index_document(store, document_uri: str, chunks: Iterator[str]) -> int:
+    """Embed a document's chunks and write them as a shard; returns the chunk count"""
+    texts = []
+    for text in chunks:
+        if len(texts) >= KB_LOCAL_INDEX_MAX_CHUNKS:
+            logger.warning(f"Local index: {document_uri} truncated at {KB_LOCAL_INDEX_MAX_CHUNKS} chunks")
+            break
+        texts.append(text)
+    name = shard_name(document_uri)
+    start = time.time()
+    if texts:
+        vectors = np.asarray(list(_embed_executor.map(titan_embed, texts)), dtype=np.float32)
+    else:
+        # An empty shard still records that the document is covered
+        vectors = np.zeros((0, EMBEDDING_DIMENSIONS), dtype=np.float32)
+    store.put(name + '.npy', _npy_bytes(vectors))
+    store.put(name + '.json', json.dumps({'uri': document_uri, 'chunks': texts}, ensure_ascii=False).encode('utf-8'))
+    store.delete(name + SKIPPED_SUFFIX)
+    logger.info(f"Local index: shard {name} | chunks: {len(texts)} | elapsed_ms: {(time.time() - start) * 1000:.0f}")
+    return len(texts)
+
+
+def mark_skipped(store, document_uri: str, reason: str) -> None:
+    """Record that a document could not be indexed so it does not hold the index incomplete
+
+    The document is simply absent from local results. backfill_local_index
+    tries it again, since a skipped document has no shard.
+    """
+    store.put(shard_name(document_uri) + SKIPPED_SUFFIX, json.dumps({
+        'uri': document_uri,
+        'reason': reason,
+        'skippedAt': datetime.utcnow().isoformat() + 'Z'
+    }, ensure_ascii=False).encode('utf-8'))
+
+
+def rebuild_index(store, bucket: str = '', attempts: int = REBUILD_ATTEMPTS) -> int:
+    """Merge every shard into one vectors file plus index.json; returns the chunk count
+
+    Shards whose version is unchanged since the previous build are copied
+    from the previous vectors file, so only new and rewritten shards are
+    downloaded. With a bucket, the index is also synced with its
+    knowledge-base/ documents: shards of deleted documents are removed, and
+    index.json is marked complete when every document has a shard or is
+    marked skipped. Rebuilds from several containers are serialized by a
+    conditional write of index.json; a rebuild that loses starts over so
+    that the shards it was not shown are merged too.
+    """
+    for attempt in range(1, attempts + 1):
+        try:
+            return _rebuild_once(store, bucket)
+        except IndexConflictError:
+            if attempt == attempts:
+                raise
+            logger.info(f"Local index: concurrent rebuild, retrying ({attempt}/{attempts})")
+
+
+def _shard_uri(bucket: str, shard: str) -> str:
+    return f"s3://{bucket}/{KB_DOCUMENT_PREFIX}{shard[len(SHARD_DIR):]}"
+
+
+def _previous_rows(store, previous: Dict[str, Any]):
+    """(shard entries, vectors) of the previous build, or ({}, None) if it cannot be reused"""
+    entries = previous.get('shards')
+    if not entries or previous.get('dimensions') != EMBEDDING_DIMENSIONS:
+        return {}, None
+    data = store.get(previous['vectors'])
+    if not data:
+        return {}, None
+    vectors = np.load(io.BytesIO(data), allow_pickle=False)
+    if vectors.shape != (len(previous['chunks']), EMBEDDING_DIMENSIONS):
+        return {}, None
+    return entries, vectors
+
+
+def _rebuild_once(store, bucket: str) -> int:
+    start = time.time()
+    # Read the version first: if index.json changes after this, the final write fails
+    version = store.version(INDEX_NAME)
+    previous = json.loads(store.get(INDEX_NAME) or b'{}')
+    listed = store.list_versions(SHARD_DIR)
+    shards = {name[:-len('.json')]: v for name, v in listed.items() if name.endswith('.json')}
+    skipped = {name[:-len(SKIPPED_SUFFIX)] for name in listed if name.endswith(SKIPPED_SUFFIX)}
+    # Listed after the shards, and documents are written before their shards,
+    # so a shard with no document here really is stale
+    documents = kb_document_uris(bucket) if bucket else None
+
+    if documents is not None:
+        for shard in sorted(set(shards) | skipped):
+            if _shard_uri(bucket, shard) not in documents:
+                logger.info(f"Local index: removing shard of deleted document {_shard_uri(bucket, shard)}")
+                for suffix in ('.npy', '.json', SKIPPED_SUFFIX):
+                    store.delete(shard + suffix)
+                shards.pop(shard, None)
+                skipped.discard(shard)
+
+    previous_entries, previous_vectors = _previous_rows(store, previous)
+    matrices, chunks, entries, covered = [], [], {}, set()
+    reused = 0
+    for shard, shard_version in sorted(shards.items()):
+        entry = previous_entries.get(shard)
+        if entry and entry['version'] == shard_version:
+            rows = slice(entry['start'], entry['start'] + entry['count'])
+            uri, vectors, shard_chunks = entry['uri'], previous_vectors[rows], previous['chunks'][rows]
+            reused += 1
+        else:
+            meta, data = store.get(shard + '.json'), store.get(shard + '.npy')
+            if not meta or not data:
+                # Shard being rewritten; the next rebuild picks it up
+                continue
+            meta = json.loads(meta)
+            vectors = np.load(io.BytesIO(data), allow_pickle=False)
+            if vectors.shape != (len(meta['chunks']), EMBEDDING_DIMENSIONS):
+                logger.warning(f"Local index: skipping malformed shard {shard}")
+                continue
+            uri, shard_chunks = meta['uri'], [{'uri': meta['uri'], 'text': text} for text in meta['chunks']]
+        entries[shard] = {'uri': uri, 'version': shard_version, 'start': len(chunks), 'count': len(shard_chunks)}
+        matrices.append(vectors)
+        chunks.extend(shard_chunks)
+        covered.add(uri)
+    if bucket:
+        covered.update(_shard_uri(bucket, shard) for shard in skipped)
+
+    complete = documents is not None and documents <= covered
+    vectors = np.concatenate(matrices) if matrices else np.zeros((0, EMBEDDING_DIMENSIONS), dtype=np.float32)
+    vectors_name = f"vectors-{uuid.uuid4().hex}.npy"
+    store.put(vectors_name, _npy_bytes(vectors))
+    try:
+        store.put_if_unchanged(INDEX_NAME, json.dumps({
+            'vectors': vectors_name,
+            'dimensions': EMBEDDING_DIMENSIONS,
+            'documents': len(entries),
+            'skipped': len(skipped),
+            'chunks': chunks,
+            'shards': entries,
+            'complete': complete,
+            'builtAt': datetime.utcnow().isoformat() + 'Z'
+        }, ensure_ascii=False).encode('utf-8'), version)
+    except IndexConflictError:
+        store.delete(vectors_name)
+        raise
+    if previous.get('vectors'):
+        store.delete(previous['vectors'])
+
+    logger.info(
+        f"Local index: rebuilt | documents: {len(entries)} | reused: {reused} | skipped: {len(skipped)} | "
+        f"chunks: {len(chunks)} | complete: {complete} | elapsed_ms: {(time.time() - start) * 1000:.0f}"
+    )
+    return len(chunks)
+
+
+class LocalVectorIndex:
+    """In-process nearest-neighbour search over the knowledge-base/ documents
+
+    The merged vectors are memory-mapped from /tmp (or KB_LOCAL_INDEX_DIR)
+    and scored with one matrix-vector product. search() returns results in
+    the shape of Bedrock's retrievalResults, or None when the index is
+    missing, not yet complete, or its best match is below the score
+    threshold, in which case the caller should ask Bedrock.
+
+    Only an index marked complete is trusted: one built while every
+    knowledge-base/ document had a shard or was marked skipped. Documents added outside the file
+    processor, or uploaded before the index existed, are covered once
+    file_processor's backfill_local_index has run.
+    """
+
+    def __init__(self, store=None, min_score: float = KB_LOCAL_INDEX_MIN_SCORE,
+                 check_seconds: float = KB_LOCAL_INDEX_CHECK_SECONDS, embed=titan_embed):
+        self.store = store
+        self.min_score = min_score
+        self.check_seconds = check_seconds
+        self.embed = embed
+        self.query_vectors = TTLCache(max_entries=QUERY_EMBEDDING_ENTRIES, ttl_seconds=QUERY_EMBEDDING_TTL_SECONDS)
+        self._vectors = None
+        self._vectors_name: Optional[str] = None
+        self._chunks: List[Dict[str, str]] = []
+        self._complete = False
+        self._version: Optional[str] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _refresh(self) -> None:
+        with self._lock:
+            if time.monotonic() - self._checked_at < self.check_seconds:
+                return
+            self._checked_at = time.monotonic()
+            version = self.store.version(INDEX_NAME)
+            if version == self._version:
+                return
+            previous = self._vectors_name
+            if version is None:
+                self._vectors, self._vectors_name, self._chunks, self._version = None, None, [], None
+                self._complete = False
+            else:
+                start = time.time()
+                meta = json.loads(self.store.get(INDEX_NAME))
+                vectors = np.load(self.store.local_path(meta['vectors']), mmap_mode='r', allow_pickle=False)
+                self._vectors, self._vectors_name, self._chunks, self._version = vectors, meta['vectors'], meta['chunks'], version
+                self._complete = bool(meta.get('complete'))
+                logger.info(
+                    f"Local index: loaded {len(self._chunks)} chunks from {meta['documents']} documents | "
+                    f"complete: {self._complete} | "
+                    f"elapsed_ms: {(time.time() - start) * 1000:.0f}"
+                )
+            if previous and previous != self._vectors_name:
+                # Open maps keep the old file readable until they are dropped
+                self.store.discard_local(previous)
+
+    def _query_vector(self, query: str):
+        key = normalize_query(query)
+        vector = self.query_vectors.get(key)
+        if vector is None:
+            vector = np.asarray(self.embed(query), dtype=np.float32)
+            self.query_vectors.set(key, vector)
+        return vector
+
+    def search(self, query: str, top_k: int = 5) -> Optional[List[Dict[str, Any]]]:
+        if self.store is None:
+            return None
+        try:
+            self._refresh()
+            vectors, chunks = self._vectors, self._chunks
+            if vectors is None or not chunks or not self._complete:
+                return None
+            start = time.time()
+            scores = vectors @ self._query_vector(query)
+            k = min(top_k, len(chunks))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+        except Exception as e:
+            logger.warning(f"Local index unavailable, using Bedrock retrieval: {e}")
+            return None
+
+        best = float(scores[top[0]])
+        elapsed_ms = (time.time() - start) * 1000
+        if best < self.min_score:
+            logger.info(f"Local index: miss (best score {best:.3f}) | elapsed_ms: {elapsed_ms:.1f}")
+            return None
+        logger.info(f"Local index: hit (best score {best:.3f}) | chunks: {len(chunks)} | elapsed_ms: {elapsed_ms:.1f}")
+        return [{
+            'content': {'text': chunks[i]['text']},
+            'location': {'type': 'S3', 's3Location': {'uri': chunks[i]['uri']}},
+            'score': float(scores[i])
+        } for i in top]
+
+
+@lazy_singleton
+def get_local_index() -> LocalVectorIndex:
+    """Per-container index for the S3_BUCKET knowledge base; disabled by KB_LOCAL_INDEX_ENABLED=false"""
+    bucket = os.environ.get('S3_BUCKET', '').replace('s3://', '')
+    if not KB_LOCAL_INDEX_ENABLED or not (bucket or KB_LOCAL_INDEX_DIR):
+        return LocalVectorIndex(store=None)
+    return LocalVectorIndex(store_for(bucket))
@@ -0,0 +1,40 @@
+# DynamoDB table for server-side chat sessions (recent messages + rolling summary)
+resource "aws_dynamodb_table" "sessions" {
+  name         = "${local.name_prefix}-sessions"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "sessionId"
+
+  attribute {
+    name = "sessionId"
+    type = "S"
+  }
+
+  ttl {
+    attribute_name = "expiresAt"
+    enabled        = true
+  }
+
+  point_in_time_recovery {
+    enabled = true
+  }
+
+  server_side_encryption {
+    enabled = true
+  }
+
+  tags = {
+    Name = "${local.name_prefix}-sessions"
+  }
+}
+
+resource "aws_ssm_parameter" "session_table_name" {
+  name  = "/genai/${var.environment}/session-table-name"
+  type  = "String"
+  value = aws_dynamodb_table.sessions.name
+
+  description = "DynamoDB table for chat sessions"
+
+  tags = {
+    Name = "${local.name_prefix}-session-table-name"
+  }
+}
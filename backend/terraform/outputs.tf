@@ -76,4 +76,10 @@ output "project_name" {
 output "stack_name" {
   description = "CloudFormation stack name for Serverless Framework reference"
   value       = "genai-terraform-${var.environment}"
-}
\ No newline at end of file
+}
+
+# DynamoDB outputs
+output "session_table_name" {
+  description = "Name of the DynamoDB chat session table"
+  value       = aws_dynamodb_table.sessions.name
+}
@@ -59,6 +59,18 @@ if command -v npx >/dev/null 2>&1; then
     du -sh node_modules/* 2>/dev/null | sort -hr | head -10
 fi
 
+# Python Lambda コールドスタート計測
+echo ""
+echo "🐍 Python Lambda コールドスタート"
+echo "-------------------------------"
+if command -v python3 >/dev/null 2>&1; then
+    mkdir -p bench-results
+    python3 backend/lambda/python/benchmarks/cold_start.py --runs 3 \
+        --output "bench-results/cold-start-$(git rev-parse --short HEAD 2>/dev/null || echo local).json"
+else
+    echo "python3 が見つかりません"
+fi
+
 echo ""
 echo "🎯 パフォーマンス最適化提案"
 echo "========================="
@@ -18,6 +18,8 @@ export function ChatInterface() {
   const [isLoading, setIsLoading] = useState(false)
   const [isStreaming, setIsStreaming] = useState(false)
   const [streamingMessageId, setStreamingMessageId] = useState<string | null>(null)
+  // One server-side session per conversation; the backend keeps the history
+  const [sessionId] = useState(() => generateId())
 
   const handleSendMessage = async (content: string, attachments: File[] = [], useStreaming = true) => {
     const userMessage: Message = {
@@ -59,12 +61,6 @@ export function ChatInterface() {
         }
       }
 
-      // Prepare chat history
-      const history = messages.map(msg => ({
-        role: msg.role,
-        content: msg.content
-      }))
-
       // Add file information to content if any files were uploaded
       let messageContent = content
       if (uploadedFiles.length > 0) {
@@ -85,8 +81,7 @@ export function ChatInterface() {
 
       const requestData = {
         message: messageContent,
-        history,
-        sessionId: generateId()
+        sessionId
       }
 
       if (useStreaming) {
@@ -1,6 +1,9 @@
 import { fetchAuthSession } from 'aws-amplify/auth';
 
 const API_BASE_URL = process.env.NEXT_PUBLIC_API_GATEWAY_URL;
+// Function URL of chatStreamResponse; frames arrive as they are generated.
+// Without it, /chat/stream on API Gateway delivers the whole response at once.
+const CHAT_STREAM_URL = process.env.NEXT_PUBLIC_CHAT_STREAM_URL || (API_BASE_URL && `${API_BASE_URL}/chat/stream`);
 
 interface ChatMessage {
   role: 'user' | 'assistant';
@@ -82,14 +85,20 @@ export async function sendChatMessage(request: ChatRequest): Promise<ChatRespons
   }
 }
 
+// Delta-only stream protocol: chunks carry `content` deltas with a `seq`
+// number and `checkpoint` events carry the accumulated text for resync.
+const STREAM_PROTOCOL_VERSION = 2;
+
 interface StreamEvent {
-  event: 'start' | 'chunk' | 'end' | 'error';
+  event: 'start' | 'chunk' | 'checkpoint' | 'tool_start' | 'tool_end' | 'end' | 'error';
   data: any;
 }
 
 interface StreamCallbacks {
   onStart?: (data: any) => void;
   onChunk?: (chunk: string, fullContent: string) => void;
+  onToolStart?: (tool: { id: string; name: string; input: any }) => void;
+  onToolEnd?: (tool: { id: string; name: string; status: string; durationMs: number; outputPreview: string }) => void;
   onEnd?: (message: any) => void;
   onError?: (error: string) => void;
 }
@@ -98,20 +107,20 @@ export async function sendChatMessageStream(
   request: ChatRequest, 
   callbacks: StreamCallbacks
 ): Promise<void> {
-  if (!API_BASE_URL) {
+  if (!CHAT_STREAM_URL) {
     throw new Error('API Gateway URL not configured');
   }
 
   try {
     const headers = await getAuthHeaders();
     
-    const response = await fetch(`${API_BASE_URL}/chat/stream`, {
+    const response = await fetch(CHAT_STREAM_URL, {
       method: 'POST',
       headers: {
         ...headers,
         'Cache-Control': 'no-cache',
       },
-      body: JSON.stringify(request),
+      body: JSON.stringify({ ...request, protocolVersion: STREAM_PROTOCOL_VERSION }),
     });
 
     if (!response.ok) {
@@ -122,6 +131,9 @@ export async function sendChatMessageStream(
       );
     }
 
+    let fullContent = '';
+    let lastSeq = 0;
+
     const reader = response.body?.getReader();
     const decoder = new TextDecoder();
 
@@ -129,37 +141,77 @@ export async function sendChatMessageStream(
       throw new Error('Failed to get response stream reader');
     }
 
+    const handleEvent = (event: StreamEvent) => {
+      switch (event.event) {
+        case 'start':
+          callbacks.onStart?.(event.data);
+          break;
+        case 'chunk':
+          if (event.data.fullContent !== undefined) {
+            // Legacy protocol
+            fullContent = event.data.fullContent;
+          } else {
+            if (event.data.seq !== lastSeq + 1) {
+              console.warn(`Stream gap: expected seq ${lastSeq + 1}, got ${event.data.seq}`);
+            }
+            fullContent += event.data.content;
+            lastSeq = event.data.seq;
+          }
+          callbacks.onChunk?.(event.data.content, fullContent);
+          break;
+        case 'checkpoint':
+          // Resync to the server's text, repairing any gap
+          fullContent = event.data.fullContent;
+          lastSeq = event.data.seq;
+          callbacks.onChunk?.('', fullContent);
+          break;
+        case 'tool_start':
+          callbacks.onToolStart?.(event.data);
+          break;
+        case 'tool_end':
+          callbacks.onToolEnd?.(event.data);
+          break;
+        case 'end':
+          callbacks.onEnd?.(event.data.message);
+          break;
+        case 'error':
+          callbacks.onError?.(event.data.error);
+          break;
+      }
+    };
+
+    const handleFrame = (frame: string) => {
+      const data = frame
+        .split('\n')
+        .filter(line => line.startsWith('data:'))
+        .map(line => line.replace(/^data: ?/, ''))
+        .join('\n');
+      if (!data) return;
+      try {
+        handleEvent(JSON.parse(data));
+      } catch (parseError) {
+        console.error('Failed to parse stream event:', parseError);
+      }
+    };
+
+    // Network reads do not align with SSE frames; keep the trailing partial
+    // frame until the blank line that ends it arrives
+    let buffer = '';
+
     try {
       while (true) {
         const { done, value } = await reader.read();
         
         if (done) break;
 
-        const chunk = decoder.decode(value, { stream: true });
-        const lines = chunk.split('\n').filter(line => line.trim());
-
-        for (const line of lines) {
-          try {
-            const event: StreamEvent = JSON.parse(line);
-            
-            switch (event.event) {
-              case 'start':
-                callbacks.onStart?.(event.data);
-                break;
-              case 'chunk':
-                callbacks.onChunk?.(event.data.content, event.data.fullContent);
-                break;
-              case 'end':
-                callbacks.onEnd?.(event.data.message);
-                break;
-              case 'error':
-                callbacks.onError?.(event.data.error);
-                break;
-            }
-          } catch (parseError) {
-            console.error('Failed to parse stream event:', parseError);
-          }
-        }
+        buffer += decoder.decode(value, { stream: true });
+        const frames = buffer.split('\n\n');
+        buffer = frames.pop() ?? '';
+        frames.forEach(handleFrame);
+      }
+      buffer += decoder.decode();
+      if (buffer.trim()) {
+        handleFrame(buffer);
       }
     } finally {
       reader.releaseLock();